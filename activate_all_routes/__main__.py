@@ -1,40 +1,42 @@
 import cloudshell.helpers.scripts.cloudshell_scripts_helpers as cs_helper
-from cloudshell.api.common_cloudshell_api import CloudShellAPIError
+from sandbox_orch_plugins import RouteTable, RouteBatcher
 
-bi_dir = []
-uni_dir = []
+ROUTE_CHUNK_SIZE = 100  # routes per ConnectRoutesInReservation call, 0 sends all routes of a type in one call
+ROUTES_IN_FLIGHT = 2  # chunks connected at the same time
+RECONCILE_ROUTES = True  # skip the routes ActiveRoutesInfo already lists as active, False connects every route
 
 res_id = cs_helper.get_reservation_context_details().id
-route_details = cs_helper.get_api_session().GetReservationDetails(res_id).ReservationDescription.TopologiesRouteInfo
-w2output = cs_helper.get_api_session().WriteMessageToReservationOutput
+api = cs_helper.get_api_session()
+reservation = api.GetReservationDetails(res_id).ReservationDescription
+route_details = reservation.TopologiesRouteInfo
+w2output = api.WriteMessageToReservationOutput
 
 # build route lists
 # route lists used by the Route API are just are endpoints paired in an open list:
 # ['source1', 'target1', 'source2', 'target2', ... 'sourceN', 'targetN']
-for route in route_details:
-    for r in route.Routes:
-        if r.RouteType == 'bi':
-            bi_dir.append(r.Source)
-            bi_dir.append(r.Target)
-        if r.RouteType == 'uni':
-            uni_dir.append(r.Source)
-            uni_dir.append(r.Target)
+# the RouteBatcher builds these per chunk from the indexed route table
+# when reconciling, routes that are already active are left alone, so re-running after a partial failure only
+# sends the rest
+routes = RouteTable.from_topologies(route_details)
+bi_dir = routes.by_type('bi')
+uni_dir = routes.by_type('uni')
+if RECONCILE_ROUTES:
+    active = RouteTable.keys_of(reservation.ActiveRoutesInfo or [])
+    bi_dir = RouteTable.reconcile(bi_dir, active)
+    uni_dir = RouteTable.reconcile(uni_dir, active)
+batcher = RouteBatcher(api, res_id, chunk_size=ROUTE_CHUNK_SIZE, max_in_flight=ROUTES_IN_FLIGHT)
+
+if len(bi_dir) + len(uni_dir) < len(routes):
+    w2output(reservationId=res_id,
+             message='Skipping {} routes, already active'.format(len(routes) - len(bi_dir) - len(uni_dir)))
 
 # execute routes
 if len(bi_dir) > 0:
-    try:
-        w2output(reservationId=res_id,
-                 message='Queuing {} Bi-Dir routes for connection'.format(len(bi_dir)/2))
-        cs_helper.get_api_session().ConnectRoutesInReservation(reservationId=res_id, endpoints=bi_dir,
-                                                               mappingType='bi')
-    except CloudShellAPIError as err:
-        w2output(reservationId=res_id, message=err.message)
+    w2output(reservationId=res_id,
+             message='Queuing {} Bi-Dir routes for connection'.format(len(bi_dir)))
+    batcher.connect(bi_dir, 'bi', 'Bi-Dir routes')
 
 if len(uni_dir) > 0:
-    try:
-        w2output(reservationId=res_id,
-                 message='Queuing {} Uni-Dir routes for connection'.format(len(uni_dir)/2))
-        cs_helper.get_api_session().ConnectRoutesInReservation(reservationId=res_id, endpoints=uni_dir,
-                                                               mappingType='uni')
-    except CloudShellAPIError as err:
-        w2output(reservationId=res_id, message=err.message)
\ No newline at end of file
+    w2output(reservationId=res_id,
+             message='Queuing {} Uni-Dir routes for connection'.format(len(uni_dir)))
+    batcher.connect(uni_dir, 'uni', 'Uni-Dir routes')
@@ -0,0 +1,207 @@
+"""
+Benchmarks every plugin in sandbox_orch_plugins.py, plus the cable conversion, against the in-process mock API.
+Reports wall time and API call counts per scenario and topology size.
+The behaviour of the failure paths is asserted in checks.py, run it after changing a plugin.
+
+    python benchmarks --sizes 10 100 1000 --latency 0.002
+    python benchmarks/checks.py
+"""
+from argparse import ArgumentParser
+from json import dumps as json_dumps
+from time import time
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'sandbox_orch_plugin'))
+sys.path.insert(0, os.path.join(HERE, '..', 'cable_2_route'))
+
+from mock_cloudshell_api import MockCloudShellAPI, MockSandbox, MockTopology
+from sandbox_orch_plugins import SandboxOrchPlugins, AsyncSandboxOrchPlugins, SyncPluginFacade, \
+    RouteCommandHelper, ResourceCommandHelper, ServiceCommandHelper, READ_ONLY_API_PREFIXES
+from cable_2_route import ConvertCableToRoute
+
+
+def _plugins(args, **kwargs):
+    return SandboxOrchPlugins(route_chunk_size=args.route_chunk_size, routes_in_flight=args.routes_in_flight, **kwargs)
+
+
+def _async_plugins(args):
+    return SyncPluginFacade(AsyncSandboxOrchPlugins(route_chunk_size=args.route_chunk_size,
+                                                    routes_in_flight=args.routes_in_flight))
+
+
+def _activate_all(api):
+    for route in api.topology.routes:
+        api.ConnectRoutesInReservation(api.topology.reservation_id, [route.Source, route.Target], route.RouteType)
+
+
+def scenario_connect_all_routes(api, sandbox, args):
+    _plugins(args).connect_all_routes(sandbox, None)
+
+
+def scenario_connect_all_routes_switch_waves(api, sandbox, args):
+    _plugins(args, switch_waves=True).connect_all_routes(sandbox, None)
+
+
+def scenario_disconnect_all_routes(api, sandbox, args):
+    _plugins(args).disconnect_all_routes(sandbox, None)
+
+
+def scenario_connect_select_routes_by_type(api, sandbox, args):
+    _plugins(args).connect_select_routes_by_type(sandbox, RouteCommandHelper(route_type='bi'))
+
+
+def scenario_disconnect_select_routes_by_type(api, sandbox, args):
+    _plugins(args).disconnect_select_routes_by_type(sandbox, RouteCommandHelper(route_type='uni'))
+
+
+def scenario_connect_routes_by_device_type(api, sandbox, args):
+    _plugins(args).connect_routes_by_device_type(sandbox, RouteCommandHelper(device_family='Router'))
+
+
+def scenario_disconnect_routes_by_device_type(api, sandbox, args):
+    _plugins(args).disconnect_routes_by_device_type(sandbox, RouteCommandHelper(device_model='Arista EOS Router'))
+
+
+def scenario_wait_for_routes(api, sandbox, args):
+    plugins = _plugins(args)
+    plugins.connect_all_routes(sandbox, None)
+    if not plugins.wait_for_routes(sandbox, None):
+        raise RuntimeError('routes still down after {}s'.format(plugins.route_wait_timeout))
+
+
+def scenario_run_resource_command_on_all(api, sandbox, args):
+    _plugins(args).run_resource_command_on_all(sandbox, ResourceCommandHelper(
+        command_name='power_on', run_type='execute', max_concurrency=args.max_concurrency))
+
+
+def scenario_run_resource_command_on_select(api, sandbox, args):
+    _plugins(args).run_resource_command_on_select(sandbox, ResourceCommandHelper(
+        command_name='PowerCycle', device_family='Switch', run_type='execute', max_concurrency=args.max_concurrency))
+
+
+def scenario_run_resource_command_by_selector(api, sandbox, args):
+    _plugins(args).run_resource_command_on_select(sandbox, ResourceCommandHelper(
+        command_name='power_on', run_type='execute', max_concurrency=args.max_concurrency,
+        selector='family:Router,Switch !name:*0 attr.Location:"Rack 1"'))
+
+
+def scenario_run_service_command(api, sandbox, args):
+    _plugins(args).run_service_command(sandbox, ServiceCommandHelper(
+        command_name='start_traffic', service_name='Traffic Service', run_type='execute',
+        max_concurrency=args.max_concurrency))
+
+
+def scenario_run_service_command_by_pattern(api, sandbox, args):
+    _plugins(args).run_service_command(sandbox, ServiceCommandHelper(
+        command_name='start_traffic', service_name='*Service', run_type='execute',
+        max_concurrency=args.max_concurrency))
+
+
+def scenario_async_connect_routes_by_device_type(api, sandbox, args):
+    _async_plugins(args).connect_routes_by_device_type(sandbox, RouteCommandHelper(device_family='Router'))
+
+
+def scenario_async_run_resource_command_on_all(api, sandbox, args):
+    _async_plugins(args).run_resource_command_on_all(sandbox, ResourceCommandHelper(
+        command_name='power_on', run_type='execute', max_concurrency=args.max_concurrency))
+
+
+def scenario_convert_cable_to_route(api, sandbox, args):
+    ConvertCableToRoute(cs_session=api).convert_cable_to_route(sandbox.id)
+
+
+# (scenario, runs against a reservation with every route already active)
+SCENARIOS = [
+    (scenario_connect_all_routes, False),
+    (scenario_connect_all_routes_switch_waves, False),
+    (scenario_disconnect_all_routes, True),
+    (scenario_connect_select_routes_by_type, False),
+    (scenario_disconnect_select_routes_by_type, True),
+    (scenario_connect_routes_by_device_type, False),
+    (scenario_disconnect_routes_by_device_type, True),
+    (scenario_wait_for_routes, False),
+    (scenario_run_resource_command_on_all, False),
+    (scenario_run_resource_command_on_select, False),
+    (scenario_run_resource_command_by_selector, False),
+    (scenario_run_service_command, False),
+    (scenario_run_service_command_by_pattern, False),
+    (scenario_async_connect_routes_by_device_type, False),
+    (scenario_async_run_resource_command_on_all, False),
+    (scenario_convert_cable_to_route, False),
+]
+
+
+def run_scenario(scenario, pre_activate, size, args):
+    """
+    :param function scenario:
+    :param bool pre_activate: connect every route before the measurement
+    :param int size: resources & routes in the topology
+    :param args: parsed command line
+    :return: dict: measurement
+    """
+    topology = MockTopology(resources=size, routes=size, cables=size, services=max(1, size // 10), seed=size)
+    api = MockCloudShellAPI(topology, latency=args.latency, per_route_latency=args.per_route_latency,
+                            failure_rate=args.failure_rate, switch_latency=args.switch_latency,
+                            activation_delay=args.activation_delay)
+    sandbox = MockSandbox(api)
+    if pre_activate:
+        _activate_all(api)
+    api.reset_counts()
+
+    error = ''
+    stdout = sys.stdout
+    start = time()
+    try:
+        sys.stdout = open(os.devnull, 'w')  # ConvertCableToRoute prints per cable
+        scenario(api, sandbox, args)
+    except Exception as err:
+        error = '{}: {}'.format(type(err).__name__, err)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    wall = time() - start
+
+    reads = sum(count for method, count in api.calls.items() if method.startswith(READ_ONLY_API_PREFIXES))
+    return dict(size=size, scenario=scenario.__name__.replace('scenario_', ''), wall=round(wall, 4),
+                calls=sum(api.calls.values()), reads=reads, writes=sum(api.calls.values()) - reads,
+                by_method=dict(api.calls), error=error)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the sandbox plugins against the mock CloudShell API')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--scenarios', nargs='+', default=[], help='only run scenarios containing these names')
+    parser.add_argument('--latency', type=float, default=0.001, help='seconds per API call')
+    parser.add_argument('--per-route-latency', type=float, default=0.0, help='extra seconds per route in route calls')
+    parser.add_argument('--switch-latency', type=float, default=0.0,
+                        help='seconds per route on each L1 switch, serialized per switch')
+    parser.add_argument('--activation-delay', type=float, default=0.0,
+                        help='up to this many seconds before a connected route shows as active')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='0..1 chance of any API call failing')
+    parser.add_argument('--max-concurrency', type=int, default=1, help='ResourceCommandHelper max_concurrency')
+    parser.add_argument('--route-chunk-size', type=int, default=0)
+    parser.add_argument('--routes-in-flight', type=int, default=1)
+    parser.add_argument('--json', default='', help='also write the results, one JSON object per line, to this file')
+    args = parser.parse_args()
+
+    rows = []
+    print '{:>6}  {:<36} {:>9} {:>8} {:>8} {:>8}  {}'.format('size', 'scenario', 'wall(s)', 'calls', 'reads',
+                                                             'writes', 'error')
+    for size in args.sizes:
+        for scenario, pre_activate in SCENARIOS:
+            if args.scenarios and not any(name in scenario.__name__ for name in args.scenarios):
+                continue
+            row = run_scenario(scenario, pre_activate, size, args)
+            rows.append(row)
+            print '{size:>6}  {scenario:<36} {wall:>9.3f} {calls:>8} {reads:>8} {writes:>8}  {error}'.format(**row)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            for row in rows:
+                f.write(json_dumps(row, sort_keys=True) + '\n')
+
+
+main()
@@ -0,0 +1,318 @@
+"""
+Behaviour checks for the failure paths the benchmarks only time: route bisection & its limit, device selectors,
+route reconciliation, switch waves, the cable conversion fallback, the cable digest and the mail queue.
+Runs against the same in-process mock API, prints one line per check and exits non-zero if any fails.
+
+    python benchmarks/checks.py [names...]
+"""
+from json import dumps as json_dumps
+from tempfile import mkdtemp
+from time import time
+import logging
+import os
+import shutil
+import smtplib
+import socket
+import sys
+import traceback
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'sandbox_orch_plugin'))
+sys.path.insert(0, os.path.join(HERE, '..', 'cable_2_route'))
+sys.path.insert(0, os.path.join(HERE, '..', 'cable_requst_sandbox_script'))
+
+from mock_cloudshell_api import MockCloudShellAPI, MockInfo, MockSandbox, MockTopology
+from sandbox_orch_plugins import DeviceSelector, ResourceIndex, RouteBatcher, RouteRecord, RouteTable, \
+    SwitchWaveScheduler
+from cable_2_route import CONNECTION_WEIGHT, ConvertCableToRoute
+from cable_digest import CableDigest
+from mail_queue import CLAIM_SUFFIX, SPOOL_SUFFIX, MailQueue
+
+logging.getLogger('mail_queue').addHandler(logging.NullHandler())  # failed sends are expected here
+
+
+def _route_table(api):
+    return RouteTable.from_topologies(
+        api.GetReservationDetails(api.topology.reservation_id).ReservationDescription.TopologiesRouteInfo)
+
+
+def _batcher(api, **kwargs):
+    return RouteBatcher(api, api.topology.reservation_id, output=lambda reservationId, message: None, **kwargs)
+
+
+def _record(index, source, target, switches):
+    """
+    :param list str switches: L1 switches the route's Segments run through, in order
+    :return: RouteRecord
+    """
+    hops = [source] + ['{}/Port {}'.format(switch, index) for switch in switches] + [target]
+    segments = [MockInfo(Source=a, Target=b) for a, b in zip(hops, hops[1:])] if switches else []
+    return RouteRecord(index, MockInfo(Source=source, Target=target, RouteType='bi', Segments=segments))
+
+
+def check_bisection_isolates_broken_routes():
+    api = MockCloudShellAPI(MockTopology(resources=20, routes=96))
+    routes = _route_table(api).by_type('bi')
+    broken = [routes[5], routes[40]]
+    api.fail_endpoints = set(route.source for route in broken)
+
+    result = _batcher(api).connect(routes, 'bi')
+
+    assert [route.index for route in result.failed_routes] == [route.index for route in broken]
+    assert len(result.succeeded_routes) == len(routes) - len(broken)
+    assert all(len(chunk.routes) == 1 for chunk in result.chunks if chunk.error != '')
+    assert len(api.active_routes) == len(routes) - len(broken)
+
+
+def check_bisection_stops_when_every_call_fails():
+    api = MockCloudShellAPI(MockTopology(resources=20, routes=96), failure_rates={'ConnectRoutesInReservation': 1.0})
+    routes = _route_table(api).by_type('bi')
+
+    result = _batcher(api).connect(routes, 'bi')
+
+    assert not result
+    assert api.calls['ConnectRoutesInReservation'] == 3  # the chunk and its two halves
+    assert len(result.chunks) == 1 and len(result.failed_routes) == len(routes)
+
+
+def check_bisection_respects_the_isolation_limit():
+    api = MockCloudShellAPI(MockTopology(resources=20, routes=300))
+    routes = _route_table(api).by_type('bi')
+    broken = routes[::10]
+    api.fail_endpoints = set(route.source for route in broken)
+
+    result = _batcher(api, max_isolation_calls=8).connect(routes, 'bi')
+
+    assert api.calls['ConnectRoutesInReservation'] <= 1 + 8
+    failed = set(route.index for route in result.failed_routes)
+    assert failed.issuperset(route.index for route in broken)
+    assert len(failed) + len(result.succeeded_routes) == len(routes)
+    assert any(len(chunk.routes) > 1 for chunk in result.chunks if chunk.error != '')  # reported, not isolated
+
+
+def check_device_selector_parsing():
+    index = ResourceIndex.for_sandbox(MockSandbox(MockCloudShellAPI(MockTopology(resources=90))), refresh=True)
+    routers = [name for name in index.names() if name in index.by_family('Router')]
+
+    def names(text):
+        return index.select(DeviceSelector.parse(text))
+
+    assert names('family:router') == routers
+    assert names('!family:Router') == [name for name in index.names() if name not in routers]
+    assert names('family:Router,Switch model:"Arista*"') == routers
+    assert names('"Router 1"') == ['Router 1']
+    assert names('re:"^Router 1\\d$"') == [name for name in routers if name.startswith('Router 1') and len(name) == 9]
+    assert names('family:Router attr.Location:"Rack 1"') == [name for name in routers
+                                                              if int(name.split()[-1]) <= 40]
+    assert names('') == index.names()
+    for bad in ('family:', '!model:'):
+        try:
+            DeviceSelector.parse(bad)
+        except ValueError:
+            continue
+        raise AssertionError('{!r} parsed'.format(bad))
+
+
+def check_route_reconcile():
+    routes = RouteTable([RouteRecord(0, MockInfo(Source='A/1', Target='B/1', RouteType='bi')),
+                         RouteRecord(1, MockInfo(Source='A/2', Target='B/2', RouteType='uni')),
+                         RouteRecord(2, MockInfo(Source='A/3', Target='B/3', RouteType='bi'))])
+    # bi routes are active either way round, uni routes only in their own direction
+    active = RouteTable.keys_of([MockInfo(Source='B/1', Target='A/1', RouteType='bi'),
+                                 MockInfo(Source='B/2', Target='A/2', RouteType='uni')])
+
+    assert [route.index for route in RouteTable.reconcile(list(routes), active)] == [1, 2]
+    assert [route.index for route in RouteTable.reconcile(list(routes), active, connect=False)] == [0]
+    assert RouteTable.reconcile(list(routes), set(), connect=False) == []
+
+
+def check_switch_wave_grouping():
+    routes = [_record(0, 'A/1', 'B/1', ['S1']),
+              _record(1, 'A/2', 'B/2', ['S2']),
+              _record(2, 'A/3', 'B/3', ['S1', 'S3']),
+              _record(3, 'A/4', 'B/4', ['S3', 'S4']),
+              _record(4, 'A/5', 'B/5', ['S5', 'S6']),
+              _record(5, 'A/6', 'B/6', ['S1']),
+              _record(6, 'A/7', 'B/7', [])]
+
+    waves = SwitchWaveScheduler(None).plan(routes)
+
+    plan = [[(switches, [route.index for route in batch]) for switches, batch in wave] for wave in waves]
+    assert plan == [[(('S1',), [0, 5]), (('S2',), [1])],
+                    [(('S1', 'S3', 'S4'), [2, 3]), (('S5', 'S6'), [4]), ((), [6])]], plan
+
+
+def check_switch_waves_connect_every_route():
+    api = MockCloudShellAPI(MockTopology(resources=20, routes=300))
+    routes = _route_table(api).by_type('bi')
+    api.fail_endpoints = set([routes[7].source])
+
+    result = SwitchWaveScheduler(_batcher(api)).connect(routes, 'bi')
+
+    assert [route.index for route in result.failed_routes] == [routes[7].index]
+    assert sorted(route.index for route in result.succeeded_routes) == [route.index for route in routes[:7] +
+                                                                        routes[8:]]
+
+
+def check_cable_update_fallback():
+    api = MockCloudShellAPI(MockTopology(resources=6, routes=0), fail_endpoints=['X/1'])
+    cables = [MockInfo(Source='A/1', Target='B/1'), MockInfo(Source='B/1', Target='C/1'),
+              MockInfo(Source='D/1', Target='X/1'), MockInfo(Source='E/1', Target='F/1')]
+    converter = ConvertCableToRoute(cs_session=api)
+
+    # cables sharing a port, even through another cable, are updated one after another
+    assert [[cable.Source for cable in group] for group in converter._port_groups(cables)] == \
+        [['A/1', 'B/1'], ['D/1'], ['E/1']]
+
+    updated = converter._update_physical_connections(cables)
+
+    assert [cable.Source for cable in updated] == ['A/1', 'B/1', 'E/1']
+    assert api.calls['UpdatePhysicalConnections'] == 1 + len(cables)
+    assert len(converter.update_timings) == len(cables)
+    assert api.physical_connections['A/1'] == 'B/1' and api.physical_connections['C/1'] == 'B/1'
+    assert set(api.connection_weights.values()) == set([CONNECTION_WEIGHT])  # same weight on the fallback
+
+
+def check_cable_digest_dedupe():
+    folder = mkdtemp()
+    try:
+        digest = CableDigest(os.path.join(folder, 'digest.sqlite'), interval=3600)
+        assert digest.record('r1', 'alice', 'a@x', 'link1', [('A', 'B'), ('B', 'A')]) == 1
+        assert digest.record('r2', 'bob', 'b@x', 'link2', [('B', 'A'), ('C', 'D')]) == 1
+        assert digest.record('r1', 'alice', 'a@x', 'link1', [('A', 'B')]) == 0  # re-run of the same sandbox
+
+        due = digest.take_due()
+        assert [(cable['source'], cable['target']) for cable in due] == [('A', 'B'), ('C', 'D')]
+        assert sorted(each['reservation_id'] for each in due[0]['reservations']) == ['r1', 'r2']
+
+        assert digest.record('r3', 'carol', 'c@x', 'link3', [('A', 'B')]) == 0  # already mailed
+        assert digest.record('r3', 'carol', 'c@x', 'link3', [('E', 'F')]) == 1
+        assert digest.take_due() == []  # interval not over
+        assert [(cable['source'], cable['target']) for cable in digest.take_due(force=True)] == [('E', 'F')]
+        digest.close()
+    finally:
+        shutil.rmtree(folder)
+
+
+class _FakeSMTP(object):
+    """
+    smtplib.SMTP stand-in, failing the first sends as given
+    """
+    failures = []
+    sent = []
+
+    def __init__(self, host, port, timeout=None):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        if _FakeSMTP.failures:
+            raise _FakeSMTP.failures.pop(0)
+        _FakeSMTP.sent.append(message)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _spool(folder, name, message):
+    with open(os.path.join(folder, name), 'w') as f:
+        f.write(json_dumps({'sender': 'a', 'recipients': ['b'], 'message': message, 'attempts': 0, 'error': ''}))
+
+
+def check_mail_queue_claims():
+    folder = mkdtemp()
+    _FakeSMTP.failures, _FakeSMTP.sent = [], []
+    first = MailQueue('relay', spool_dir=folder, smtp_factory=_FakeSMTP)
+    second = MailQueue('relay', spool_dir=folder, smtp_factory=_FakeSMTP)
+    try:
+        now = int(time())
+        fresh = '1-a{}.{}-x{}'.format(SPOOL_SUFFIX, now, CLAIM_SUFFIX)
+        stale = '2-b{}.{}-y{}'.format(SPOOL_SUFFIX, now - 3600, CLAIM_SUFFIX)
+        _spool(folder, fresh, 'fresh')
+        _spool(folder, stale, 'stale')
+        _spool(folder, '3-c' + SPOOL_SUFFIX, 'spooled')
+
+        assert first.resume() == 2  # the fresh claim is left to its owner
+        # the other process queued the same messages: each one is still sent once
+        for name in (stale, '3-c' + SPOOL_SUFFIX):
+            second._queue.put(os.path.join(folder, name))
+        second._start()
+        assert first.flush(5) and second.flush(5)
+        assert sorted(_FakeSMTP.sent) == ['spooled', 'stale']
+        assert os.listdir(folder) == [fresh]
+    finally:
+        first.close(1)
+        second.close(1)
+        shutil.rmtree(folder)
+
+
+def check_mail_queue_retries():
+    folder = mkdtemp()
+    _FakeSMTP.sent = []
+    queue = MailQueue('relay', spool_dir=folder, smtp_factory=_FakeSMTP, max_attempts=3, base_delay=0.01)
+    try:
+
+        _FakeSMTP.failures = [socket.error('down'), smtplib.SMTPServerDisconnected('gone')]
+        queue.enqueue('a', ['b'], 'retried')
+        assert queue.flush(5)
+        assert _FakeSMTP.sent == ['retried'] and os.listdir(folder) == []
+
+        _FakeSMTP.failures = [socket.error('down')] * 3
+        kept = queue.enqueue('a', ['b'], 'kept')
+        assert queue.flush(5)
+        assert os.listdir(folder) == [os.path.basename(kept)]  # left spooled for the next run
+        os.remove(kept)
+
+        _FakeSMTP.failures = [smtplib.SMTPResponseException(550, 'no such user')]
+        rejected = queue.enqueue('a', ['b'], 'rejected')
+        assert queue.flush(5)
+        assert os.listdir(folder) == [os.path.basename(rejected) + '.failed']  # permanent, not retried
+        assert _FakeSMTP.sent == ['retried']
+    finally:
+        queue.close(1)
+        shutil.rmtree(folder)
+
+
+CHECKS = [
+    check_bisection_isolates_broken_routes,
+    check_bisection_stops_when_every_call_fails,
+    check_bisection_respects_the_isolation_limit,
+    check_device_selector_parsing,
+    check_route_reconcile,
+    check_switch_wave_grouping,
+    check_switch_waves_connect_every_route,
+    check_cable_update_fallback,
+    check_cable_digest_dedupe,
+    check_mail_queue_claims,
+    check_mail_queue_retries,
+]
+
+
+def main():
+    names = sys.argv[1:]
+    failed = 0
+    for check in CHECKS:
+        if names and not any(name in check.__name__ for name in names):
+            continue
+        stdout = sys.stdout
+        try:
+            sys.stdout = open(os.devnull, 'w')  # ConvertCableToRoute prints per cable
+            check()
+            error = ''
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print '{:<50} {}'.format(check.__name__.replace('check_', ''), 'FAIL' if error else 'ok')
+        if error:
+            failed += 1
+            print error
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
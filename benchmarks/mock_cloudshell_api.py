@@ -0,0 +1,355 @@
+from cloudshell.api.common_cloudshell_api import CloudShellAPIError
+from collections import Counter, OrderedDict
+from threading import Lock
+from time import sleep, time
+from uuid import uuid4
+import random
+
+FAMILIES = OrderedDict([('Router', 'Arista EOS Router'),
+                        ('Switch', 'Cisco NXOS Switch'),
+                        ('Traffic Generator', 'Ixia Chassis')])
+DRIVER_COMMANDS = ['health_check', 'load_firmware', 'power_on', 'power_off', 'restore', 'save']
+CONNECTED_COMMANDS = ['PowerCycle', 'PowerOff', 'PowerOn']
+SERVICE_COMMANDS = ['start_traffic', 'stop_traffic', 'configure_vlan']
+PORTS_PER_SWITCH = 96
+
+
+class MockInfo(object):
+    """
+    attribute bag standing in for the API's *Info response objects
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join('{}={!r}'.format(k, v)
+                                                                   for k, v in sorted(self.__dict__.items())))
+
+
+class MockTopology(object):
+    """
+    Synthetic reservation: devices of a few Families / Models, bi & uni routes between them running across
+    L1 switches, 'cable' requests and service instances
+    """
+    def __init__(self, resources=10, routes=10, cables=0, services=0, owner='admin', reservation_id=None,
+                 seed=0):
+        """
+        :param int resources: number of devices (L1 switches are added on top)
+        :param int routes: number of Topology routes, every third one is uni-directional
+        :param int cables: number of 'cable' requests in RequestedRoutesInfo
+        :param int services: number of service instances
+        :param str owner: reservation owner
+        :param str reservation_id: defaults to a new uuid
+        :param int seed: random seed for the layout
+        """
+        rand = random.Random(seed)
+        self.reservation_id = reservation_id or str(uuid4())
+        self.owner = owner
+        self.resources = OrderedDict()
+        self.switches = []
+        self.services = OrderedDict()
+        self.routes = []
+        self.cables = []
+        self.pdu_wired = set()
+        self.attributes = {}
+
+        families = list(FAMILIES.items())
+        for i in range(max(resources, 1)):
+            family, model = families[i % len(families)]
+            name = '{} {}'.format(family, i + 1)
+            self.resources[name] = MockInfo(Name=name, ResourceFamilyName=family, ResourceModelName=model,
+                                            FullAddress='10.0.{}.{}'.format(i // 250, i % 250 + 1),
+                                            VmDetails=None, Shared=False, Released=False, TopologyName='Topology')
+            self.attributes[name] = [MockInfo(Name='Location', Value='Rack {}'.format(i // 40 + 1)),
+                                     MockInfo(Name='Firmware', Value='v{}.{}'.format(rand.randint(1, 3),
+                                                                                     rand.randint(0, 9)))]
+            if i % 2 == 0:
+                self.pdu_wired.add(name)
+
+        for i in range(max(1, (routes * 2 + PORTS_PER_SWITCH - 1) // PORTS_PER_SWITCH)):
+            self.switches.append('L1 Switch {}'.format(i + 1))
+
+        devices = list(self.resources.keys())
+        port_count = Counter()
+        switch_port = [0]
+
+        def _next_port(device):
+            port_count[device] += 1
+            return '{}/Port {}'.format(device, port_count[device])
+
+        def _next_switch_port():
+            index = switch_port[0]
+            switch_port[0] += 1
+            return '{}/Blade 1/Port {}'.format(self.switches[(index // PORTS_PER_SWITCH) % len(self.switches)],
+                                               index % PORTS_PER_SWITCH + 1)
+
+        for i in range(routes):
+            source = _next_port(devices[i % len(devices)])
+            target = _next_port(devices[(i + 1 + rand.randrange(max(len(devices) - 1, 1))) % len(devices)])
+            hop_a, hop_b = _next_switch_port(), _next_switch_port()
+            self.routes.append(MockInfo(Source=source, Target=target, RouteType='uni' if i % 3 == 2 else 'bi',
+                                        Alias='Route {}'.format(i + 1), Shared=False, IsTap=False, Attributes=[],
+                                        Segments=[MockInfo(Source=source, Target=hop_a),
+                                                  MockInfo(Source=hop_a, Target=hop_b),
+                                                  MockInfo(Source=hop_b, Target=target)]))
+
+        for i in range(cables):
+            source = _next_port(devices[i % len(devices)])
+            target = _next_port(devices[(i + 1) % len(devices)])
+            self.cables.append(MockInfo(Source=source, Target=target, RouteType='cable', Alias='', Shared=False,
+                                        IsTap=False, Attributes=[], Segments=[]))
+
+        for i in range(services):
+            name = 'Traffic Service' if i % 2 == 0 else 'VLAN Service'
+            alias = '{} {}'.format(name, i + 1)
+            self.services[alias] = MockInfo(Alias=alias, ServiceName=name, Address='', Attributes=[])
+
+
+class MockCloudShellAPI(object):
+    """
+    In-process stand-in for the CloudShellAPISession calls used by the scripts in this repo.
+    Every call is counted, can be slowed down (latency) and can fail at random (failure_rate)
+    """
+    def __init__(self, topology, latency=0.0, latencies=None, per_route_latency=0.0, failure_rate=0.0,
+                 failure_rates=None, fail_endpoints=(), seed=0, switch_latency=0.0, activation_delay=0.0):
+        """
+        :param MockTopology topology:
+        :param float latency: seconds added to every call
+        :param dict latencies: per method latency, overrides latency
+        :param float per_route_latency: extra seconds per route for the route calls (L1 switch time)
+        :param float failure_rate: 0..1 chance of any call raising CloudShellAPIError
+        :param dict failure_rates: per method failure rate, overrides failure_rate
+        :param list str fail_endpoints: Connect / Disconnect / physical connection calls including any of these
+                                     endpoints fail
+        :param int seed: random seed for the failures
+        :param float switch_latency: seconds per route on every L1 switch its Segments use, each switch drives one
+                                     route at a time (calls on different switches overlap, calls on one don't)
+        :param float activation_delay: up to this many seconds (random per route) before a connected route
+                                       shows in ActiveRoutesInfo
+        """
+        self.topology = topology
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.per_route_latency = per_route_latency
+        self.failure_rate = failure_rate
+        self.failure_rates = failure_rates or {}
+        self.fail_endpoints = set(fail_endpoints)
+        self.calls = Counter()
+        self.messages = []
+        self.executed = []
+        self.active_routes = OrderedDict()
+        self.physical_connections = {}
+        self.connection_weights = {}  # port -> ConnectionWeight, None when the server picked it
+        self.ended = False
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self.switch_latency = switch_latency
+        self.activation_delay = activation_delay
+        self._active_at = {}
+        self._switch_locks = dict((switch, Lock()) for switch in topology.switches)
+        self._route_switches = {}
+        for route in topology.routes:
+            switches = sorted(set(endpoint.split('/')[0] for segment in route.Segments
+                                  for endpoint in (segment.Source, segment.Target)) & set(topology.switches))
+            self._route_switches[(route.Source, route.Target)] = switches
+            self._route_switches[(route.Target, route.Source)] = switches
+
+    def _call(self, method, routes=0):
+        """
+        counts the call, sleeps the injected latency and raises the injected failures
+        :param str method:
+        :param int routes: number of routes in the call
+        :return: None
+        """
+        with self._lock:
+            self.calls[method] += 1
+            fail = self._random.random() < self.failure_rates.get(method, self.failure_rate)
+
+        delay = self.latencies.get(method, self.latency) + self.per_route_latency * routes
+        if delay > 0:
+            sleep(delay)
+        if fail:
+            raise CloudShellAPIError(100, 'Injected failure in {}'.format(method), '')
+
+    def _drive_switches(self, endpoints):
+        """
+        sleeps switch_latency per route on each switch the routes use, holding the switch while it works
+        :param list str endpoints:
+        :return: None
+        """
+        if self.switch_latency <= 0:
+            return
+        per_switch = Counter()
+        for source, target in zip(endpoints[::2], endpoints[1::2]):
+            for switch in self._route_switches.get((source, target), ()):
+                per_switch[switch] += 1
+        for switch in sorted(per_switch):
+            with self._switch_locks[switch]:
+                sleep(self.switch_latency * per_switch[switch])
+
+    def _check_endpoints(self, endpoints):
+        bad = self.fail_endpoints.intersection(endpoints)
+        if bad:
+            raise CloudShellAPIError(100, 'Failed to route {}'.format(', '.join(sorted(bad))), '')
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls = Counter()
+
+    # -- reservations
+    def GetReservationDetails(self, reservationId=''):
+        self._call('GetReservationDetails')
+        topo = self.topology
+        with self._lock:
+            now = time()
+            active = [route for key, route in self.active_routes.items() if self._active_at.get(key, 0) <= now]
+        return MockInfo(ReservationDescription=MockInfo(
+            Id=topo.reservation_id, Name='Mock Reservation', Owner=topo.owner,
+            ActualEndTime='' if not self.ended else '01/01/2018 00:00',
+            Status='Started', ProvisioningStatus='Ready',
+            Resources=list(topo.resources.values()),
+            Services=list(topo.services.values()),
+            Apps=[],
+            TopologiesRouteInfo=[MockInfo(TopologyName='Topology', Routes=list(topo.routes))],
+            RequestedRoutesInfo=list(topo.routes) + list(topo.cables),
+            ActiveRoutesInfo=active))
+
+    def GetCurrentReservations(self, reservationOwner=''):
+        self._call('GetCurrentReservations')
+        return MockInfo(Reservations=[MockInfo(Id=self.topology.reservation_id, Owner=self.topology.owner,
+                                               Name='Mock Reservation')] if not self.ended else [])
+
+    def WriteMessageToReservationOutput(self, reservationId='', message=''):
+        self._call('WriteMessageToReservationOutput')
+        with self._lock:
+            self.messages.append(message)
+
+    def GetUserDetails(self, username=''):
+        self._call('GetUserDetails')
+        return MockInfo(Name=username, Email='{}@example.com'.format(username))
+
+    # -- resources & commands
+    def GetResourceDetails(self, resourceFullPath='', showAllDomains=False):
+        self._call('GetResourceDetails')
+        resource = self.topology.resources.get(resourceFullPath.split('/')[0])
+        if resource is None:
+            raise CloudShellAPIError(100, "Resource '{}' not found".format(resourceFullPath), '')
+        return MockInfo(Name=resource.Name, ResourceFamilyName=resource.ResourceFamilyName,
+                        ResourceModelName=resource.ResourceModelName, FullAddress=resource.FullAddress,
+                        ResourceAttributes=self.topology.attributes.get(resource.Name, []), ChildResources=[])
+
+    def GetResourceCommands(self, resourceFullPath=''):
+        self._call('GetResourceCommands')
+        return MockInfo(Commands=[MockInfo(Name=name, Tag='', Parameters=[]) for name in DRIVER_COMMANDS])
+
+    def GetResourceConnectedCommands(self, resourceFullPath=''):
+        self._call('GetResourceConnectedCommands')
+        names = CONNECTED_COMMANDS if resourceFullPath in self.topology.pdu_wired else []
+        return MockInfo(Commands=[MockInfo(Name=name, Tag='power', Parameters=[]) for name in names])
+
+    def GetServiceCommands(self, serviceName=''):
+        self._call('GetServiceCommands')
+        return MockInfo(Commands=[MockInfo(Name=name, Tag='', Parameters=[]) for name in SERVICE_COMMANDS])
+
+    def ExecuteCommand(self, reservationId='', targetName='', targetType='', commandName='', commandInputs=[],
+                       printOutput=False):
+        self._call('ExecuteCommand')
+        with self._lock:
+            self.executed.append((targetType, targetName, commandName))
+        return MockInfo(Output='')
+
+    def EnqueueCommand(self, reservationId='', targetName='', targetType='', commandName='', commandInputs=[],
+                       printOutput=False):
+        self._call('EnqueueCommand')
+        with self._lock:
+            self.executed.append((targetType, targetName, commandName))
+
+    def ExecuteResourceConnectedCommand(self, reservationId='', resourceFullPath='', commandName='', commandTag='',
+                                        parameterValues=[], connectedPortsFullPath=[], printOutput=False):
+        self._call('ExecuteResourceConnectedCommand')
+        with self._lock:
+            self.executed.append(('Connected', resourceFullPath, commandName))
+        return MockInfo(Output='')
+
+    # -- routes
+    def ConnectRoutesInReservation(self, reservationId='', endpoints=[], mappingType=''):
+        self._call('ConnectRoutesInReservation', len(endpoints) // 2)
+        self._check_endpoints(endpoints)
+        self._drive_switches(endpoints)
+        with self._lock:
+            for source, target in zip(endpoints[::2], endpoints[1::2]):
+                self.active_routes[(source, target)] = MockInfo(Source=source, Target=target, RouteType=mappingType,
+                                                                Segments=[])
+                if self.activation_delay > 0:
+                    self._active_at[(source, target)] = time() + self._random.random() * self.activation_delay
+        return MockInfo(Routes=[])
+
+    def DisconnectRoutesInReservation(self, reservationId='', endpoints=[]):
+        self._call('DisconnectRoutesInReservation', len(endpoints) // 2)
+        self._check_endpoints(endpoints)
+        self._drive_switches(endpoints)
+        with self._lock:
+            for source, target in zip(endpoints[::2], endpoints[1::2]):
+                self.active_routes.pop((source, target), None)
+                self.active_routes.pop((target, source), None)
+
+    def RemoveRoutesFromReservation(self, reservationId='', endpoints=[], mappingType=''):
+        self._call('RemoveRoutesFromReservation', len(endpoints) // 2)
+        removed = set(zip(endpoints[::2], endpoints[1::2]))
+        with self._lock:
+            self.topology.cables = [c for c in self.topology.cables if (c.Source, c.Target) not in removed]
+
+    def AddRoutesToReservation(self, reservationId='', sourceResourcesFullPath=[], targetResourcesFullPath=[],
+                               mappingType='', maxHops=0, routeAlias='', isShared=False):
+        self._call('AddRoutesToReservation', len(sourceResourcesFullPath))
+        with self._lock:
+            for source, target in zip(sourceResourcesFullPath, targetResourcesFullPath):
+                self.topology.routes.append(MockInfo(Source=source, Target=target, RouteType=mappingType,
+                                                     Alias=routeAlias, Shared=isShared, IsTap=False, Attributes=[],
+                                                     Segments=[]))
+        return MockInfo(Routes=[])
+
+    def UpdatePhysicalConnection(self, resourceAFullPath='', resourceBFullPath='', overrideExistingConnections=True):
+        self._call('UpdatePhysicalConnection')
+        self._check_endpoints([resourceAFullPath, resourceBFullPath])
+        with self._lock:
+            self.physical_connections[resourceAFullPath] = resourceBFullPath
+            self.physical_connections[resourceBFullPath] = resourceAFullPath
+            self.connection_weights[resourceAFullPath] = None
+            self.connection_weights[resourceBFullPath] = None
+
+    def UpdatePhysicalConnections(self, physicalConnectionUpdateRequest=[], overrideExistingConnections=True):
+        self._call('UpdatePhysicalConnections', len(physicalConnectionUpdateRequest))
+        self._check_endpoints([endpoint for request in physicalConnectionUpdateRequest
+                               for endpoint in (request.ResourceAFullName, request.ResourceBFullName)])
+        with self._lock:
+            for request in physicalConnectionUpdateRequest:
+                self.physical_connections[request.ResourceAFullName] = request.ResourceBFullName
+                self.physical_connections[request.ResourceBFullName] = request.ResourceAFullName
+                self.connection_weights[request.ResourceAFullName] = request.ConnectionWeight
+                self.connection_weights[request.ResourceBFullName] = request.ConnectionWeight
+
+
+class MockComponents(object):
+    def __init__(self, topology):
+        """
+        :param MockTopology topology:
+        """
+        self.resources = OrderedDict(topology.resources)
+        self.services = OrderedDict(topology.services)
+        self.apps = {}
+
+
+class MockSandbox(object):
+    """
+    The parts of cloudshell.workflow.orchestration.sandbox.Sandbox the plugins use
+    """
+    def __init__(self, api):
+        """
+        :param MockCloudShellAPI api:
+        """
+        self.automation_api = api
+        self.id = api.topology.reservation_id
+        self.name = 'Mock Reservation'
+        self.components = MockComponents(api.topology)
+        self.reservationContextDetails = MockInfo(id=self.id, owner_user=api.topology.owner, domain='Global')
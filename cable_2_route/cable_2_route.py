@@ -1,16 +1,49 @@
 import cloudshell.api.cloudshell_api as cs_api
 from cloudshell.api.common_cloudshell_api import CloudShellAPIError
-from json import loads as json_loads
+from argparse import ArgumentParser
+from json import dumps as json_dumps, loads as json_loads
 from base64 import b64decode
-from time import strftime
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from time import sleep, strftime, time
+import os
+import sys
+from orch_helpers import JsonFileStore, ReservationOutputWriter
+
+BULK_BATCH_SIZE = 50  # cables converted per bulk Remove / Add / Connect call, 1 converts cable by cable
+CONVERSION_STEPS = ['remove', 'update', 'add', 'connect']
+SLOWEST_UPDATES_SHOWN = 5  # per-cable timings printed after a per-cable update phase, all of them are in update_timings
+RESERVATION_WORKERS = 4  # Sandboxes converted at the same time in batch mode
+UPDATE_WORKERS = 10  # concurrent per-cable updates after a failed bulk update, cables sharing a port run in order
+# weight of every physical connection written. UpdatePhysicalConnection can't set one, so single cables go through
+# UpdatePhysicalConnections too, and a cable gets the same weight whether or not its batch's bulk update worked
+CONNECTION_WEIGHT = '10'
+WATCH_STATE_KEY = 'cable_watcher'
+WATCH_MIN_INTERVAL = 10  # seconds between polls while cable requests keep showing up
+WATCH_MAX_INTERVAL = 300  # seconds between polls once nothing has changed for a while
+WATCH_DETAILS_PER_POLL = 20  # GetReservationDetails calls per poll, however many Sandboxes are active
+WATCH_MAX_ATTEMPTS = 3  # conversions tried per cable before the watcher leaves it for the user
 
 
 class ConvertCableToRoute(object):
 
-    def __init__(self):
-        self.json_file_path = './configs.json'  # manually set this
-        self.configs = json_loads(open(self.json_file_path).read())
-        self.cs_session = self._start_cloudshell_session()
+    def __init__(self, cs_session=None, batch_size=BULK_BATCH_SIZE, update_workers=UPDATE_WORKERS):
+        """
+        :param CloudShellAPISession cs_session: existing session to use, otherwise one is opened from configs.json
+        :param int batch_size: cables per bulk conversion call, 1 converts cable by cable
+        :param int update_workers: concurrent per-cable physical connection updates
+        """
+        self.batch_size = max(batch_size, 1)
+        self.update_workers = max(update_workers, 1)
+        self.batch_update_timings = []  # (cables, seconds) per bulk UpdatePhysicalConnections call
+        self.update_timings = []  # (cable, seconds) per single cable update, in completion order per group
+
+        if cs_session is None:
+            self.json_file_path = './configs.json'  # manually set this
+            self.configs = json_loads(open(self.json_file_path).read())
+            self.cs_session = self._start_cloudshell_session()
+        else:
+            self.cs_session = cs_session
 
         if self.cs_session:
             self.w2output = self.cs_session.WriteMessageToReservationOutput
@@ -26,97 +59,559 @@ class ConvertCableToRoute(object):
             print ' {}'.format(e.message)
             return None
 
-    def check_id(self, id):
+    def get_reservation(self, id):
         """
-        verifies that a ID is a valid Sandbox
-        :param id:
-        :return:
+        fetches the reservation details once, so check_id & convert_cable_to_route can share them
+        :param str id: Sandbox ID
+        :return: ReservationDescriptionInfo or None if the ID could not be looked up
         """
-        sandbox_detail = None
-
         try:
-            sandbox_detail = self.cs_session.GetReservationDetails(id).ReservationDescription
+            return self.cs_session.GetReservationDetails(id).ReservationDescription
         except CloudShellAPIError as err:
             print err.message
+            return None
 
-        if sandbox_detail.ActualEndTime == '':
+    def check_id(self, id, sandbox_detail=None):
+        """
+        verifies that a ID is a valid Sandbox
+        :param str id: Sandbox ID
+        :param ReservationDescriptionInfo sandbox_detail: already fetched details, fetched from the API when None
+        :return: bool: True if the Sandbox is still active
+        """
+        if sandbox_detail is None:
+            sandbox_detail = self.get_reservation(id)
+
+        if sandbox_detail is not None and sandbox_detail.ActualEndTime == '':
             return True
         else:
             return False
 
-    def convert_cable_to_route(self, id):
+    def convert_cable_to_route(self, id, sandbox_detail=None):
         """
-
+        converts every 'cable' request in the sandbox to a bi-directional route, batch_size cables at a time
         :param str id: Unique ID for a CloudShell Sandbox (Active Reservation)
-        :return:
+        :param ReservationDescriptionInfo sandbox_detail: already fetched details, fetched from the API when None
+        :return: list RouteInfo converted: the cable requests that were converted
         """
-        full_route_details = self.cs_session.GetReservationDetails(id).ReservationDescription.RequestedRoutesInfo
+        if sandbox_detail is None:
+            sandbox_detail = self.cs_session.GetReservationDetails(id).ReservationDescription
+        con_list = self.cable_requests(sandbox_detail)
+
+        if len(con_list) > 0:
+            return self.convert_cables(id, con_list)
 
+        print 'No Cables to Convert - Please check your ID or validate on the Canvas'
+        return []
+
+    def convert_cables(self, id, con_list):
+        """
+        converts the given cable requests to bi-directional routes, batch_size cables at a time
+        :param str id: Sandbox ID
+        :param list RouteInfo con_list: cable requests of that Sandbox
+        :return: list RouteInfo converted: the cable requests that were converted
+        """
+        converted = []
+        update_seconds = []  # physical connection update time of each bulk batch
+        # output is buffered and written in a few multi-line calls, flushed when the conversion ends
+        with ReservationOutputWriter(self.cs_session, id) as w2output:
+            for start in range(0, len(con_list), self.batch_size):
+                batch = con_list[start:start + self.batch_size]
+                if len(batch) == 1:
+                    converted.extend(cable for cable in batch if self._convert_cable(id, cable, w2output))
+                else:
+                    converted.extend(self._convert_batch(id, batch, w2output, update_seconds))
+
+        if len(update_seconds) > 0:
+            print 'Physical Connection updates took {:.2f}s in total ({} batches)'.format(sum(update_seconds),
+                                                                                          len(update_seconds))
+        return converted
+
+    @staticmethod
+    def cable_requests(sandbox_detail):
+        """
+        :param ReservationDescriptionInfo sandbox_detail:
+        :return: list RouteInfo: the 'cable' requests, in canvas order
+        """
         con_list = []
-        for route in full_route_details:
+        for route in sandbox_detail.RequestedRoutesInfo:
             if route.RouteType == 'cable':
                 con_list.append(route)
+        return con_list
 
-        if len(con_list) > 0:
-            for each in con_list:
-                try:
-                    self.cs_session.RemoveRoutesFromReservation(reservationId=id,
-                                                                endpoints=[each.Source, each.Target],
-                                                                mappingType='bi')
-
-                    self.cs_session.UpdatePhysicalConnection(resourceAFullPath=each.Source,
-                                                             resourceBFullPath=each.Target,
-                                                             overrideExistingConnections=True)
-
-                    self.cs_session.AddRoutesToReservation(reservationId=id,
-                                                           sourceResourcesFullPath=[each.Source],
-                                                           targetResourcesFullPath=[each.Target],
-                                                           mappingType='bi')
-
-                    self.cs_session.ConnectRoutesInReservation(reservationId=id,
-                                                               endpoints=[each.Source, each.Target],
-                                                               mappingType='bi')
-
-                    print 'Converted Cable to Route:'
-                    print '  {} <---> {}'.format(each.Source, each.Target)
-
-                    self.w2output(reservationId=id, message='----------')
-                    self.w2output(reservationId=id, message=strftime('%Y-%m-%d %H:%M:%S'))
-                    self.w2output(reservationId=id, message='Converted Cable to Route')
-                    self.w2output(reservationId=id, message='  {} <---> {}'.format(each.Source, each.Target))
-                    self.w2output(reservationId=id, message='----------')
-
-                except CloudShellAPIError as err:
+    def convert_reservations(self, ids, max_workers=RESERVATION_WORKERS):
+        """
+        validates & converts many Sandboxes concurrently over this session,
+        fetching each Sandbox's details exactly once
+        :param list str ids: Sandbox IDs
+        :param int max_workers: Sandboxes converted at the same time
+        :return: list dict: one summary per ID, in the order given
+        """
+        ids = [id.strip() for id in ids if id.strip()]
+        if len(ids) == 0:
+            return []
+
+        pool = ThreadPool(min(max(max_workers, 1), len(ids)))
+        try:
+            return pool.map(self._convert_reservation, ids)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _convert_reservation(self, id):
+        """
+        :param str id: Sandbox ID
+        :return: dict: summary of the conversion
+        """
+        start = time()
+        summary = {'id': id, 'valid': False, 'cables': 0, 'converted': [], 'error': ''}
+        try:
+            sandbox_detail = self.get_reservation(id)
+            summary['valid'] = self.check_id(id, sandbox_detail)
+            if summary['valid']:
+                summary['cables'] = len(self.cable_requests(sandbox_detail))
+                converted = self.convert_cable_to_route(id, sandbox_detail)
+                summary['converted'] = ['{} <--> {}'.format(cable.Source, cable.Target) for cable in converted]
+            else:
+                summary['error'] = 'Invalid ID'
+        except Exception as err:
+            summary['error'] = '{}: {}'.format(type(err).__name__, getattr(err, 'message', '') or err)
+        summary['seconds'] = round(time() - start, 3)
+        return summary
+
+    def _convert_batch(self, id, batch, w2output, update_seconds=None):
+        """
+        converts a batch of cables with one Remove, Add & Connect call for the whole batch.
+        if one of those calls fails, the cables still in the batch are finished one by one from that step on
+        :param str id: Sandbox ID
+        :param list RouteInfo batch: cable requests
+        :param ReservationOutputWriter w2output:
+        :param list update_seconds: the batch's physical connection update time is appended to it
+        :return: list RouteInfo: converted cables
+        """
+        step = 'remove'
+        remaining = batch
+        try:
+            self.cs_session.RemoveRoutesFromReservation(reservationId=id,
+                                                        endpoints=self._endpoints(remaining),
+                                                        mappingType='bi')
+            step = 'update'
+            start = time()
+            remaining = self._update_physical_connections(remaining)
+            if update_seconds is not None:
+                update_seconds.append(time() - start)
+            if len(remaining) == 0:
+                return []
+
+            step = 'add'
+            self.cs_session.AddRoutesToReservation(reservationId=id,
+                                                   sourceResourcesFullPath=[cable.Source for cable in remaining],
+                                                   targetResourcesFullPath=[cable.Target for cable in remaining],
+                                                   mappingType='bi')
+            step = 'connect'
+            self.cs_session.ConnectRoutesInReservation(reservationId=id,
+                                                       endpoints=self._endpoints(remaining),
+                                                       mappingType='bi')
+        except CloudShellAPIError as err:
+            print 'Bulk {} failed for {} Cables, converting them one at a time'.format(step, len(remaining))
+            print err.message
+            return [cable for cable in remaining if self._convert_cable(id, cable, w2output, step)]
+
+        for cable in remaining:
+            self._report_conversion(id, cable, w2output)
+        return remaining
+
+    def _convert_cable(self, id, cable, w2output, from_step='remove'):
+        """
+        converts a single cable
+        :param str id: Sandbox ID
+        :param RouteInfo cable: cable request
+        :param ReservationOutputWriter w2output:
+        :param str from_step: first step to run, earlier steps were already done in bulk
+        :return: bool: True if converted
+        """
+        steps = CONVERSION_STEPS[CONVERSION_STEPS.index(from_step):]
+        try:
+            if 'remove' in steps:
+                self.cs_session.RemoveRoutesFromReservation(reservationId=id,
+                                                            endpoints=[cable.Source, cable.Target],
+                                                            mappingType='bi')
+
+            if 'update' in steps:
+                self._update_physical_connection(cable)
+
+            if 'add' in steps:
+                self.cs_session.AddRoutesToReservation(reservationId=id,
+                                                       sourceResourcesFullPath=[cable.Source],
+                                                       targetResourcesFullPath=[cable.Target],
+                                                       mappingType='bi')
+
+            self.cs_session.ConnectRoutesInReservation(reservationId=id,
+                                                       endpoints=[cable.Source, cable.Target],
+                                                       mappingType='bi')
+
+        except CloudShellAPIError as err:
+            print 'Unable to Complete Requested Connection'
+            print '{} <--> {}'.format(cable.Source, cable.Target)
+            print err.message
+            return False
+
+        self._report_conversion(id, cable, w2output)
+        return True
+
+    def _update_physical_connections(self, cables):
+        """
+        updates the physical connection of every cable with one UpdatePhysicalConnections call.
+        if the bulk call fails, each cable is updated on its own so one bad cable doesn't fail the rest,
+        in parallel across cables that share no port. overrideExistingConnections replaces whatever a port was
+        wired to, so cables sharing a port are updated one after another in request order
+        :param list RouteInfo cables:
+        :return: list RouteInfo: cables whose physical connection was updated, in request order
+        """
+        if len(cables) == 0:
+            return []
+
+        start = time()
+        try:
+            self._update_physical_connection(*cables)
+            duration = time() - start
+            self.batch_update_timings.append((len(cables), duration))
+            print 'Updated {} Physical Connections in {:.2f}s (1 bulk call)'.format(len(cables), duration)
+            return cables
+        except CloudShellAPIError as err:
+            print 'Bulk Physical Connection update failed for {} Cables, updating them one at a time'.format(
+                len(cables))
+            print err.message
+
+        groups = self._port_groups(cables)
+        start = time()
+        pool = ThreadPool(min(self.update_workers, len(groups)))
+        try:
+            results = pool.map(self._update_group, groups)
+        finally:
+            pool.close()
+            pool.join()
+        total = time() - start
+
+        updated = set()
+        timings = []
+        for group_results in results:
+            for cable, duration, error in group_results:
+                timings.append((cable, duration))
+                if error is None:
+                    updated.add(id(cable))
+                else:
                     print 'Unable to Complete Requested Connection'
-                    print '{} <--> {}'.format(each.Source, each.Target)
-                    print err.message
+                    print '{} <--> {}'.format(cable.Source, cable.Target)
+                    print error
+
+        self.update_timings.extend(timings)
+        print 'Updated {}/{} Physical Connections in {:.2f}s ({} groups, {} workers)'.format(
+            len(updated), len(cables), total, len(groups), min(self.update_workers, len(groups)))
+        for cable, duration in sorted(timings, key=lambda timing: timing[1], reverse=True)[:SLOWEST_UPDATES_SHOWN]:
+            print '  {:.3f}s  {} <--> {}'.format(duration, cable.Source, cable.Target)
+
+        return [cable for cable in cables if id(cable) in updated]
+
+    def _update_group(self, group):
+        """
+        :param list RouteInfo group: cables sharing ports, updated in order
+        :return: list tuple: (cable, seconds, error message or None) per cable
+        """
+        results = []
+        for cable in group:
+            start = time()
+            try:
+                self._update_physical_connection(cable)
+                error = None
+            except CloudShellAPIError as err:
+                error = err.message
+            results.append((cable, time() - start, error))
+        return results
+
+    @staticmethod
+    def _port_groups(cables):
+        """
+        splits cables into groups that share no port with each other,
+        two cables are in the same group when they are linked through any chain of shared ports
+        :param list RouteInfo cables:
+        :return: list list RouteInfo: groups, each in request order
+        """
+        parent = {}
+
+        def find(port):
+            while parent[port] != port:
+                parent[port] = parent[parent[port]]
+                port = parent[port]
+            return port
+
+        for cable in cables:
+            for port in (cable.Source, cable.Target):
+                parent.setdefault(port, port)
+            parent[find(cable.Source)] = find(cable.Target)
+
+        groups = OrderedDict()
+        for cable in cables:
+            groups.setdefault(find(cable.Source), []).append(cable)
+        return groups.values()
+
+    def _update_physical_connection(self, *cables):
+        """
+        one UpdatePhysicalConnections call for the given cables, each written with CONNECTION_WEIGHT
+        :param RouteInfo cables:
+        :return: None
+        """
+        self.cs_session.UpdatePhysicalConnections(
+            physicalConnectionUpdateRequest=[cs_api.PhysicalConnectionUpdateRequest(cable.Source, cable.Target,
+                                                                                    CONNECTION_WEIGHT)
+                                             for cable in cables],
+            overrideExistingConnections=True)
+
+    def _report_conversion(self, id, cable, w2output):
+        """
+        :param str id: Sandbox ID
+        :param RouteInfo cable:
+        :param ReservationOutputWriter w2output:
+        :return: None
+        """
+        print 'Converted Cable to Route:'
+        print '  {} <---> {}'.format(cable.Source, cable.Target)
+
+        w2output(reservationId=id, message='----------')
+        w2output(reservationId=id, message=strftime('%Y-%m-%d %H:%M:%S'))
+        w2output(reservationId=id, message='Converted Cable to Route')
+        w2output(reservationId=id, message='  {} <---> {}'.format(cable.Source, cable.Target))
+        w2output(reservationId=id, message='----------')
+
+    @staticmethod
+    def _endpoints(cables):
+        """
+        :param list RouteInfo cables:
+        :return: list str: ['source1', 'target1', ... 'sourceN', 'targetN']
+        """
+        endpoints = []
+        for cable in cables:
+            endpoints.append(cable.Source)
+            endpoints.append(cable.Target)
+        return endpoints
+
+
+def _cable_key(cable):
+    """
+    :param RouteInfo cable:
+    :return: str: 'source<->target'
+    """
+    return '{}<->{}'.format(cable.Source, cable.Target)
+
+
+class CableWatcher(object):
+    """
+    Polls the active Sandboxes and converts new cable requests as they appear.
+
+    Every poll makes one GetCurrentReservations call and at most details_per_poll GetReservationDetails calls.
+    A Sandbox whose cable requests haven't changed is checked less and less often (its interval doubles up to
+    max_interval), so the API load stays flat as the number of Sandboxes grows.
+    What was seen & tried per Sandbox is kept in the state store, so a restarted watcher picks up where it left off.
+    """
+    def __init__(self, converter, store, min_interval=WATCH_MIN_INTERVAL, max_interval=WATCH_MAX_INTERVAL,
+                 details_per_poll=WATCH_DETAILS_PER_POLL, max_attempts=WATCH_MAX_ATTEMPTS):
+        """
+        :param ConvertCableToRoute converter:
+        :param JsonFileStore store: persists the per Sandbox state
+        :param float min_interval: seconds
+        :param float max_interval: seconds
+        :param int details_per_poll: upper bound on GetReservationDetails calls per poll
+        :param int max_attempts: conversions tried per cable
+        """
+        self.converter = converter
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.details_per_poll = max(details_per_poll, 1)
+        self.max_attempts = max_attempts
+        self.poll_interval = min_interval
+        self.state = store.get(WATCH_STATE_KEY) or {}  # Sandbox ID -> {'cables', 'failed', 'interval', 'next_check'}
+
+    def poll_once(self, now=None):
+        """
+        checks the Sandboxes that are due and converts their new cable requests
+        :param float now: current time, time() when None
+        :return: list dict: one event per Sandbox checked: id, cables, converted, failed
+        """
+        now = time() if now is None else now
+        active = [reservation.Id for reservation in
+                  self.converter.cs_session.GetCurrentReservations(reservationOwner='').Reservations]
+
+        changed = False
+        for id in list(self.state):
+            if id not in active:
+                del self.state[id]  # Sandbox ended
+                changed = True
+
+        # new Sandboxes (next_check 0) first, then the ones waiting the longest
+        due = sorted([id for id in active if self.state.get(id, {}).get('next_check', 0) <= now],
+                     key=lambda id: self.state.get(id, {}).get('next_check', 0))[:self.details_per_poll]
+
+        events = []
+        for id in due:
+            event = self._check(id, now)
+            events.append(event)
+            if event['new'] or event['converted']:
+                changed = True
+
+        if due or changed:
+            self.store.set(WATCH_STATE_KEY, self.state)
+
+        if changed:
+            self.poll_interval = self.min_interval
+        else:
+            self.poll_interval = min(self.poll_interval * 2, self.max_interval)
+        return events
+
+    def _check(self, id, now):
+        """
+        :param str id: Sandbox ID
+        :param float now:
+        :return: dict: event
+        """
+        entry = self.state.setdefault(id, {'cables': [], 'failed': {}, 'interval': self.min_interval})
+        event = {'id': id, 'cables': 0, 'new': 0, 'converted': [], 'failed': []}
+
+        sandbox_detail = self.converter.get_reservation(id)
+        if not self.converter.check_id(id, sandbox_detail):
+            entry['interval'] = self.max_interval
+            entry['next_check'] = now + entry['interval']
+            return event
+
+        cables = self.converter.cable_requests(sandbox_detail)
+        keys = [_cable_key(cable) for cable in cables]
+        seen = set(entry['cables'])
+        event['cables'] = len(cables)
+        event['new'] = len([key for key in keys if key not in seen])
+
+        # failures are only remembered while the request is still there, a re-drawn cable starts over
+        failed = dict((key, attempts) for key, attempts in entry['failed'].items() if key in keys)
+        pending = [cable for cable, key in zip(cables, keys) if failed.get(key, 0) < self.max_attempts]
+
+        if pending:
+            converted = set(_cable_key(cable) for cable in self.converter.convert_cables(id, pending))
+            for cable in pending:
+                key = _cable_key(cable)
+                if key in converted:
+                    event['converted'].append(key)
+                    failed.pop(key, None)
+                else:
+                    event['failed'].append(key)
+                    failed[key] = failed.get(key, 0) + 1
+
+        entry['cables'] = [key for key in keys if key not in event['converted']]
+        entry['failed'] = failed
+        if event['new'] or event['converted']:
+            entry['interval'] = self.min_interval
         else:
-            print 'No Cables to Convert - Please check your ID or validate on the Canvas'
+            entry['interval'] = min(entry['interval'] * 2, self.max_interval)
+        entry['next_check'] = now + entry['interval']
+        return event
+
+    def run(self, max_polls=0):
+        """
+        polls until interrupted, printing one JSON line per Sandbox that had cables
+        :param int max_polls: stop after this many polls, 0 runs forever
+        :return: None
+        """
+        polls = 0
+        while not max_polls or polls < max_polls:
+            for event in self.poll_once():
+                if event['cables']:
+                    print json_dumps(event, sort_keys=True)
+            polls += 1
+            if not max_polls or polls < max_polls:
+                sleep(self._next_sleep())
+
+    def _next_sleep(self):
+        """
+        :return: float: seconds until the next poll, never past the next Sandbox that is due
+        """
+        wait = self.poll_interval
+        next_checks = [entry.get('next_check', 0) for entry in self.state.values()]
+        if next_checks:
+            wait = min(wait, max(min(next_checks) - time(), self.min_interval))
+        return wait
+
+
+def _read_ids(args):
+    """
+    :param args: parsed command line
+    :return: list str: IDs from the arguments, then --file, then stdin
+    """
+    ids = list(args.ids)
+    if args.file:
+        with open(args.file) as f:
+            ids.extend(f.read().split())
+    if args.stdin:
+        ids.extend(sys.stdin.read().split())
+    return ids
 
 
 def main():
+    parser = ArgumentParser(description='Converts cable requests to routes. Prompts for IDs when none are given')
+    parser.add_argument('ids', nargs='*', help='Sandbox/Reservation IDs')
+    parser.add_argument('--file', default='', help='file of IDs, whitespace or newline separated')
+    parser.add_argument('--stdin', action='store_true', help='read IDs from stdin')
+    parser.add_argument('--workers', type=int, default=RESERVATION_WORKERS, help='Sandboxes converted at once')
+    parser.add_argument('--summary', default='', help='write the JSON lines summary here instead of stdout')
+    parser.add_argument('--watch', action='store_true', help='keep polling the active Sandboxes for new cables')
+    parser.add_argument('--state', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'cable_watcher_state.json'),
+                        help='--watch state file')
+    parser.add_argument('--min-interval', type=float, default=WATCH_MIN_INTERVAL)
+    parser.add_argument('--max-interval', type=float, default=WATCH_MAX_INTERVAL)
+    parser.add_argument('--details-per-poll', type=int, default=WATCH_DETAILS_PER_POLL)
+    args = parser.parse_args()
+
     local = ConvertCableToRoute()
 
-    stop = False
+    if not local.cs_session:
+        return
+
+    print 'Connected to CloudShell'
 
-    if local.cs_session:
-        print 'Connected to CloudShell'
+    if args.watch:
+        watcher = CableWatcher(local, JsonFileStore(args.state), min_interval=args.min_interval,
+                               max_interval=args.max_interval, details_per_poll=args.details_per_poll)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            print '-- Ending'
+        return
 
-        while not stop:
-            print "\nPlease Enter Sandbox/Reservation ID, or 'exit' to end"
-            user_input = raw_input('ID: ')
+    ids = _read_ids(args)
+    if ids:
+        summaries = local.convert_reservations(ids, max_workers=args.workers)
+        lines = [json_dumps(summary, sort_keys=True) for summary in summaries]
+        if args.summary:
+            with open(args.summary, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        else:
+            print '\n'.join(lines)
+        return
 
-            if user_input.upper() == 'EXIT' or user_input == '0':
-                stop = True
-            else:
-                id_check = local.check_id(user_input.strip())
+    stop = False
+    while not stop:
+        print "\nPlease Enter Sandbox/Reservation ID, or 'exit' to end"
+        user_input = raw_input('ID: ')
 
-                if id_check:
-                    local.convert_cable_to_route(user_input.strip())
-                else:
-                    print 'Invalid ID'
+        if user_input.upper() == 'EXIT' or user_input == '0':
+            stop = True
+        else:
+            sandbox_detail = local.get_reservation(user_input.strip())
+
+            if local.check_id(user_input.strip(), sandbox_detail):
+                local.convert_cable_to_route(user_input.strip(), sandbox_detail)
+            else:
+                print 'Invalid ID'
 
-        print '-- Ending'
+    print '-- Ending'
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,22 @@
+from json import dumps as json_dumps
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
 from cable_2_route import ConvertCableToRoute
+from mock_cloudshell_api import MockCloudShellAPI, MockTopology
 
-unit = ConvertCableToRoute()
-test_id = '10fd2bd9-0c53-49ba-9967-ea889bef36bb'
+# runs against the in-process mock API, with a synthetic reservation holding 5 cable requests
+topology = MockTopology(resources=10, routes=10, cables=5)
+session = MockCloudShellAPI(topology)
+unit = ConvertCableToRoute(cs_session=session)
+test_id = topology.reservation_id
 
 if unit.cs_session:
-    if unit.check_id(test_id):
-        unit.convert_cable_to_route(test_id)
-    else:
-        print 'Invalid ID'
+    for summary in unit.convert_reservations([test_id]):
+        print json_dumps(summary, sort_keys=True)
+    print 'API calls: {}'.format(dict(session.calls))
+    print 'Cables left: {}'.format(len(topology.cables))
 else:
-    'No valid session to CloudShell -- Exit'
+    print 'No valid session to CloudShell -- Exit'
@@ -1,35 +1,17 @@
 from cloudshell.helpers.scripts import cloudshell_dev_helpers as dev_helper
 from cloudshell.workflow.orchestration.sandbox import Sandbox
 from base64 import b64decode
-import smtplib
-from email.mime.text import MIMEText
-from cloudshell.core.logger import qs_logger
 from time import strftime
+from cable_digest import CableDigest, DIGEST_INTERVAL
+from cable_request_mail import send_due_digest, send_email
+from orch_helpers import ReservationOutputWriter
 
-SMTP_USER = 'no-reply@acmeco.com'
-SMTP_MAIL_LIST = 'user1@acmeco.com;user2@acmeco.com'
-SMTP_SERVER = 'mail-relay.acmeco.com'
-SMTP_PORT = 25
 HTTP_PREFIX = 'cloudshell.lab.acmeco.com:8080/RM/Diagram/Index/'  # portal address
 HTTP_SECURE = False
-
-
-def send_email(subject='', message=''):
-
-    msg = MIMEText(message)
-    msg['Subject'] = subject
-    msg['From'] = SMTP_USER
-    msg['To'] = SMTP_MAIL_LIST
-
-    try:
-        s = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        s.sendmail(SMTP_USER, SMTP_MAIL_LIST, msg.as_string())
-        s.quit()
-    except Exception as e:
-        logger = qs_logger.get_qs_logger()
-        logger.warning('Unable to send email message')
-        logger.warning(e.message)
-        logger.warning(message)
+# True: requests are only recorded, and one consolidated email for all sandboxes goes out per DIGEST_INTERVAL.
+# Either way schedule send_cable_digest.py on the execution server, it sends the digest and any mail this script
+# left spooled on exit (SMTP settings are in cable_request_mail.py)
+DIGEST_MODE = False
 
 
 def main():
@@ -50,7 +32,6 @@ def main():
 
     if len(cable_req) > 0:
         owner = sandbox.reservationContextDetails.owner_user
-        email = sandbox.automation_api.GetUserDetails(username=owner).Email
         subj = 'CloudShell Cable Request from {}'.format(owner)
         count = 0
 
@@ -62,6 +43,13 @@ def main():
         wedge += sandbox.id
         link = '<a href="{}">{}</a>'.format(wedge, sandbox.id)
 
+        if DIGEST_MODE:
+            _add_to_digest(sandbox, owner, wedge, cable_req)
+            _write_request_output(sandbox, cable_req)
+            return
+
+        email = sandbox.automation_api.GetUserDetails(username=owner).Email
+
         msg = str()
         msg += 'CloudShell Request for Cabling\n'
         msg += '{}\n'.format(strftime('%Y-%m-%d %H:%M:%S'))
@@ -84,13 +72,36 @@ def main():
 
         # print msg
         send_email(subject=subj, message=msg)
-        sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                               message='\nRequest for {} Cable(s) made'.format(count))
-        for each in cable_req:
-            sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                                   message=' {} <---> {}'.format(each.Source,
-                                                                                                 each.Target))
+        _write_request_output(sandbox, cable_req)
 # end main
 
 
+def _add_to_digest(sandbox, owner, wedge, cable_req):
+    """
+    records the requests in the shared digest and sends the consolidated email if one is due already,
+    otherwise the scheduled send_cable_digest.py sends it
+    :param Sandbox sandbox:
+    :param str owner:
+    :param str wedge: sandbox URL
+    :param list RouteInfo cable_req:
+    :return: int: cables new to the digest
+    """
+    digest = CableDigest(interval=DIGEST_INTERVAL)
+    try:
+        email = digest.user_email(owner, lambda name: sandbox.automation_api.GetUserDetails(username=name).Email)
+        added = digest.record(sandbox.id, owner, email, wedge, [(cable.Source, cable.Target) for cable in cable_req])
+        send_due_digest(digest)
+        return added
+    finally:
+        digest.close()
+
+
+def _write_request_output(sandbox, cable_req):
+    # one multi-line output write instead of one per cable
+    with ReservationOutputWriter(sandbox.automation_api, sandbox.id) as w2output:
+        w2output(reservationId=sandbox.id, message='\nRequest for {} Cable(s) made'.format(len(cable_req)))
+        for each in cable_req:
+            w2output(reservationId=sandbox.id, message=' {} <---> {}'.format(each.Source, each.Target))
+
+
 main()
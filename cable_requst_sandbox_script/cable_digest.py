@@ -0,0 +1,190 @@
+from tempfile import gettempdir
+from time import localtime, strftime, time
+import os
+import sqlite3
+
+DEFAULT_DIGEST_PATH = os.path.join(gettempdir(), 'cable_request_digest.sqlite')
+DIGEST_INTERVAL = 900  # seconds between consolidated cable request emails
+RENOTIFY_AFTER = 7 * 24 * 3600  # seconds before a cable that was already mailed is mailed again if re-requested
+USER_EMAIL_TTL = 24 * 3600  # seconds an owner's email address is reused before GetUserDetails is called again
+LOCK_TIMEOUT = 30  # seconds a process waits on another one holding the database
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cables (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    notified_at REAL,
+    PRIMARY KEY (source, target)
+);
+CREATE TABLE IF NOT EXISTS cable_reservations (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    reservation_id TEXT NOT NULL,
+    owner TEXT,
+    email TEXT,
+    link TEXT,
+    seen REAL NOT NULL,
+    PRIMARY KEY (source, target, reservation_id)
+);
+CREATE TABLE IF NOT EXISTS users (
+    owner TEXT PRIMARY KEY,
+    email TEXT,
+    fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class CableDigest(object):
+    """
+    Collects cable requests from every sandbox into one sqlite database, so the lab team gets one consolidated
+    email per DIGEST_INTERVAL instead of one per sandbox.
+    A (source, target) pair is only mailed once however many sandboxes ask for it, and re-running a sandbox's
+    script doesn't mail its cables again. The database can be shared by concurrent script runs.
+    """
+    def __init__(self, path=DEFAULT_DIGEST_PATH, interval=DIGEST_INTERVAL, renotify_after=RENOTIFY_AFTER):
+        """
+        :param str path: sqlite database, created if missing
+        :param float interval: seconds between digests
+        :param float renotify_after: seconds before an already mailed cable can be mailed again
+        """
+        self.path = path
+        self.interval = interval
+        self.renotify_after = renotify_after
+        self._db = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def user_email(self, owner, fetch):
+        """
+        :param str owner: user name
+        :param function fetch: callable(owner) returning the email, only called when not cached
+        :return: str: email address
+        """
+        row = self._db.execute('SELECT email, fetched FROM users WHERE owner = ?', (owner,)).fetchone()
+        if row is not None and time() - row[1] < USER_EMAIL_TTL:
+            return row[0]
+        email = fetch(owner)
+        self._db.execute('INSERT OR REPLACE INTO users (owner, email, fetched) VALUES (?, ?, ?)',
+                         (owner, email, time()))
+        return email
+
+    def record(self, reservation_id, owner, email, link, cables):
+        """
+        adds a sandbox's cable requests
+        :param str reservation_id:
+        :param str owner:
+        :param str email: owner's email
+        :param str link: sandbox URL
+        :param list tuple cables: (source, target) pairs, a cable is the same either way round
+        :return: int: pairs that will be in the next digest because of this call
+        """
+        now = time()
+        added = 0
+        with self._transaction():
+            for source, target in set(tuple(sorted(cable)) for cable in cables):
+                row = self._db.execute('SELECT notified_at FROM cables WHERE source = ? AND target = ?',
+                                       (source, target)).fetchone()
+                if row is None:
+                    self._db.execute('INSERT INTO cables (source, target, first_seen) VALUES (?, ?, ?)',
+                                     (source, target, now))
+                    added += 1
+                elif row[0] is not None and now - row[0] >= self.renotify_after:
+                    self._db.execute('UPDATE cables SET notified_at = NULL, first_seen = ? '
+                                     'WHERE source = ? AND target = ?', (now, source, target))
+                    added += 1
+                self._db.execute('INSERT OR REPLACE INTO cable_reservations '
+                                 '(source, target, reservation_id, owner, email, link, seen) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (source, target, reservation_id, owner, email, link, now))
+        return added
+
+    def pending(self):
+        """
+        :return: int: pairs waiting for the next digest
+        """
+        return self._db.execute('SELECT COUNT(*) FROM cables WHERE notified_at IS NULL').fetchone()[0]
+
+    def take_due(self, force=False):
+        """
+        claims the pending cables if a digest is due, marking them notified.
+        only one of several concurrent callers gets them
+        :param bool force: ignore the interval
+        :return: list dict: source, target, first_seen, reservations (list of dict reservation_id, owner, email, link);
+                 empty when no digest is due
+        """
+        now = time()
+        with self._transaction():
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'last_digest'").fetchone()
+            if not force and row is not None and now - float(row[0]) < self.interval:
+                return []
+
+            cables = self._db.execute('SELECT source, target, first_seen FROM cables WHERE notified_at IS NULL '
+                                      'ORDER BY first_seen, source, target').fetchall()
+            if not cables:
+                return []
+
+            digest = []
+            for source, target, first_seen in cables:
+                reservations = self._db.execute(
+                    'SELECT reservation_id, owner, email, link FROM cable_reservations '
+                    'WHERE source = ? AND target = ? ORDER BY seen', (source, target)).fetchall()
+                digest.append({'source': source, 'target': target, 'first_seen': first_seen,
+                               'reservations': [dict(zip(('reservation_id', 'owner', 'email', 'link'), reservation))
+                                                for reservation in reservations]})
+
+            self._db.execute('UPDATE cables SET notified_at = ? WHERE notified_at IS NULL', (now,))
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_digest', ?)", (str(now),))
+        return digest
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    @staticmethod
+    def format(digest):
+        """
+        :param list dict digest: from take_due
+        :return: str: email body
+        """
+        msg = str()
+        msg += 'CloudShell Requests for Cabling\n'
+        msg += '{}\n'.format(strftime('%Y-%m-%d %H:%M:%S'))
+        msg += '{} Cable(s) requested\n'.format(len(digest))
+        msg += '\n'
+
+        count = 0
+        for cable in digest:
+            count += 1
+            msg += '  Cable # {}\n'.format(count)
+            msg += '   > From: {}\n'.format(cable['source'])
+            msg += '   >   To: {}\n'.format(cable['target'])
+            msg += '   > Since: {}\n'.format(strftime('%Y-%m-%d %H:%M:%S', localtime(cable['first_seen'])))
+            for reservation in cable['reservations']:
+                msg += '   > Sandbox: {} ( {} {} )\n'.format(reservation['link'], reservation['owner'],
+                                                           reservation['email'])
+            msg += '\n'
+
+        msg += '-- End of Requests'
+        return msg
+
+
+class _Transaction(object):
+    """
+    BEGIN IMMEDIATE ... COMMIT / ROLLBACK, taking the write lock up front so concurrent runs serialize
+    """
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db.execute('BEGIN IMMEDIATE')
+        return self._db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
@@ -0,0 +1,58 @@
+from email.mime.text import MIMEText
+from cloudshell.core.logger import qs_logger
+from cable_digest import CableDigest
+from mail_queue import MailQueue
+import atexit
+
+SMTP_USER = 'no-reply@acmeco.com'
+SMTP_MAIL_LIST = 'user1@acmeco.com;user2@acmeco.com'
+SMTP_SERVER = 'mail-relay.acmeco.com'
+SMTP_PORT = 25
+MAIL_EXIT_TIMEOUT = 0  # seconds a sandbox script waits on exit for queued mail, the rest stays spooled for the next
+# run or send_cable_digest.py, so a slow relay never holds up the reservation
+MAIL_FLUSH_TIMEOUT = 15  # seconds send_cable_digest.py waits for its digest to be delivered
+
+_mail_queue = []
+
+
+def get_mail_queue():
+    """
+    starts the delivery queue on first use, picking up mail left undelivered by earlier runs
+    :return: MailQueue
+    """
+    if not _mail_queue:
+        queue = MailQueue(SMTP_SERVER, SMTP_PORT, logger=qs_logger.get_qs_logger())
+        queue.resume()
+        atexit.register(queue.close, MAIL_EXIT_TIMEOUT)
+        _mail_queue.append(queue)
+    return _mail_queue[0]
+
+
+def send_email(subject='', message=''):
+
+    msg = MIMEText(message)
+    msg['Subject'] = subject
+    msg['From'] = SMTP_USER
+    msg['To'] = SMTP_MAIL_LIST
+
+    # queued & delivered in the background, a slow or failing relay doesn't hold up the sandbox
+    try:
+        get_mail_queue().enqueue(SMTP_USER, SMTP_MAIL_LIST.split(';'), msg.as_string())
+    except (IOError, OSError) as e:
+        logger = qs_logger.get_qs_logger()
+        logger.warning('Unable to queue email message')
+        logger.warning(str(e))
+        logger.warning(message)
+
+
+def send_due_digest(digest, force=False):
+    """
+    mails the pending cable requests as one consolidated email if a digest is due
+    :param CableDigest digest:
+    :param bool force: send whatever is pending, due or not
+    :return: int: cables mailed
+    """
+    due = digest.take_due(force)
+    if due:
+        send_email(subject='CloudShell Cable Requests ({})'.format(len(due)), message=CableDigest.format(due))
+    return len(due)
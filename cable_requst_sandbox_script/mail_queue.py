@@ -0,0 +1,266 @@
+from json import dumps as json_dumps, loads as json_loads
+from Queue import Empty, Queue
+from tempfile import gettempdir
+from threading import Lock, Thread
+from time import sleep, time
+from uuid import uuid4
+import logging
+import os
+import smtplib
+import socket
+
+DEFAULT_SPOOL_DIR = os.path.join(gettempdir(), 'cable_request_mail')
+MAX_ATTEMPTS = 5  # delivery attempts per message in one run, the message stays spooled for the next run after that
+BASE_DELAY = 1.0  # seconds before the first retry, doubled on every retry
+MAX_DELAY = 30.0
+IDLE_TIMEOUT = 30.0  # seconds an unused SMTP connection is kept open
+SMTP_TIMEOUT = 30.0
+STALE_CLAIM_AGE = 600  # seconds after which a message claimed by a process that died is taken over
+SPOOL_SUFFIX = '.mail'
+CLAIM_SUFFIX = '.sending'
+FAILED_SUFFIX = '.failed'
+
+
+class MailQueue(object):
+    """
+    Local delivery queue for notification emails.
+    enqueue() writes the message to the spool directory and returns, a single worker thread delivers the spooled
+    messages over one reused SMTP connection, retrying with exponential backoff.
+    A message is only removed from the spool once the relay accepted it, so anything undelivered when the process
+    ends is sent by the next MailQueue started on the same spool directory.
+    A message being sent is renamed to a claim '<spool file>.<claim time>-<token>.sending' that no other process
+    touches until it is stale_claim_age old. Taking over a stale claim renames it to a new claim, so only one process
+    can win it.
+    """
+    def __init__(self, host, port=25, spool_dir=DEFAULT_SPOOL_DIR, max_attempts=MAX_ATTEMPTS,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY, idle_timeout=IDLE_TIMEOUT, timeout=SMTP_TIMEOUT,
+                 stale_claim_age=STALE_CLAIM_AGE, smtp_factory=smtplib.SMTP, logger=None):
+        """
+        :param str host: SMTP relay
+        :param int port:
+        :param str spool_dir: where undelivered messages are kept, created if missing
+        :param int max_attempts: delivery attempts per message
+        :param float base_delay: seconds before the first retry
+        :param float max_delay: upper bound on the retry delay
+        :param float idle_timeout: seconds before an unused connection is closed
+        :param float timeout: SMTP socket timeout
+        :param float stale_claim_age: seconds before a message claimed by another process is taken over
+        :param smtp_factory: callable(host, port, timeout=) returning an smtplib.SMTP like connection
+        :param logger: defaults to this module's logger
+        """
+        self.host = host
+        self.port = port
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stale_claim_age = stale_claim_age
+        self.smtp_factory = smtp_factory
+        self.logger = logger or logging.getLogger(__name__)
+        self.delivered = 0
+        self._queue = Queue()
+        self._smtp = None
+        self._worker = None
+        self._lock = Lock()
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+
+    def enqueue(self, sender, recipients, message):
+        """
+        spools the message for delivery and returns without waiting on the relay
+        :param str sender:
+        :param list str recipients:
+        :param str message: full message text, e.g. MIMEText.as_string()
+        :return: str: spool file of the message
+        """
+        path = os.path.join(self.spool_dir, '{:.6f}-{}{}'.format(time(), uuid4().hex, SPOOL_SUFFIX))
+        self._write(path, {'sender': sender, 'recipients': list(recipients), 'message': message,
+                           'attempts': 0, 'error': ''})
+        self._queue.put(path)
+        self._start()
+        return path
+
+    def resume(self):
+        """
+        queues the messages left in the spool by earlier runs, and the stale claims of processes that died sending
+        :return: int: messages queued
+        """
+        count = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith(CLAIM_SUFFIX):
+                if not self._stale(path):
+                    continue  # being sent by another process
+            elif not name.endswith(SPOOL_SUFFIX):
+                continue
+            self._queue.put(path)
+            count += 1
+        if count:
+            self._start()
+        return count
+
+    def pending(self):
+        """
+        :return: int: messages queued or being delivered in this process
+        """
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """
+        waits for the queued messages to be delivered (or given up on)
+        :param float timeout: seconds, None waits until the queue is empty
+        :return: bool: True if nothing is left in the queue
+        """
+        deadline = None if timeout is None else time() + timeout
+        while self.pending():
+            if deadline is not None and time() >= deadline:
+                return False
+            sleep(0.05)
+        return True
+
+    def close(self, timeout=None):
+        """
+        flushes, then stops the worker and closes the SMTP connection
+        :param float timeout: seconds to wait for delivery
+        :return: bool: True if everything queued was handled
+        """
+        done = self.flush(timeout)
+        with self._lock:
+            worker = self._worker
+        if worker is not None and done:
+            self._queue.put(None)
+            worker.join(timeout)
+        return done
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(target=self._work, name='MailQueue')
+                self._worker.daemon = True  # undelivered mail stays spooled, it never holds the process open
+                self._worker.start()
+
+    def _work(self):
+        while True:
+            try:
+                path = self._queue.get(timeout=self.idle_timeout)
+            except Empty:
+                self._disconnect()
+                continue
+            try:
+                if path is None:
+                    self._disconnect()
+                    with self._lock:
+                        self._worker = None
+                    return
+                self._deliver(path)
+            except Exception as err:
+                self.logger.warning('Unable to send email message: {}'.format(err))
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, path):
+        """
+        :param str path: spool file, or a stale claim to take over
+        :return: bool: True if delivered
+        """
+        source = path
+        if source.endswith(CLAIM_SUFFIX):
+            if not self._stale(source):
+                return False  # its owner is still sending it
+            path = self._spooled_path(source)
+        claimed = '{}.{:d}-{}{}'.format(path, int(time()), uuid4().hex, CLAIM_SUFFIX)
+        try:
+            # a spooled file or a given claim can be renamed only once, so only one process sends the message
+            os.rename(source, claimed)
+        except OSError:
+            return False  # delivered, claimed or taken over by another process
+        record = self._read(claimed)
+        if record is None:
+            return False
+
+        while True:
+            try:
+                self._send(record)
+                os.remove(claimed)
+                self.delivered += 1
+                return True
+            except (smtplib.SMTPException, socket.error) as err:
+                self._disconnect()
+                record['attempts'] += 1
+                record['error'] = str(err)
+                permanent = isinstance(err, smtplib.SMTPResponseException) and err.smtp_code >= 500 or \
+                    isinstance(err, smtplib.SMTPRecipientsRefused)
+                if permanent or record['attempts'] >= self.max_attempts:
+                    self.logger.warning('Unable to send email message')
+                    self.logger.warning(record['error'])
+                    self._write(path + FAILED_SUFFIX if permanent else path, record)
+                    os.remove(claimed)
+                    return False
+                self._write(claimed, record)
+                sleep(min(self.base_delay * 2 ** (record['attempts'] - 1), self.max_delay))
+
+    def _stale(self, claimed):
+        """
+        :param str claimed: claim file
+        :return: bool: True if the claim is older than stale_claim_age
+        """
+        stamp = claimed[:-len(CLAIM_SUFFIX)].rsplit('.', 1)[-1].split('-', 1)[0]
+        try:
+            return time() - int(stamp) >= self.stale_claim_age
+        except ValueError:
+            return False  # not a claim this queue made
+
+    @staticmethod
+    def _spooled_path(claimed):
+        """
+        :param str claimed: claim file
+        :return: str: spool file the claimed message came from
+        """
+        return claimed[:-len(CLAIM_SUFFIX)].rsplit('.', 1)[0]
+
+    def _send(self, record):
+        """
+        sends over the open connection, reconnecting once right away if the relay dropped it while idle
+        :param dict record:
+        :return: None
+        """
+        reused = self._smtp is not None
+        try:
+            self._connection().sendmail(record['sender'], record['recipients'], record['message'])
+        except smtplib.SMTPServerDisconnected:
+            self._disconnect()
+            if not reused:
+                raise
+            self._connection().sendmail(record['sender'], record['recipients'], record['message'])
+
+    def _connection(self):
+        if self._smtp is None:
+            self._smtp = self.smtp_factory(self.host, self.port, timeout=self.timeout)
+        return self._smtp
+
+    def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, socket.error):
+                smtp.close()
+
+    @staticmethod
+    def _write(path, record):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(json_dumps(record))
+        if os.path.exists(path) and os.name == 'nt':
+            os.remove(path)  # rename won't replace an existing file on windows
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json_loads(f.read())
+        except (IOError, ValueError):
+            return None
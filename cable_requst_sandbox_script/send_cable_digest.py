@@ -0,0 +1,53 @@
+"""
+Sends the consolidated cable request email on a schedule, so requests recorded by the last sandbox of a quiet
+period still go out. Sandbox runs only record their requests (DIGEST_MODE in __main__.py), this is what mails them.
+It also delivers whatever mail the sandbox scripts left in the spool, they don't wait on the relay when they exit.
+Run it on the execution server from cron / Task Scheduler every DIGEST_INTERVAL, or leave it running with --loop:
+
+    python send_cable_digest.py            # send if a digest is due
+    python send_cable_digest.py --force    # send whatever is pending now
+    python send_cable_digest.py --loop     # check every --interval seconds until stopped
+"""
+from argparse import ArgumentParser
+from time import sleep
+from cable_digest import CableDigest, DEFAULT_DIGEST_PATH, DIGEST_INTERVAL
+from cable_request_mail import MAIL_FLUSH_TIMEOUT, get_mail_queue, send_due_digest
+
+
+def send_once(path, interval, force=False):
+    """
+    :param str path: digest database
+    :param float interval: seconds between digests
+    :param bool force: ignore the interval
+    :return: int: cables mailed
+    """
+    queue = get_mail_queue()  # picks up the mail spooled by the sandbox scripts
+    digest = CableDigest(path, interval=interval)
+    try:
+        sent = send_due_digest(digest, force)
+    finally:
+        digest.close()
+    queue.flush(MAIL_FLUSH_TIMEOUT)
+    return sent
+
+
+def main():
+    parser = ArgumentParser(description='Mail the pending cable requests as one consolidated email')
+    parser.add_argument('--digest', default=DEFAULT_DIGEST_PATH, help='digest database the sandbox runs record to')
+    parser.add_argument('--interval', type=float, default=DIGEST_INTERVAL, help='seconds between digests')
+    parser.add_argument('--force', action='store_true', help='send the pending requests even if not due yet')
+    parser.add_argument('--loop', action='store_true', help='keep running, checking every --interval seconds')
+    args = parser.parse_args()
+
+    while True:
+        sent = send_once(args.digest, args.interval, args.force)
+        if sent:
+            print 'Mailed {} Cable request(s)'.format(sent)
+        if not args.loop:
+            break
+        sleep(args.interval)
+        get_mail_queue().resume()  # mail spooled by the sandbox scripts since the last check
+
+
+if __name__ == '__main__':
+    main()
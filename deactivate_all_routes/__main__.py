@@ -1,26 +1,30 @@
 import cloudshell.helpers.scripts.cloudshell_scripts_helpers as cs_helper
-from cloudshell.api.common_cloudshell_api import CloudShellAPIError
+from sandbox_orch_plugins import RouteTable, RouteBatcher
 
-route_list = []
+RECONCILE_ROUTES = True  # only disconnect the routes ActiveRoutesInfo lists as active, False disconnects every route
 
 res_id = cs_helper.get_reservation_context_details().id
-route_details = cs_helper.get_api_session().GetReservationDetails(res_id).ReservationDescription.TopologiesRouteInfo
-w2output = cs_helper.get_api_session().WriteMessageToReservationOutput
+api = cs_helper.get_api_session()
+reservation = api.GetReservationDetails(res_id).ReservationDescription
+route_details = reservation.TopologiesRouteInfo
+w2output = api.WriteMessageToReservationOutput
 
 # build route lists
 # route lists used by the Route API are just are endpoints paired in an open list:
 # ['source1', 'target1', 'source2', 'target2', ... 'sourceN', 'targetN']
-for route in route_details:
-    for r in route.Routes:
-        route_list.append(r.Source)
-        route_list.append(r.Target)
+# when reconciling, only routes that are currently active are disconnected
+routes = RouteTable.from_topologies(route_details)
+route_list = list(routes)
+if RECONCILE_ROUTES:
+    route_list = RouteTable.reconcile(route_list, RouteTable.keys_of(reservation.ActiveRoutesInfo or []),
+                                      connect=False)
 
+if len(route_list) < len(routes):
+    w2output(reservationId=res_id,
+             message='Skipping {} routes, already disconnected'.format(len(routes) - len(route_list)))
 
 # execute routes
 if len(route_list) > 0:
-    try:
-        w2output(reservationId=res_id,
-                 message='Queuing {} routes for disconnection'.format(len(route_list)/2))
-        cs_helper.get_api_session().DisconnectRoutesInReservation(reservationId=res_id, endpoints=route_list)
-    except CloudShellAPIError as err:
-        w2output(reservationId=res_id, message=err.message)
+    w2output(reservationId=res_id,
+             message='Queuing {} routes for disconnection'.format(len(route_list)))
+    RouteBatcher(api, res_id).disconnect(route_list)
@@ -13,8 +13,11 @@ def main():
 
     cmd_helper = ResourceCommandHelper(command_name='bark', inputs=bark_inputs)
 
+    # command lists are kept in a local sqlite cache, shared by every sandbox run on this execution server
+    plugins = SandboxOrchPlugins(metadata_cache=True)
+
     # stage hooks:
-    sandbox.workflow.add_to_configuration(function=SandboxOrchPlugins().run_resource_command_on_all,
+    sandbox.workflow.add_to_configuration(function=plugins.run_resource_command_on_all,
                                           components=cmd_helper)
 
     sandbox.execute_setup()
@@ -1,16 +1,29 @@
 from cloudshell.workflow.orchestration.sandbox import Sandbox
 from cloudshell.workflow.orchestration.setup.default_setup_orchestrator import DefaultSetupWorkflow
+from sandbox_orch_plugins import ApiCallRecorder, ReservationSnapshot, SandboxOrchPlugins
+
+RECONCILE_ROUTES = True  # re-read the active routes and only connect the ones that are down, False connects them all
 
 
 def main():
     sandbox = Sandbox()
     DefaultSetupWorkflow().register(sandbox)
 
-    route_details = sandbox.automation_api.GetReservationDetails(sandbox.id).ReservationDescription.TopologiesRouteInfo
+    # fetched once, when the first stage reads it, and shared with any other plugin registered on this sandbox
+    route_details = ReservationSnapshot.for_sandbox(sandbox)
 
     # stage hooks:
     sandbox.workflow.add_to_connectivity(function=do_route_connections, components=route_details)
-    sandbox.execute_setup()
+    sandbox.workflow.on_connectivity_ended(function=wait_for_route_connections, components=route_details)
+
+    # time every API call per stage / plugin, summary goes to the output and a JSON file when setup ends.
+    # attached after the hooks are registered so it can tag them, the snapshot's reads still go through it
+    recorder = ApiCallRecorder()
+    recorder.attach(sandbox)
+    try:
+        sandbox.execute_setup()
+    finally:
+        recorder.finish(sandbox, 'setup')
 
 
 def do_route_connections(sandbox, components):
@@ -20,41 +33,23 @@ def do_route_connections(sandbox, components):
     in an open list:
     ['source1', 'target1', 'source2', 'target2', ... 'sourceN', 'targetN']
     :param Sandbox sandbox: Sandbox context obj
-    :param TopologiesRouteInfo components:  List of Route Objects found in the reservation being used
+    :param ReservationSnapshot components:  Shared reservation details, holding the Routes of the reservation
+    :return: None
+    """
+    # when reconciling, only routes that aren't active yet are sent, so re-running setup after a partial failure
+    # is quick. routes on different L1 switches are connected at the same time, the whole topology is connected here
+    SandboxOrchPlugins(reconcile_routes=RECONCILE_ROUTES, switch_waves=True).connect_all_routes(sandbox, components)
+
+
+def wait_for_route_connections(sandbox, components):
+    """
+    holds setup until the connected routes show as active, so configuration only starts on live links.
+    routes still down after the timeout are listed in the output
+    :param Sandbox sandbox: Sandbox context obj
+    :param ReservationSnapshot components:  Shared reservation details, holding the Routes of the reservation
     :return: None
     """
-    bi_direction = []
-    uni_direction = []
-    for route in components:
-        for r in route:
-            if r.RouteType == 'bi':
-                bi_direction.append(r.Source)
-                bi_direction.append(r.Target)
-            elif r.RouteType == 'uni':
-                uni_direction.append(r.Source)
-                uni_direction.append(r.Target)
-
-    # set bi-directional routes
-    if len(bi_direction) > 0:
-        try:
-            sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                message='Queuing {} Bi-Dir routes for connection'.format(len(bi_direction) / 2))
-
-            sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id,
-                                                              endpoints=bi_direction, mappingType='bi')
-        except Exception as err:
-            sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id, message=err.message)
-
-    # set uni-directional routes
-    if len(uni_direction) > 0:
-        try:
-            sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                message='Queuing {} Uni-Dir routes for connection'.format(len(uni_direction) / 2))
-
-            sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id,
-                                                              endpoints=uni_direction, mappingType='uni')
-        except Exception as err:
-            sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id, message=err.message)
+    SandboxOrchPlugins().wait_for_routes(sandbox, components)
 
 
 main()
@@ -0,0 +1,143 @@
+# output & state helpers used by sandbox_orch_plugins.py, copied on their own into scripts that need only these
+from json import dumps as json_dumps, loads as json_loads
+import os
+from threading import Lock, Timer, current_thread
+
+
+class ReservationOutputWriter(object):
+    """
+    Buffers reservation output messages and writes them as one multi-line WriteMessageToReservationOutput call
+    once max_lines / max_chars are buffered, max_delay seconds after the first buffered message, on flush(),
+    or when leaving a `with` block (also on exceptions).
+    Called like WriteMessageToReservationOutput, so it can stand in for it:
+        w2output = ReservationOutputWriter(api, res_id)
+        w2output(reservationId=res_id, message='...')
+    """
+    _registry = {}
+    _registry_lock = Lock()
+
+    def __init__(self, api, reservation_id, max_lines=50, max_chars=4000, max_delay=2.0):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param int max_lines: flush once this many messages are buffered
+        :param int max_chars: flush once the buffered text reaches this size
+        :param float max_delay: seconds a message may wait in the buffer, 0 disables the timer
+        """
+        self.api = api
+        self.reservation_id = reservation_id
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self._lines = []
+        self._chars = 0
+        self._timer = None
+        self._lock = Lock()
+
+    @classmethod
+    def for_sandbox(cls, sandbox):
+        """
+        returns the writer shared by every plugin writing to this sandbox through this API object
+        :param Sandbox sandbox:
+        :return: ReservationOutputWriter
+        """
+        key = (sandbox.id, id(sandbox.automation_api))
+        with cls._registry_lock:
+            writer = cls._registry.get(key)
+            if writer is None:
+                writer = cls(sandbox.automation_api, sandbox.id)
+                cls._registry[key] = writer
+        return writer
+
+    def __call__(self, reservationId=None, message=''):
+        self.write(message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.flush()
+        except Exception:
+            if exc_type is None:
+                raise  # don't hide the original error behind a failed flush
+
+    def write(self, message):
+        """
+        :param str message:
+        :return: None
+        """
+        with self._lock:
+            self._lines.append(message)
+            self._chars += len(message) + 1
+            full = len(self._lines) >= self.max_lines or self._chars >= self.max_chars
+            if not full and self._timer is None and self.max_delay > 0:
+                self._timer = Timer(self.max_delay, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            pass  # no caller to report to from the timer thread, this batch is dropped
+
+    def flush(self):
+        """
+        writes everything buffered in a single API call
+        :return: None
+        """
+        with self._lock:
+            lines, self._lines, self._chars = self._lines, [], 0
+            timer, self._timer = self._timer, None
+            if len(lines) > 0:
+                self.api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
+                                                         message='\n'.join(lines))
+
+        if timer is not None and timer is not current_thread():
+            timer.cancel()
+            timer.join()  # don't leave a waiting timer thread behind at interpreter exit
+
+
+class JsonFileStore(object):
+    """
+    Minimal key/value store persisted to a local JSON file, for keeping metadata across sandbox runs
+    """
+    def __init__(self, path):
+        """
+        :param str path: file to load from / save to, created on first write
+        """
+        self.path = path
+        self._lock = Lock()
+        self._data = {}
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self._data = json_loads(f.read())
+            except ValueError:
+                self._data = {}  # unreadable cache, start over
+
+    def get(self, key):
+        """
+        :param str key:
+        :return: stored value or None
+        """
+        return self._data.get(key)
+
+    def set(self, key, value):
+        """
+        stores the value and rewrites the file (write to temp file then rename, so readers never see half a file)
+        :param str key:
+        :param value: any JSON serializable value
+        :return: None
+        """
+        with self._lock:
+            self._data[key] = value
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(json_dumps(self._data))
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path)  # rename won't replace an existing file on windows
+            os.rename(tmp_path, self.path)
@@ -1,22 +1,32 @@
 from cloudshell.workflow.orchestration.sandbox import Sandbox
-from cloudshell.workflow.orchestration.setup.default_setup_orchestrator import DefaultSetupWorkflow
-from sandbox_orch_plugins import ServiceCommandHelper, ResourceCommandHelper, RouteCommandHelper, SandboxOrchPlugins
+from cloudshell.workflow.orchestration.teardown.default_teardown_orchestrator import DefaultTeardownWorkflow
+from sandbox_orch_plugins import ApiCallRecorder, ServiceCommandHelper, ResourceCommandHelper, RouteCommandHelper, \
+    SandboxOrchPlugins
 from collections import OrderedDict
 
+RECONCILE_ROUTES = True  # re-read the active routes and only disconnect the ones still up, False disconnects them all
+
 
 def main():
     sandbox = Sandbox()
-    DefaultSetupWorkflow().register(sandbox)
+    DefaultTeardownWorkflow().register(sandbox)
     w2output = sandbox.automation_api.WriteMessageToReservationOutput
 
     model_list = ['Arista EOS Router']
+    plugins = SandboxOrchPlugins(reconcile_routes=RECONCILE_ROUTES)
 
     for model in model_list:
         route_helper = RouteCommandHelper(device_model=model)
         w2output(sandbox.id, 'Queueing Route Disconnection for {}'.format(model))
-        sandbox.workflow.add_to_teardown(function=SandboxOrchPlugins().disconnect_routes_by_device_type(),
+        sandbox.workflow.add_to_teardown(function=plugins.disconnect_routes_by_device_type,
                                          components=route_helper)
 
-    sandbox.execute_setup()
+    # time every API call per stage / plugin, summary goes to the output and a JSON file when teardown ends
+    recorder = ApiCallRecorder()
+    recorder.attach(sandbox)
+    try:
+        sandbox.execute_teardown()
+    finally:
+        recorder.finish(sandbox, 'teardown')
 
 main()
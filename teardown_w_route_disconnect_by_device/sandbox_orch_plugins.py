@@ -1,11 +1,390 @@
 from cloudshell.workflow.orchestration.sandbox import Sandbox
 from cloudshell.api.cloudshell_api import InputNameValue, ResourceCommandListInfo
 from collections import OrderedDict
+from json import dumps as json_dumps, loads as json_loads
+from fnmatch import translate as glob_to_regex
+from functools import wraps
+from multiprocessing.pool import ThreadPool
+import os
+from re import IGNORECASE, compile as re_compile, escape as re_escape
+from shlex import split as shlex_split
+import sqlite3
+import sys
+from tempfile import gettempdir
+from threading import Event, Lock, Thread, local
+from time import sleep, time
+from orch_helpers import JsonFileStore, ReservationOutputWriter
+
+DEFAULT_MAX_WORKERS = 10
+DEFAULT_METADATA_CACHE_PATH = os.path.join(gettempdir(), 'sandbox_orch_metadata.sqlite')
+# seconds a cached entry is used, by key prefix. Drivers & service models rarely change, connections more often
+METADATA_TTLS = {'resource': 24 * 3600, 'driver_commands': 24 * 3600, 'service_commands': 24 * 3600,
+                 'connected_commands': 3600}
+METADATA_DEFAULT_TTL = 3600
+METADATA_LOCK_TIMEOUT = 30  # seconds a process waits on another one writing the cache
+
+_call_context = local()  # stage / plugin the current thread is working for, read by InstrumentedApi
+
+
+def _get_call_context():
+    """
+    :return: tuple str stage, plugin: what the current thread is working for, ('', '') outside a plugin
+    """
+    return getattr(_call_context, 'stage', ''), getattr(_call_context, 'plugin', '')
+
+
+def _in_call_context(context, func):
+    """
+    wraps func so it runs under the given call context, used to carry the context onto worker threads
+    :param tuple context: (stage, plugin) from _get_call_context
+    :param function func:
+    :return: function
+    """
+    def _run(*args, **kwargs):
+        previous = _get_call_context()
+        _call_context.stage, _call_context.plugin = context
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _call_context.stage, _call_context.plugin = previous
+    return _run
+
+
+def _thread_map(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    runs func against every item on up to max_workers threads, preserving the order of items.
+    plain threads pulling from a shared iterator: python 2's ThreadPool takes ~0.1s to shut down, every call
+    :param function func: callable taking a single item
+    :param list items:
+    :param int max_workers: upper bound on concurrent calls
+    :return: list results: one result per item, same order as items, the first error (in item order) is re-raised
+    """
+    items = list(items)
+    if len(items) == 0:
+        return []
+    if max_workers <= 1 or len(items) == 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = {}
+    numbered = iter(enumerate(items))
+    lock = Lock()
+    func = _in_call_context(_get_call_context(), func)
+
+    def _work():
+        while True:
+            with lock:
+                if errors:
+                    return  # stop taking new items once one failed
+                try:
+                    index, item = next(numbered)
+                except StopIteration:
+                    return
+            try:
+                results[index] = func(item)
+            except Exception:
+                with lock:
+                    errors[index] = sys.exc_info()
+
+    workers = [Thread(target=_work) for _ in range(min(max_workers, len(items)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if errors:
+        exc_info = errors[min(errors)]
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return results
+
+
+class CommandTimeoutError(Exception):
+    def __init__(self, message):
+        super(CommandTimeoutError, self).__init__(message)
+        self.message = message
+
+
+def _call_with_timeout(func, timeout=None):
+    """
+    runs func, giving up on it after timeout seconds.
+    the API call can't be cancelled, so a timed out call is left to finish on its own daemon thread
+    :param function func: callable taking no arguments
+    :param float timeout: seconds to wait, None waits forever
+    :return: func's return value
+    """
+    if timeout is None:
+        return func()
+
+    outcome = {}
+
+    def _target():
+        try:
+            outcome['value'] = func()
+        except Exception as err:
+            outcome['error'] = err
+
+    worker = Thread(target=_in_call_context(_get_call_context(), _target))
+    worker.daemon = True
+    worker.start()
+    worker.join(timeout)
+
+    if worker.is_alive():
+        raise CommandTimeoutError('Timed out after {} seconds'.format(timeout))
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('value')
+
+
+def _flushes_output(method):
+    """
+    plugin method decorator, flushes the sandbox's buffered output when the plugin ends, even if it raised
+    """
+    @wraps(method)
+    def _run(self, sandbox, components):
+        try:
+            return method(self, sandbox, components)
+        finally:
+            try:
+                ReservationOutputWriter.for_sandbox(sandbox).flush()
+            except Exception:
+                pass  # keep the plugin's own result / error
+    return _run
+
+
+class _Pattern(object):
+    """
+    one compiled value of a selector term: exact (case insensitive), glob ('Router*') or regex ('re:^Router \\d+$')
+    """
+    __slots__ = ('text', 'literal', '_test')
+
+    def __init__(self, text, exact=False):
+        """
+        :param str text:
+        :param bool exact: take text as is, no glob / regex
+        """
+        self.text = text
+        self.literal = None
+        if exact:
+            self.literal = text.upper()
+            self._test = None
+        elif text.startswith('re:'):
+            self._test = re_compile(text[3:], IGNORECASE).search
+        elif any(char in text for char in '*?['):
+            self._test = re_compile(glob_to_regex(text), IGNORECASE).match
+        else:
+            self.literal = text.upper()
+            self._test = None
+
+    def matches(self, value):
+        """
+        :param str value:
+        :return: bool
+        """
+        if self.literal is not None:
+            return value.upper() == self.literal
+        return self._test(value) is not None
+
+
+class _FieldTerm(object):
+    """
+    matches resources whose name, family, model or attribute matches any of the patterns
+    """
+    def __init__(self, field, patterns, attribute=''):
+        """
+        :param str field: 'name', 'family', 'model' or 'attr'
+        :param list _Pattern patterns:
+        :param str attribute: attribute name, for field 'attr'
+        """
+        self.field = field
+        self.patterns = patterns
+        self.attribute = attribute.upper()
+        # cost decides evaluation order: index lookups first, then name scans, then attribute lookups
+        if field in ('family', 'model') or field == 'name' and all(p.literal is not None for p in patterns):
+            self.cost = 0
+        elif field == 'name':
+            self.cost = 1
+        else:
+            self.cost = 2
+
+    def _matches(self, value):
+        return any(pattern.matches(value) for pattern in self.patterns)
+
+    def select(self, index, candidates):
+        """
+        :param ResourceIndex index:
+        :param set str candidates: names still in the running
+        :return: set str: the matching candidates
+        """
+        if self.field in ('family', 'model'):
+            groups = index._by_family if self.field == 'family' else index._by_model
+            hits = set()
+            for value, names in groups.items():
+                if self._matches(value):
+                    hits |= names
+            return hits & candidates
+
+        if self.field == 'name':
+            if self.cost == 0:
+                return set(index._by_upper_name[pattern.literal] for pattern in self.patterns
+                           if pattern.literal in index._by_upper_name) & candidates
+            return set(name for name in candidates if self._matches(name))
+
+        index.load_details(candidates)
+        hits = set()
+        for name in candidates:
+            value = index.attributes(name).get(self.attribute)
+            if value is not None and self._matches(value):
+                hits.add(name)
+        return hits
+
+
+class _NotTerm(object):
+    def __init__(self, term):
+        self.term = term
+        self.cost = term.cost
+
+    def select(self, index, candidates):
+        return candidates - self.term.select(index, candidates)
+
+
+class _AllOf(object):
+    def __init__(self, terms):
+        self.terms = sorted(terms, key=lambda term: term.cost)
+        self.cost = max([term.cost for term in terms] or [0])
+
+    def select(self, index, candidates):
+        for term in self.terms:
+            if not candidates:
+                break
+            candidates = term.select(index, candidates)
+        return candidates
+
+
+class _AnyOf(object):
+    def __init__(self, terms):
+        self.terms = terms
+        self.cost = max([term.cost for term in terms] or [0])
+
+    def select(self, index, candidates):
+        selected = set()
+        for term in self.terms:
+            selected |= term.select(index, candidates - selected)
+        return selected
+
+
+class DeviceSelector(object):
+    """
+    Device filter compiled once from a selector string and evaluated against a sandbox's ResourceIndex.
+    Whitespace separated terms, all of which must match; a term is [!]field:value[,value...] where any value may
+    match and '!' negates the term:
+
+        family:Router,Switch  model:"Cisco*"  !name:re:spare  attr.Location:"Rack 1*"
+
+    field is name, family, model or attr.<Attribute Name> (a bare value is a name).
+    Values are case insensitive exact matches, globs (* ? [...]) or regular expressions prefixed with 're:'
+    (searched, so anchor them with ^ $ for whole names). Quote values containing spaces: "Router 1"
+    """
+    FIELDS = ('name', 'family', 'model')
+
+    def __init__(self, node, text=''):
+        """
+        :param node: compiled term, use parse / any_of / all_of / nothing rather than building one
+        :param str text: selector text, for display
+        """
+        self._node = node
+        self.text = text
+
+    def __repr__(self):
+        return 'DeviceSelector({!r})'.format(self.text)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param str text: selector, '' selects every device
+        :return: DeviceSelector
+        """
+        terms = []
+        for token in shlex_split(str(text)):
+            negate = token.startswith('!')
+            if negate:
+                token = token[1:]
+            field, sep, value = token.partition(':')
+            if not sep or not (field.lower() in cls.FIELDS or field.lower().startswith('attr.')):
+                field, value = 'name', token
+            field = field.lower()
+            if value == '':
+                raise ValueError("Empty value in device selector term '{}'".format(token))
+
+            values = [value] if value.startswith('re:') else [each for each in value.split(',') if each]
+            if field.startswith('attr.'):
+                term = _FieldTerm('attr', [_Pattern(each) for each in values], field[len('attr.'):])
+            else:
+                term = _FieldTerm(field, [_Pattern(each) for each in values])
+            terms.append(_NotTerm(term) if negate else term)
+        return cls(_AllOf(terms), text)
+
+    @classmethod
+    def field(cls, field, value, substring=False):
+        """
+        :param str field: name, family or model
+        :param str value: exact value (case insensitive)
+        :param bool substring: match value anywhere in the field instead
+        :return: DeviceSelector
+        """
+        pattern = _Pattern('re:' + re_escape(value)) if substring else _Pattern(value, exact=True)
+        return cls(_FieldTerm(field, [pattern]), '{}:{}'.format(field, '*{}*'.format(value) if substring else value))
+
+    @classmethod
+    def all_of(cls, selectors):
+        """
+        :param list DeviceSelector selectors:
+        :return: DeviceSelector: devices matching every selector (every device when there are none)
+        """
+        return cls(_AllOf([selector._node for selector in selectors]),
+                   ' '.join('({})'.format(selector.text) for selector in selectors))
+
+    @classmethod
+    def any_of(cls, selectors):
+        """
+        :param list DeviceSelector selectors:
+        :return: DeviceSelector: devices matching at least one selector (no device when there are none)
+        """
+        return cls(_AnyOf([selector._node for selector in selectors]),
+                   ' | '.join('({})'.format(selector.text) for selector in selectors))
+
+    @classmethod
+    def nothing(cls):
+        """
+        :return: DeviceSelector: matches no device
+        """
+        return cls.any_of([])
+
+    def select(self, index):
+        """
+        :param ResourceIndex index:
+        :return: set str: names of the matching resources
+        """
+        return self._node.select(index, set(index.records))
+
+
+def _compile_selector(selector, fields):
+    """
+    :param selector: DeviceSelector, selector string or '' for none
+    :param DeviceSelector fields: selector built from a helper's Name / Family / Model, None if none are set
+    :return: DeviceSelector: both combined, nothing selected when neither is set
+    """
+    if isinstance(selector, basestring):
+        selector = DeviceSelector.parse(selector) if selector.strip() else None
+    selectors = [each for each in (fields, selector) if each is not None]
+    if not selectors:
+        return DeviceSelector.nothing()
+    return selectors[0] if len(selectors) == 1 else DeviceSelector.all_of(selectors)
 
 
 class ResourceCommandHelper(object):
     def __init__(self, command_name='', device_name='', device_family='', device_model='', run_type='enqueue',
-                 inputs={}):
+                 inputs={}, max_concurrency=1, timeout=None, selector=''):
         """
 
         :param string command_name: Name of the Command on the Resource to Run
@@ -15,6 +394,10 @@ class ResourceCommandHelper(object):
         :param string run_type: enqueue or execute - how to run the command (fire & forget vs wait to complete)
                                 *Connected Commands can only Execute
         :param OrderedDict inputs: Key == Input Name, Value == Input Value
+        :param int max_concurrency: How many devices to run the command on at once (1 == one after the other)
+        :param float timeout: Seconds to wait on a single device before reporting it as failed (None == no limit)
+        :param selector: DeviceSelector or selector string (see DeviceSelector), devices must also match
+                         the Name / Family / Model when those are set
         """
         self.command_name = command_name
         self.device_name = device_name.upper()
@@ -22,71 +405,1536 @@ class ResourceCommandHelper(object):
         self.model_name = device_model.upper()
         self.run_type = run_type.upper()
         self.parameters = inputs
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        # the exact Device Name wins, otherwise the Family and / or Model must match
+        if self.device_name != '':
+            fields = DeviceSelector.field('name', self.device_name)
+        elif self.family_name != '' or self.model_name != '':
+            fields = DeviceSelector.all_of([DeviceSelector.field(field, value) for field, value in
+                                            (('family', self.family_name), ('model', self.model_name)) if value != ''])
+        else:
+            fields = None
+        self.selector = _compile_selector(selector, fields)
+
+
+class ServiceCommandHelper(object):
+    def __init__(self, command_name='', service_name='', run_type='enqueue', inputs={}, service_alias='',
+                 max_concurrency=1, timeout=None):
+        """
+
+        :param string command_name: Name of the Command on the Service to Run
+        :param string service_name: Service (Model) Name of the instances to use: exact (case insensitive),
+                                    glob ('Traffic*') or regex ('re:^VLAN')
+        :param string run_type: Enqueue or Execute this command (fire and forget vs wait to complete)
+        :param OrderedDict inputs: Key == Input Name, Value == Input Value
+        :param string service_alias: Alias of the instances to use, same matching as service_name.
+                                     When both are set an instance must match both, when neither is none is used
+        :param int max_concurrency: How many instances to run the command on at once (1 == one after the other)
+        :param float timeout: Seconds to wait on a single instance before reporting it as failed (None == no limit)
+        """
+        self.command_name = command_name
+        self.service_name = service_name.upper()
+        self.service_alias = service_alias.upper()
+        self.run_type = run_type.upper()
+        self.parameters = inputs
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._patterns = [(field, _Pattern(value)) for field, value in
+                          (('ServiceName', service_name), ('Alias', service_alias)) if value != '']
+
+    def matches(self, service):
+        """
+        :param ServiceInstance service: one of sandbox.components.services
+        :return: bool: True if the instance is one to run the command on
+        """
+        return bool(self._patterns) and all(pattern.matches(getattr(service, field))
+                                            for field, pattern in self._patterns)
+
+
+class RouteCommandHelper(object):
+    def __init__(self, device_name='', device_family='', device_model='', route_type='', evaluate_connection_by='Either',
+                 selector=''):
+        """
+        Designed to allow qualifiers to be used with determining which routes to activate or deactivate
+        :param device_name: Name of the Exact Device to use
+        :param device_family: Name of the Device Family
+        :param device_model:
+        :param route_type:
+        :param str evaluate_connection_by:  Judge Route by 'Source', 'Target' or 'Either'
+        :param selector: DeviceSelector or selector string (see DeviceSelector), devices must also match
+                         the Name / Family / Model when those are set
+        """
+        self.device_name = device_name.upper()
+        self.device_family = device_family.upper()
+        self.device_model = device_model.upper()
+        self.route_type = route_type.upper()
+        self.evaluate_by = evaluate_connection_by.upper()
+        if self.evaluate_by not in ROUTE_SIDES:
+            raise ValueError("evaluate_connection_by must be 'Source', 'Target' or 'Either', got '{}'".format(
+                evaluate_connection_by))
+
+        # any of Family, Model or part of the Name
+        fields = [DeviceSelector.field(field, value, substring=field == 'name') for field, value in
+                  (('family', self.device_family), ('model', self.device_model), ('name', self.device_name))
+                  if value != '']
+        self.selector = _compile_selector(selector, DeviceSelector.any_of(fields) if fields else None)
+
+
+def _flatten_routes(topologies_route_info):
+    """
+    :param TopologiesRouteInfo topologies_route_info: per Topology route lists from GetReservationDetails
+    :return: list RouteInfo: every route, across all topologies
+    """
+    routes = []
+    for topology in topologies_route_info:
+        routes.extend(topology.Routes)
+    return routes
+
+
+def _route_key(source, target, route_type):
+    """
+    identity of a route for comparing desired against active routes, bi routes match in either direction
+    :param str source:
+    :param str target:
+    :param str route_type: 'bi' or 'uni'
+    :return: tuple
+    """
+    if route_type.lower() == 'uni':
+        return source, target
+    return tuple(sorted((source, target)))
+
+
+class RouteRecord(object):
+    __slots__ = ('index', 'source', 'target', 'route_type', 'topology', 'base_source', 'base_target', 'key', 'info')
+
+    def __init__(self, index, route_info, topology=''):
+        """
+        :param int index: position of the route in the reservation, keeps selections in reservation order
+        :param RouteInfo route_info: Route object from TopologiesRouteInfo
+        :param str topology: Name of the Topology the route belongs to
+        """
+        self.index = index
+        self.source = route_info.Source
+        self.target = route_info.Target
+        self.route_type = route_info.RouteType.lower()
+        self.topology = topology
+        self.base_source = self.source.split('/')[0]
+        self.base_target = self.target.split('/')[0]
+        self.key = _route_key(self.source, self.target, self.route_type)
+        self.info = route_info
+
+
+def _route_endpoints(routes):
+    """
+    :param list RouteRecord routes:
+    :return: list str: open list of paired endpoints ['source1', 'target1', ... 'sourceN', 'targetN']
+    """
+    endpoints = []
+    for route in routes:
+        endpoints.append(route.source)
+        endpoints.append(route.target)
+    return endpoints
+
+
+ROUTE_SIDES = ('SOURCE', 'TARGET', 'EITHER')  # RouteCommandHelper.evaluate_by values
+ISOLATION_CALLS_PER_CHUNK = 64  # most extra calls spent bisecting one failed chunk, enough for ~3 broken routes in 1000
+
+
+class RouteTable(object):
+    """
+    Routes of a reservation, built once, with hash indexes by endpoint, base device (either side, source side and
+    target side), route type and topology.
+    Every selection returns RouteRecords in reservation order and only touches the matching routes
+    """
+    def __init__(self, records=()):
+        """
+        :param list RouteRecord records:
+        """
+        self.records = []
+        self._by_endpoint = {}
+        self._by_device = {}
+        self._by_source_device = {}
+        self._by_target_device = {}
+        self._by_type = {}
+        self._by_topology = {}
+        for record in records:
+            self._add(record)
+
+    @classmethod
+    def from_topologies(cls, topologies_route_info):
+        """
+        :param TopologiesRouteInfo topologies_route_info: per Topology route lists from GetReservationDetails
+        :return: RouteTable
+        """
+        records = []
+        for topology in topologies_route_info:
+            for route in topology.Routes:
+                records.append(RouteRecord(len(records), route, topology.TopologyName))
+        return cls(records)
+
+    def _add(self, record):
+        self.records.append(record)
+        self._by_endpoint.setdefault(record.source, []).append(record)
+        if record.target != record.source:
+            self._by_endpoint.setdefault(record.target, []).append(record)
+        self._by_device.setdefault(record.base_source, []).append(record)
+        if record.base_target != record.base_source:
+            self._by_device.setdefault(record.base_target, []).append(record)
+        self._by_source_device.setdefault(record.base_source, []).append(record)
+        self._by_target_device.setdefault(record.base_target, []).append(record)
+        self._by_type.setdefault(record.route_type, []).append(record)
+        self._by_topology.setdefault(record.topology, []).append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @staticmethod
+    def _merge(record_lists):
+        """
+        :param list list RouteRecord record_lists:
+        :return: list RouteRecord: de-duplicated, in reservation order
+        """
+        merged = {}
+        for records in record_lists:
+            for record in records:
+                merged[record.index] = record
+        return [merged[index] for index in sorted(merged)]
+
+    def by_type(self, route_type):
+        """
+        :param str route_type: 'bi' or 'uni' (any case)
+        :return: list RouteRecord
+        """
+        return list(self._by_type.get(route_type.lower(), ()))
+
+    def by_endpoint(self, endpoint):
+        """
+        :param str endpoint: full path of a port, e.g. 'Switch1/Port 1'
+        :return: list RouteRecord: routes starting or ending on that endpoint
+        """
+        return list(self._by_endpoint.get(endpoint, ()))
+
+    def by_device(self, device):
+        """
+        :param str device: root resource name
+        :return: list RouteRecord: routes with either side on that device
+        """
+        return list(self._by_device.get(device, ()))
+
+    def by_devices(self, devices, side='Either'):
+        """
+        :param set str devices: root resource names
+        :param str side: 'Source', 'Target' or 'Either' - which end of the route has to be on one of the devices
+        :return: list RouteRecord: matching routes
+        """
+        side = side.upper()
+        if side == 'SOURCE':
+            index = self._by_source_device
+        elif side == 'TARGET':
+            index = self._by_target_device
+        elif side == 'EITHER':
+            index = self._by_device
+        else:
+            raise ValueError("Route side must be one of 'Source', 'Target' or 'Either', got '{}'".format(side))
+        return self._merge(index.get(device, ()) for device in devices)
+
+    def by_topology(self, topology):
+        """
+        :param str topology: Topology Name
+        :return: list RouteRecord
+        """
+        return list(self._by_topology.get(topology, ()))
+
+    @staticmethod
+    def keys_of(route_infos):
+        """
+        :param list RouteInfo route_infos: e.g. ActiveRoutesInfo from GetReservationDetails
+        :return: set tuple: route keys, comparable with RouteRecord.key
+        """
+        return set(_route_key(route.Source, route.Target, getattr(route, 'RouteType', '') or 'bi')
+                   for route in route_infos)
+
+    @staticmethod
+    def reconcile(routes, active_keys, connect=True):
+        """
+        :param list RouteRecord routes: desired routes
+        :param set tuple active_keys: keys of the routes that are currently connected
+        :param bool connect: True returns the routes still to connect, False the routes still to disconnect
+        :return: list RouteRecord: only the routes whose state has to change
+        """
+        if connect:
+            return [route for route in routes if route.key not in active_keys]
+        return [route for route in routes if route.key in active_keys]
+
+    def select(self, devices=None, route_type='', side='Either'):
+        """
+        :param set str devices: root resource names, None for every device
+        :param str route_type: 'bi' / 'uni', '' for any type
+        :param str side: 'Source', 'Target' or 'Either' - which end of the route the devices are matched against
+        :return: list RouteRecord: routes matching both filters
+        """
+        if devices is None:
+            routes = self.by_type(route_type) if route_type else list(self.records)
+        else:
+            routes = self.by_devices(devices, side)
+            if route_type:
+                routes = [route for route in routes if route.route_type == route_type.lower()]
+        return routes
+
+
+class ChunkResult(object):
+    __slots__ = ('index', 'routes', 'error', 'duration')
+
+    def __init__(self, index, routes, error='', duration=0.0):
+        """
+        :param int index: 1 based chunk number
+        :param list RouteRecord routes: routes sent in this chunk
+        :param str error: API error message, '' if the chunk went through
+        :param float duration: seconds the API call took
+        """
+        self.index = index
+        self.routes = routes
+        self.error = error
+        self.duration = duration
+
+
+class BatchResult(object):
+    """
+    Outcome of a chunked route call.  Evaluates True if at least one chunk went through
+    """
+    def __init__(self, chunks=()):
+        """
+        :param list ChunkResult chunks:
+        """
+        self.chunks = list(chunks)
+
+    def __nonzero__(self):
+        return any(chunk.error == '' for chunk in self.chunks)
+
+    __bool__ = __nonzero__
+
+    @property
+    def succeeded_routes(self):
+        return [route for chunk in self.chunks if chunk.error == '' for route in chunk.routes]
+
+    @property
+    def failed_routes(self):
+        return [route for chunk in self.chunks if chunk.error != '' for route in chunk.routes]
+
+    @property
+    def failures(self):
+        """
+        :return: list tuple: (RouteRecord, error message) for every route that failed
+        """
+        return [(route, chunk.error) for chunk in self.chunks if chunk.error != '' for route in chunk.routes]
+
+
+class RouteBatcher(object):
+    """
+    Sends Connect / Disconnect route calls in chunks of chunk_size routes, with up to max_in_flight chunks
+    running at once.  A failing chunk only fails its own routes, and with isolate_failures it is split in halves
+    and re-sent until only the broken routes are left (about 2 * log2(chunk) extra calls per broken route).
+    Bisection stops right away when both halves fail the same way (server down, no permission, ...), and after
+    max_isolation_calls extra calls per chunk, the parts not isolated by then are reported failed as a whole.
+    Progress is written to the reservation output when there is more than one chunk
+    """
+    def __init__(self, api, reservation_id, chunk_size=0, max_in_flight=1, output=None, isolate_failures=True,
+                 max_isolation_calls=ISOLATION_CALLS_PER_CHUNK):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param int chunk_size: routes per API call, 0 sends everything in one call
+        :param int max_in_flight: chunks sent concurrently
+        :param function output: where progress goes, defaults to api.WriteMessageToReservationOutput
+        :param bool isolate_failures: bisect failed chunks to find the failing routes, retrying the rest in bulk
+        :param int max_isolation_calls: extra calls allowed to bisect one failed chunk
+        """
+        self.api = api
+        self.reservation_id = reservation_id
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.output = output or api.WriteMessageToReservationOutput
+        self.isolate_failures = isolate_failures
+        self.max_isolation_calls = max_isolation_calls
+
+    def chunk(self, routes):
+        """
+        :param list RouteRecord routes:
+        :return: list list RouteRecord: routes split into chunk_size pieces
+        """
+        if self.chunk_size <= 0 or len(routes) <= self.chunk_size:
+            return [routes] if len(routes) > 0 else []
+        return [routes[i:i + self.chunk_size] for i in range(0, len(routes), self.chunk_size)]
+
+    def connect(self, routes, mapping_type, label='routes'):
+        """
+        :param list RouteRecord routes:
+        :param str mapping_type: 'bi' or 'uni'
+        :param str label: how the routes are named in the progress messages
+        :return: BatchResult
+        """
+        def _send(chunk):
+            self.api.ConnectRoutesInReservation(reservationId=self.reservation_id,
+                                                endpoints=_route_endpoints(chunk),
+                                                mappingType=mapping_type)
+        return self._run(routes, _send, 'Connecting {}'.format(label))
+
+    def disconnect(self, routes, label='routes'):
+        """
+        :param list RouteRecord routes:
+        :param str label: how the routes are named in the progress messages
+        :return: BatchResult
+        """
+        def _send(chunk):
+            self.api.DisconnectRoutesInReservation(reservationId=self.reservation_id,
+                                                   endpoints=_route_endpoints(chunk))
+        return self._run(routes, _send, 'Disconnecting {}'.format(label))
+
+    def _run(self, routes, send, label):
+        """
+        :param list RouteRecord routes:
+        :param function send: makes the API call for one chunk
+        :param str label: progress message prefix
+        :return: BatchResult
+        """
+        chunks = self.chunk(routes)
+        total = len(chunks)
+        w2output = self.output
+
+        def _send_chunk(numbered_chunk):
+            index, chunk = numbered_chunk
+            start = time()
+            result = ChunkResult(index, chunk)
+            try:
+                send(chunk)
+            except Exception as err:
+                result.error = err.message
+            result.duration = time() - start
+
+            if result.error != '' and self.isolate_failures and len(chunk) > 1 and self.max_isolation_calls >= 2:
+                results, calls = self._isolate(index, chunk, result.error, send, self.max_isolation_calls)
+                failures = [each for each in results if each.error != '']
+                if len(failures) == 1 and len(failures[0].routes) == len(chunk):
+                    w2output(reservationId=self.reservation_id,
+                             message='{}: chunk {}/{} ({} routes) failed, not caused by single routes: {}'.format(
+                                 label, index, total, len(chunk), failures[0].error))
+                    return results
+                w2output(reservationId=self.reservation_id,
+                         message='{}: chunk {}/{} ({} routes) failed, {} failing route(s) left after {} more '
+                                 'calls'.format(label, index, total, len(chunk),
+                                                sum(len(each.routes) for each in failures), calls))
+                for failure in failures:
+                    if len(failure.routes) == 1:
+                        message = '{}: {} <--> {} failed: {}'.format(label, failure.routes[0].source,
+                                                                     failure.routes[0].target, failure.error)
+                    else:
+                        message = '{}: {} routes from {} <--> {} failed, not isolated: {}'.format(
+                            label, len(failure.routes), failure.routes[0].source, failure.routes[0].target,
+                            failure.error)
+                    w2output(reservationId=self.reservation_id, message=message)
+                return results
+
+            if result.error != '':
+                w2output(reservationId=self.reservation_id,
+                         message='{}: chunk {}/{} ({} routes) failed: {}'.format(label, index, total, len(chunk),
+                                                                                 result.error))
+            elif total > 1:
+                w2output(reservationId=self.reservation_id,
+                         message='{}: chunk {}/{} ({} routes) done in {:.1f}s'.format(label, index, total,
+                                                                                      len(chunk), result.duration))
+            return [result]
+
+        chunk_results = _thread_map(_send_chunk, enumerate(chunks, 1), self.max_in_flight)
+        return BatchResult(result for results in chunk_results for result in results)
+
+    @staticmethod
+    def _isolate(index, routes, error, send, max_calls=ISOLATION_CALLS_PER_CHUNK):
+        """
+        bisects a failed chunk: each half is re-sent in one call, halves that fail again are split further
+        until the failing routes are on their own.
+        gives up when both halves of the first split fail with the same error, or when the next split would
+        go over max_calls
+        :param int index: chunk number
+        :param list RouteRecord routes: routes of the failed call
+        :param str error: error of the failed call
+        :param function send: makes the API call for a list of routes
+        :param int max_calls: extra API calls allowed
+        :return: tuple list ChunkResult, int: results in reservation order (failing routes on their own as far as
+                 they were isolated), API calls made
+        """
+        results = []
+        calls = 0
+        failed = [(routes, error)]
+        while failed:
+            part, error = failed.pop(0)
+            if len(part) == 1 or calls + 2 > max_calls:
+                results.append(ChunkResult(index, part, error))
+                continue
+            middle = len(part) // 2
+            half_errors = []
+            for half in (part[:middle], part[middle:]):
+                start = time()
+                calls += 1
+                try:
+                    send(half)
+                    results.append(ChunkResult(index, half, duration=time() - start))
+                except Exception as err:
+                    failed.append((half, err.message))
+                    half_errors.append(err.message)
+            if calls == 2 and len(half_errors) == 2 and half_errors[0] == half_errors[1]:
+                return [ChunkResult(index, routes, half_errors[0])], calls  # the whole call fails, not a route
+        results.sort(key=lambda result: result.routes[0].index)
+        return results, calls
+
+
+class SwitchWaveScheduler(object):
+    """
+    Sends route calls grouped by the L1 switches the routes' Segments run through.
+    Wave 1 sends the routes that stay on a single switch, one batch per switch, switches concurrently.
+    Wave 2 sends the routes spanning several switches (or with no Segments yet), grouped so that routes sharing
+    a switch are in the same batch, groups concurrently.  Routes contending for a switch (and so for its ports)
+    are never sent at the same time, and wall time follows the busiest switch rather than the route total
+    """
+    def __init__(self, batcher, max_parallel=DEFAULT_MAX_WORKERS):
+        """
+        :param RouteBatcher batcher: sends each batch (chunking & failure isolation as configured)
+        :param int max_parallel: batches sent at once
+        """
+        self.batcher = batcher
+        self.max_parallel = max_parallel
+
+    @staticmethod
+    def switches_of(route):
+        """
+        :param RouteRecord route:
+        :return: frozenset str: resources the route's Segments run through, other than its own two devices
+        """
+        devices = (route.base_source, route.base_target)
+        switches = set()
+        for segment in getattr(route.info, 'Segments', None) or []:
+            for endpoint in (segment.Source, segment.Target):
+                resource = endpoint.split('/')[0]
+                if resource not in devices:
+                    switches.add(resource)
+        return frozenset(switches)
+
+    def plan(self, routes):
+        """
+        :param list RouteRecord routes:
+        :return: list list tuple: waves, each a list of (switch names, routes) batches that can run concurrently
+        """
+        single = OrderedDict()
+        parent = {}
+        spanning = []
+
+        def find(switch):
+            while parent[switch] != switch:
+                parent[switch] = parent[parent[switch]]
+                switch = parent[switch]
+            return switch
+
+        for route in routes:
+            switches = self.switches_of(route)
+            if len(switches) == 1:
+                single.setdefault(next(iter(switches)), []).append(route)
+                continue
+            spanning.append((route, switches))
+            for switch in switches:
+                parent.setdefault(switch, switch)
+            for switch in switches:
+                parent[find(switch)] = find(next(iter(switches)))
+
+        groups = OrderedDict()
+        for route, switches in spanning:
+            root = find(next(iter(switches))) if switches else None
+            groups.setdefault(root, ([], set()))
+            groups[root][0].append(route)
+            groups[root][1].update(switches)
+
+        waves = []
+        if single:
+            waves.append([((switch,), batch) for switch, batch in single.items()])
+        if groups:
+            waves.append([(tuple(sorted(switches)), batch) for batch, switches in groups.values()])
+        return waves
+
+    def connect(self, routes, mapping_type, label='routes'):
+        """
+        :param list RouteRecord routes:
+        :param str mapping_type: 'bi' or 'uni'
+        :param str label: how the routes are named in the progress messages
+        :return: BatchResult
+        """
+        return self._run(routes, lambda batch, name: self.batcher.connect(batch, mapping_type, name), label)
+
+    def disconnect(self, routes, label='routes'):
+        """
+        :param list RouteRecord routes:
+        :param str label: how the routes are named in the progress messages
+        :return: BatchResult
+        """
+        return self._run(routes, lambda batch, name: self.batcher.disconnect(batch, name), label)
+
+    def _run(self, routes, send, label):
+        """
+        :param list RouteRecord routes:
+        :param function send: callable(routes, label) returning a BatchResult
+        :param str label:
+        :return: BatchResult
+        """
+        waves = self.plan(routes)
+        if len(waves) == 1 and len(waves[0]) == 1:
+            return send(routes, label)  # nothing to spread, a single batch as before
+
+        chunks = []
+        for number, wave in enumerate(waves, 1):
+            self.batcher.output(reservationId=self.batcher.reservation_id,
+                                message='{}: wave {}/{}, {} routes over {} switch group(s)'.format(
+                                    label, number, len(waves), sum(len(batch) for _, batch in wave), len(wave)))
+
+            def _send(switch_batch):
+                switches, batch = switch_batch
+                return send(batch, '{} on {}'.format(label, ', '.join(switches) or 'unresolved routes'))
+
+            for result in _thread_map(_send, wave, self.max_parallel):
+                chunks.extend(result.chunks)
+        return BatchResult(chunks)
+
+
+class ReservationSnapshot(object):
+    """
+    One GetReservationDetails response shared by every plugin stage working on the same sandbox.
+    Fetched on first use; refresh() re-reads it, invalidate() drops it so the next reader fetches again.
+    Connecting / Disconnecting routes doesn't change which routes are in the reservation, so only callers that
+    add or remove resources/routes (or need live route state) have to refresh
+    """
+    _registry = {}
+    _registry_lock = Lock()
+
+    def __init__(self, api, reservation_id, sandbox=None):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param Sandbox sandbox: when given, its automation_api is read on every call instead of api
+        """
+        self._api = api
+        self._sandbox = sandbox
+        self.reservation_id = reservation_id
+        self._description = None
+        self._route_table = None
+        self._connected = None  # RouteRecord.key -> RouteRecord connected by the plugins, None until one connects
+        self._lock = Lock()
+
+    @property
+    def api(self):
+        """
+        the sandbox's current automation_api, so calls still go through an ApiCallRecorder attached after the
+        snapshot was built
+        :return: CloudShellAPISession
+        """
+        return self._sandbox.automation_api if self._sandbox is not None else self._api
+
+    @classmethod
+    def for_sandbox(cls, sandbox):
+        """
+        returns the snapshot shared by every plugin working on this sandbox
+        :param Sandbox sandbox:
+        :return: ReservationSnapshot
+        """
+        with cls._registry_lock:
+            snapshot = cls._registry.get(sandbox.id)
+            if snapshot is None:
+                snapshot = cls(sandbox.automation_api, sandbox.id, sandbox)
+                cls._registry[sandbox.id] = snapshot
+        return snapshot
+
+    @property
+    def description(self):
+        """
+        :return: ReservationDescriptionInfo
+        """
+        with self._lock:
+            if self._description is None:
+                self._description = self.api.GetReservationDetails(self.reservation_id).ReservationDescription
+            return self._description
+
+    @property
+    def topology_routes(self):
+        """
+        :return: TopologiesRouteInfo
+        """
+        return self.description.TopologiesRouteInfo
+
+    @property
+    def active_routes(self):
+        """
+        :return: list RouteInfo: ActiveRoutesInfo, the routes connected when the snapshot was taken
+        """
+        return self.description.ActiveRoutesInfo or []
+
+    def active_route_keys(self):
+        """
+        :return: set tuple: keys of the connected routes, comparable with RouteRecord.key
+        """
+        return RouteTable.keys_of(self.active_routes)
+
+    @property
+    def requested_routes(self):
+        """
+        :return: list RouteInfo: RequestedRoutesInfo, includes 'cable' requests
+        """
+        return self.description.RequestedRoutesInfo
+
+    def routes(self):
+        """
+        :return: list RouteInfo: every Topology route in the reservation
+        """
+        return _flatten_routes(self.topology_routes)
+
+    def route_table(self):
+        """
+        :return: RouteTable: indexed Topology routes, built once per fetch
+        """
+        description = self.description
+        with self._lock:
+            if self._route_table is None:
+                self._route_table = RouteTable.from_topologies(description.TopologiesRouteInfo)
+            return self._route_table
+
+    def read_active_route_keys(self):
+        """
+        reads the reservation's current ActiveRoutesInfo, leaving the shared details (and route table) as they are
+        :return: set tuple: keys of the connected routes, comparable with RouteRecord.key
+        """
+        description = self.api.GetReservationDetails(self.reservation_id).ReservationDescription
+        return RouteTable.keys_of(description.ActiveRoutesInfo or [])
+
+    def record_connected(self, routes):
+        """
+        notes routes the plugins connected, for wait_for_routes
+        :param list RouteRecord routes:
+        :return: None
+        """
+        with self._lock:
+            if self._connected is None:
+                self._connected = OrderedDict()
+            for route in routes:
+                self._connected[route.key] = route
+
+    def connected_routes(self):
+        """
+        :return: list RouteRecord: routes the plugins connected on this sandbox, None if no plugin connected any
+        """
+        with self._lock:
+            return None if self._connected is None else list(self._connected.values())
+
+    def refresh(self):
+        """
+        re-reads the reservation now
+        :return: ReservationSnapshot self
+        """
+        self.invalidate()
+        self.description
+        return self
+
+    def invalidate(self):
+        """
+        drops the cached details, the next reader fetches them again
+        :return: None
+        """
+        with self._lock:
+            self._description = None
+            self._route_table = None
+
+
+class RouteWaitResult(object):
+    """
+    Outcome of waiting on routes. Evaluates True if every route reached the wanted state before the deadline
+    """
+    def __init__(self, routes, connected=True):
+        """
+        :param list RouteRecord routes: routes waited on
+        :param bool connected: True when waiting for the routes to come up, False for them to go down
+        """
+        self.routes = list(routes)
+        self.connected = connected
+        self.done = OrderedDict()  # RouteRecord.key -> seconds until the route was seen in the wanted state
+        self.elapsed = 0.0
+        self.polls = 0
+
+    def __nonzero__(self):
+        return len(self.pending) == 0
+
+    __bool__ = __nonzero__
+
+    @property
+    def pending(self):
+        """
+        :return: list RouteRecord: routes not (yet) in the wanted state
+        """
+        return [route for route in self.routes if route.key not in self.done]
+
+    @property
+    def throughput(self):
+        """
+        :return: float: routes per second that reached the wanted state
+        """
+        return len(self.done) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def stragglers(self, factor=2.0):
+        """
+        :param float factor: a route is slow when it took longer than factor times the median route
+        :return: list RouteRecord: routes still pending, then the slow ones, slowest first
+        """
+        times = sorted(self.done.values())
+        slow = []
+        if times:
+            limit = times[len(times) // 2] * factor
+            slow = sorted([route for route in self.routes if self.done.get(route.key, 0) > limit],
+                          key=lambda route: self.done[route.key], reverse=True)
+        return self.pending + slow
+
+
+class RouteWaiter(object):
+    """
+    Polls the reservation's active routes until the given routes are all up (or down), or a deadline passes.
+    The poll interval starts at min_interval, stays short while routes keep coming up, backs off towards
+    max_interval while nothing changes, and is cut short when the current throughput says the rest is close
+    """
+    def __init__(self, snapshot, output=None, min_interval=1.0, max_interval=15.0):
+        """
+        :param ReservationSnapshot snapshot: its reservation's active routes are read on every poll
+        :param function output: where progress goes, defaults to the API's WriteMessageToReservationOutput
+        :param float min_interval: seconds
+        :param float max_interval: seconds
+        """
+        self.snapshot = snapshot
+        self.output = output or snapshot.api.WriteMessageToReservationOutput
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+
+    def _write(self, message):
+        self.output(reservationId=self.snapshot.reservation_id, message=message)
+
+    def wait(self, routes, timeout=300, connected=True):
+        """
+        :param list RouteRecord routes:
+        :param float timeout: seconds to wait at most
+        :param bool connected: wait for the routes to be active (True) or inactive (False)
+        :return: RouteWaitResult
+        """
+        result = RouteWaitResult(routes, connected)
+        wanted = 'up' if connected else 'down'
+        start = time()
+        deadline = start + timeout
+        interval = self.min_interval
+
+        while True:
+            active_keys = self.snapshot.read_active_route_keys()
+            result.polls += 1
+            now = time()
+            result.elapsed = now - start
+
+            before = len(result.done)
+            for route in result.pending:
+                if (route.key in active_keys) == connected:
+                    result.done[route.key] = result.elapsed
+            progress = len(result.done) - before
+
+            remaining = len(result.routes) - len(result.done)
+            if remaining == 0 or now >= deadline:
+                break
+
+            if progress:
+                self._write('Routes {}: {}/{} ({:.1f}/s)'.format(wanted, len(result.done), len(result.routes),
+                                                                result.throughput))
+                interval = self.min_interval
+                if result.throughput:
+                    # at the current rate the rest may be done before the next poll
+                    interval = max(min(interval, remaining / result.throughput), self.min_interval / 4)
+            else:
+                interval = min(interval * 1.5, self.max_interval)
+            sleep(max(min(interval, deadline - now), 0))
+
+        if result:
+            self._write('All {} Routes {} in {:.1f}s ({:.1f}/s, {} polls)'.format(
+                len(result.routes), wanted, result.elapsed, result.throughput, result.polls))
+        else:
+            stragglers = result.pending
+            self._write('Timed out after {:.0f}s: {} of {} Routes still not {}'.format(
+                result.elapsed, len(stragglers), len(result.routes), wanted))
+            for route in stragglers[:10]:
+                self._write('  {} <--> {}'.format(route.source, route.target))
+            if len(stragglers) > 10:
+                self._write('  ... and {} more'.format(len(stragglers) - 10))
+        return result
+
+
+class ResourceRecord(object):
+    __slots__ = ('name', 'family', 'model', 'details', 'fetched')
+
+    def __init__(self, name, family='', model='', details=None, fetched=False):
+        """
+        :param str name: Full name of the resource as reserved in the sandbox
+        :param str family: Resource Family Name (upper case)
+        :param str model: Resource Model Name (upper case)
+        :param ResourceInfo details: Raw GetResourceDetails response, None if not fetched yet or the lookup failed
+        :param bool fetched: True once GetResourceDetails was called for the resource
+        """
+        self.name = name
+        self.family = family
+        self.model = model
+        self.details = details
+        self.fetched = fetched
+
+
+class ResourceIndex(object):
+    """
+    Reservation scoped lookup of resource Family / Model / Name.
+    Family & Model come from the reservation's resources, GetResourceDetails is only called (concurrently, once per
+    resource) for resources whose attributes are needed. Shared by every plugin working on the same sandbox, and
+    rebuilt when the sandbox's components are refreshed (deployed Apps show up as resources after Provisioning)
+    """
+    _registry = {}
+    _registry_lock = Lock()
+
+    def __init__(self, api, resources, max_workers=DEFAULT_MAX_WORKERS, store=None):
+        """
+        :param CloudShellAPISession api:
+        :param resources: dict of name -> ReservedResourceInfo (sandbox.components.resources), or a list of names
+                          whose Family / Model are then looked up with GetResourceDetails
+        :param int max_workers: max concurrent GetResourceDetails calls
+        :param JsonFileStore store: optional persistent store (MetadataCache) of the looked up Family / Model
+        """
+        self.api = api
+        self.max_workers = max_workers
+        self.store = store
+        self.resources = resources
+        self.records = OrderedDict()
+        self._by_family = {}
+        self._by_model = {}
+        self._by_upper_name = {}
+        self._details_lock = Lock()
+
+        reserved = resources.values() if isinstance(resources, dict) else list(resources)
+        to_fetch = []
+        for resource in reserved:
+            if getattr(resource, 'ResourceFamilyName', None) is not None:
+                self._add(ResourceRecord(resource.Name, resource.ResourceFamilyName.upper(),
+                                         resource.ResourceModelName.upper()))
+                continue
+            stored = store.get('resource:{}'.format(resource)) if store else None
+            if stored is not None:
+                self._add(ResourceRecord(resource, stored[0], stored[1]))
+            else:
+                to_fetch.append(resource)
+
+        for record in _thread_map(lambda name: self._fetch(api, name), to_fetch, max_workers):
+            self._add(record)
+            if store and record.details is not None:
+                store.set('resource:{}'.format(record.name), [record.family, record.model])
+
+    def _add(self, record):
+        self.records[record.name] = record
+        self._by_family.setdefault(record.family, set()).add(record.name)
+        self._by_model.setdefault(record.model, set()).add(record.name)
+        self._by_upper_name[record.name.upper()] = record.name
+
+    @classmethod
+    def for_sandbox(cls, sandbox, refresh=False, store=None):
+        """
+        returns the index for this sandbox, building it on first use
+        :param Sandbox sandbox:
+        :param bool refresh: drop any existing index and fetch again
+        :param JsonFileStore store: persistent Family / Model store used when the index is built
+        :return: ResourceIndex
+        """
+        resources = sandbox.components.resources
+        with cls._registry_lock:
+            index = cls._registry.get(sandbox.id)
+            # refresh_components() replaces the resources dict
+            if index is None or refresh or index.resources is not resources or len(index) != len(resources):
+                index = cls(sandbox.automation_api, resources, store=store)
+                cls._registry[sandbox.id] = index
+        return index
+
+    @classmethod
+    def invalidate(cls, sandbox_id):
+        """
+        :param str sandbox_id:
+        :return: None
+        """
+        with cls._registry_lock:
+            cls._registry.pop(sandbox_id, None)
+
+    @staticmethod
+    def _fetch(api, name):
+        """
+        :param CloudShellAPISession api:
+        :param str name:
+        :return: ResourceRecord
+        """
+        try:
+            details = api.GetResourceDetails(name)
+        except Exception:
+            return ResourceRecord(name, fetched=True)
+        return ResourceRecord(name, details.ResourceFamilyName.upper(), details.ResourceModelName.upper(), details,
+                              fetched=True)
+
+    def load_details(self, names):
+        """
+        fetches GetResourceDetails, concurrently, for the named resources not fetched yet
+        :param names: resource names
+        :return: None
+        """
+        with self._details_lock:
+            missing = [name for name in names if name in self.records and not self.records[name].fetched]
+            for record in _thread_map(lambda name: self._fetch(self.api, name), missing, self.max_workers):
+                self.records[record.name].details = record.details
+                self.records[record.name].fetched = True
+
+    def attributes(self, name):
+        """
+        :param str name: resource name
+        :return: dict: upper case attribute name -> value, 2nd gen 'Model.Attribute' names are also under 'ATTRIBUTE'
+        """
+        self.load_details([name])
+        record = self.records.get(name)
+        attributes = {}
+        if record is not None and record.details is not None:
+            for attribute in getattr(record.details, 'ResourceAttributes', None) or []:
+                attributes.setdefault(attribute.Name.split('.')[-1].upper(), attribute.Value)
+                attributes[attribute.Name.upper()] = attribute.Value
+        return attributes
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def names(self):
+        """
+        :return: list str: every resource name, in reservation order
+        """
+        return list(self.records.keys())
+
+    def get(self, name):
+        """
+        :param str name:
+        :return: ResourceRecord or None
+        """
+        return self.records.get(name)
+
+    def get_family(self, name):
+        """
+        :param str name:
+        :return: str: upper case Family Name, '' if unknown
+        """
+        record = self.records.get(name)
+        return record.family if record else ''
+
+    def get_model(self, name):
+        """
+        :param str name:
+        :return: str: upper case Model Name, '' if unknown
+        """
+        record = self.records.get(name)
+        return record.model if record else ''
+
+    def by_family(self, family):
+        """
+        :param str family:
+        :return: set str: names of resources of this Family
+        """
+        return set(self._by_family.get(family.upper(), ()))
+
+    def by_model(self, model):
+        """
+        :param str model:
+        :return: set str: names of resources of this Model
+        """
+        return set(self._by_model.get(model.upper(), ()))
+
+    def by_name(self, name_part):
+        """
+        :param str name_part: case insensitive substring of the resource name
+        :return: set str: names of resources containing name_part
+        """
+        name_part = name_part.upper()
+        return set(name for name in self.records if name_part in name.upper())
+
+    def select(self, selector):
+        """
+        :param DeviceSelector selector:
+        :return: list str: names of the resources the selector matches, in reservation order
+        """
+        selected = selector.select(self)
+        return [name for name in self.records if name in selected]
+
+
+def _command_names(command_list):
+    """
+    :param list ResourceCommandListInfo command_list:
+    :return: frozenset str: the command names
+    """
+    return frozenset(each.Name for each in command_list)
+
+
+class MetadataCache(object):
+    """
+    Key/value store in a local sqlite database, with a TTL per entry, shared by every sandbox script process on the
+    execution server. Same get / set as JsonFileStore, keys are '<kind>:<resource or model>' and the kind picks the
+    TTL (METADATA_TTLS).
+    Each thread gets its own connection, the database runs in WAL mode so readers don't wait on a writer. Being a
+    cache, a failed read is a miss and a failed write is skipped (the first error is logged to stderr), and a
+    database that can't be set up at all leaves the cache disabled
+    """
+    _SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        stored REAL NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS metadata_expires ON metadata (expires);
+    '''
+
+    def __init__(self, path=DEFAULT_METADATA_CACHE_PATH, ttls=None, default_ttl=METADATA_DEFAULT_TTL):
+        """
+        :param str path: sqlite database, created if missing
+        :param dict ttls: key kind -> seconds, overriding METADATA_TTLS
+        :param float default_ttl: seconds for kinds not in ttls
+        """
+        self.path = path
+        self.ttls = dict(METADATA_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.enabled = True
+        self._warned = False
+        self._local = local()
+        for attempt in range(3):
+            try:
+                self._connection().executescript(self._SCHEMA)
+                break
+            except sqlite3.OperationalError as err:
+                # several processes creating the database at once see 'schema has changed' / 'locked'
+                self._local.db = None
+                if attempt == 2:
+                    self.enabled = False
+                    self._warn(err)
+                sleep(0.1)
+            except sqlite3.Error as err:
+                self.enabled = False
+                self._warn(err)
+                break
+        self.purge()
+
+    def _warn(self, err):
+        if not self._warned:
+            self._warned = True
+            sys.stderr.write('Metadata cache {}: {}\n'.format(self.path, err))
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=METADATA_LOCK_TIMEOUT, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def _execute(self, sql, params=()):
+        """
+        :param str sql: a single statement, each one is atomic on its own
+        :param tuple params:
+        :return: list tuple rows, empty if the cache is disabled or the statement failed
+        """
+        if not self.enabled:
+            return []
+        try:
+            return self._connection().execute(sql, params).fetchall()
+        except sqlite3.Error as err:
+            self._warn(err)
+            return []
+
+    def ttl(self, key):
+        """
+        :param str key:
+        :return: float: seconds an entry under this key is kept
+        """
+        return self.ttls.get(key.split(':', 1)[0], self.default_ttl)
+
+    def get(self, key):
+        """
+        :param str key:
+        :return: stored value, None if missing or expired
+        """
+        rows = self._execute('SELECT value FROM metadata WHERE key = ? AND expires > ?', (key, time()))
+        return json_loads(rows[0][0]) if rows else None
+
+    def set(self, key, value, ttl=None):
+        """
+        :param str key:
+        :param value: any JSON serializable value
+        :param float ttl: seconds, defaults to the TTL of the key's kind
+        :return: None
+        """
+        now = time()
+        self._execute('INSERT OR REPLACE INTO metadata (key, value, stored, expires) VALUES (?, ?, ?, ?)',
+                      (key, json_dumps(value), now, now + (self.ttl(key) if ttl is None else ttl)))
+
+    def invalidate(self, key=None, prefix=None):
+        """
+        drops entries, e.g. invalidate(prefix='driver_commands:') after a driver upgrade
+        :param str key: one entry
+        :param str prefix: every entry whose key starts with it
+        :return: None (everything is dropped when neither is given)
+        """
+        if key is not None:
+            self._execute('DELETE FROM metadata WHERE key = ?', (key,))
+        elif prefix is not None:
+            self._execute("DELETE FROM metadata WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        else:
+            self._execute('DELETE FROM metadata')
+
+    def purge(self):
+        """
+        drops the expired entries
+        :return: None
+        """
+        self._execute('DELETE FROM metadata WHERE expires <= ?', (time(),))
+
+
+class CommandCatalog(object):
+    """
+    Caches the command names resources expose.
+    Driver commands are keyed by Resource Model - every resource of a model runs the same driver.
+    Connected commands depend on what the resource is wired to (PDU, console), so they are kept per resource.
+    Service commands are keyed by Service Model Name.
+    An optional store (JsonFileStore, MetadataCache) keeps the lists across runs
+    """
+    _registry = {}
+    _registry_lock = Lock()
+
+    def __init__(self, api, store=None):
+        """
+        :param CloudShellAPISession api:
+        :param JsonFileStore store: optional persistent store for the command lists
+        """
+        self.api = api
+        self.store = store
+        self._by_model = {}
+        self._by_resource = {}
+        self._connected = {}
+        self._services = {}
+        self._locks = {}
+        self._locks_lock = Lock()
+
+    @classmethod
+    def for_sandbox(cls, sandbox, store=None):
+        """
+        returns the catalog for this sandbox, building it on first use
+        :param Sandbox sandbox:
+        :param JsonFileStore store: attached to the catalog if it doesn't have one yet
+        :return: CommandCatalog
+        """
+        with cls._registry_lock:
+            catalog = cls._registry.get(sandbox.id)
+            if catalog is None:
+                catalog = cls(sandbox.automation_api, store)
+                cls._registry[sandbox.id] = catalog
+            elif catalog.store is None:
+                catalog.store = store
+        return catalog
+
+    @classmethod
+    def invalidate(cls, sandbox_id):
+        """
+        :param str sandbox_id:
+        :return: None
+        """
+        with cls._registry_lock:
+            cls._registry.pop(sandbox_id, None)
+
+    def _key_lock(self, key):
+        """
+        one lock per cache key, so resources of the same model wait on a single lookup
+        while different models are fetched concurrently
+        :param tuple key:
+        :return: Lock
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(key, Lock())
+
+    def driver_commands(self, resource_name, model=''):
+        """
+        :param str resource_name:
+        :param str model: Resource Model Name, '' if unknown (cached per resource instead)
+        :return: frozenset str: Driver commands of the resource
+        """
+        if model == '':
+            with self._key_lock(('resource', resource_name)):
+                if resource_name not in self._by_resource:
+                    self._by_resource[resource_name] = _command_names(
+                        self.api.GetResourceCommands(resource_name).Commands)
+                return self._by_resource[resource_name]
+
+        with self._key_lock(('model', model)):
+            if model not in self._by_model:
+                self._by_model[model] = self._stored('driver_commands:{}'.format(model),
+                                                     lambda: self.api.GetResourceCommands(resource_name).Commands)
+            return self._by_model[model]
+
+    def _stored(self, key, fetch):
+        """
+        :param str key: store key
+        :param function fetch: returns the list of ResourceCommandInfo, only called when the store doesn't have it
+        :return: frozenset str: command names
+        """
+        stored = self.store.get(key) if self.store else None
+        if stored is not None:
+            return frozenset(stored)
+        names = _command_names(fetch())
+        if self.store:
+            self.store.set(key, sorted(names))
+        return names
+
+    def connected_commands(self, resource_name):
+        """
+        :param str resource_name:
+        :return: frozenset str: Connected commands of the resource
+        """
+        with self._key_lock(('connected', resource_name)):
+            if resource_name not in self._connected:
+                self._connected[resource_name] = self._stored(
+                    'connected_commands:{}'.format(resource_name),
+                    lambda: self.api.GetResourceConnectedCommands(resource_name).Commands)
+            return self._connected[resource_name]
+
+    def service_commands(self, service_name):
+        """
+        :param str service_name: Service Model Name
+        :return: frozenset str: commands of the service
+        """
+        with self._key_lock(('service', service_name)):
+            if service_name not in self._services:
+                self._services[service_name] = self._stored(
+                    'service_commands:{}'.format(service_name),
+                    lambda: self.api.GetServiceCommands(service_name).Commands)
+            return self._services[service_name]
+
+
+class DeviceCommandResult(object):
+    __slots__ = ('device', 'command', 'success', 'error', 'duration')
+
+    def __init__(self, device, command, success=False, error='', duration=0.0):
+        """
+        :param str device: Resource (or Service Alias) the command was run on
+        :param str command: Command Name
+        :param bool success: True if the command was called without error
+        :param str error: Error message when success is False
+        :param float duration: Seconds spent on this device
+        """
+        self.device = device
+        self.command = command
+        self.success = success
+        self.error = error
+        self.duration = duration
+
+
+class CommandRunResult(object):
+    """
+    Aggregated per-device results of a fanned out command.
+    Evaluates True if the command was called successfully on at least one device, like the old Bool return
+    """
+    def __init__(self, command, device_results=()):
+        """
+        :param str command: Command Name
+        :param list DeviceCommandResult device_results: only devices the command was available on
+        """
+        self.command = command
+        self.devices = OrderedDict((each.device, each) for each in device_results)
 
+    def __nonzero__(self):
+        return any(each.success for each in self.devices.values())
 
-class ServiceCommandHelper(object):
-    def __init__(self, command_name='', service_name='', run_type='enqueue', inputs={}):
-        """
+    __bool__ = __nonzero__
 
-        :param string command_name: Name of the Command on the Service to Run
-        :param string service_name: Name of the Service to Use
-        :param string run_type: Enqueue or Execute this command (fire and forget vs wait to complete)
-        :param OrderedDict inputs: Key == Input Name, Value == Input Value
-        """
-        self.command_name = command_name
-        self.service_name = service_name.upper()
-        self.run_type = run_type.upper()
-        self.parameters = inputs
+    def __len__(self):
+        return len(self.devices)
 
+    @property
+    def succeeded(self):
+        return [each for each in self.devices.values() if each.success]
 
-class RouteCommandHelper(object):
-    def __init__(self, device_name='', device_family='', device_model='', route_type='', evaluate_connection_by='Either'):
+    @property
+    def failed(self):
+        return [each for each in self.devices.values() if not each.success]
+
+    def summary(self):
         """
-        Designed to allow qualifiers to be used with determining which routes to activate or deactivate
-        :param device_name: Name of the Exact Device to use
-        :param device_family: Name of the Device Family
-        :param device_model:
-        :param route_type:
-        :param str evaluate_connection_by:  Judge Route by 'Source', 'Target' or 'Either'
+        :return: str: one line report, e.g. "power_on: 198/200 devices succeeded in 12.40s"
         """
-        self.device_name = device_name.upper()
-        self.device_family = device_family.upper()
-        self.device_model = device_model.upper()
-        self.route_type = route_type.upper()
-        self.evaluate_by = evaluate_connection_by.upper()
+        total_time = max([each.duration for each in self.devices.values()] or [0.0])
+        return '{}: {}/{} devices succeeded in {:.2f}s'.format(self.command, len(self.succeeded), len(self.devices),
+                                                               total_time)
 
 
 class SandboxOrchPlugins(object):
-    def __init__(self):
-        pass
+    def __init__(self, command_cache_path=None, route_chunk_size=0, routes_in_flight=1, reconcile_routes=False,
+                 isolate_route_failures=True, switch_waves=False, route_wait_timeout=300, metadata_cache=None):
+        """
+        :param str command_cache_path: optional JSON file keeping command lists across sandbox runs
+        :param metadata_cache: MetadataCache (or True for one at DEFAULT_METADATA_CACHE_PATH) keeping Family / Model
+                               and command lists across sandbox runs, used instead of command_cache_path
+        :param int route_chunk_size: max routes per Connect/Disconnect call, 0 sends each route list in one call
+        :param int routes_in_flight: how many route chunks are sent at once
+        :param bool reconcile_routes: read the current route state first and only connect routes that are down /
+                                      disconnect routes that are up
+        :param bool isolate_route_failures: when a route call fails, bisect it to find the failing routes and
+                                            still connect / disconnect the rest
+        :param bool switch_waves: send routes on different L1 switches concurrently (SwitchWaveScheduler), this
+                                  makes several Connect / Disconnect calls on the reservation at the same time
+        :param float route_wait_timeout: seconds wait_for_routes waits for the routes to come up
+        """
+        if metadata_cache is True:
+            metadata_cache = MetadataCache()
+        self.metadata_store = metadata_cache or (JsonFileStore(command_cache_path) if command_cache_path else None)
+        self.route_chunk_size = route_chunk_size
+        self.routes_in_flight = routes_in_flight
+        self.reconcile_routes = reconcile_routes
+        self.isolate_route_failures = isolate_route_failures
+        self.switch_waves = switch_waves
+        self.route_wait_timeout = route_wait_timeout
 
     def _build_cmd_list_from_cmdlistinfo(self, command_list):
         """
         builds
         :param list ResourceCommandListInfo command_list:
-        :return: list commands:
+        :return: frozenset commands:
         """
-        commands = []
-        for each in command_list:
-            commands.append(each.Name)
-
-        return commands
+        return _command_names(command_list)
 
     def _build_resource_command_lists(self, sandbox, device_name):
         """
 
         :param Sandbox sandbox:
         :param str device_name:
-        :return: list str reg_commands, con_commands:  Returns two lists, Regular Commands & Connected Commands
+        :return: frozenset str reg_commands, con_commands:  Returns two sets, Regular Commands & Connected Commands
         """
-        reg_commands = self._build_cmd_list_from_cmdlistinfo(
-            sandbox.automation_api.GetResourceCommands(device_name).Commands)
+        catalog = CommandCatalog.for_sandbox(sandbox, self.metadata_store)
+        model = self._resource_index(sandbox).get_model(device_name)
 
-        con_commands = self._build_cmd_list_from_cmdlistinfo(
-            sandbox.automation_api.GetResourceConnectedCommands(device_name).Commands)
+        reg_commands = catalog.driver_commands(device_name, model)
+        con_commands = catalog.connected_commands(device_name)
 
         return reg_commands, con_commands
 
+    def _resource_index(self, sandbox):
+        """
+        :param Sandbox sandbox:
+        :return: ResourceIndex: the sandbox's shared index
+        """
+        return ResourceIndex.for_sandbox(sandbox, store=self.metadata_store)
+
+    def _match_devices(self, sandbox, components):
+        """
+        resolves the devices in the sandbox matching the helper's selector
+        :param Sandbox sandbox:
+        :param RouteCommandHelper components:
+        :return: set str matching_devices:
+        """
+        return components.selector.select(self._resource_index(sandbox))
+
+    def _resolve_route_table(self, sandbox, components):
+        """
+        :param Sandbox sandbox:
+        :param components: TopologiesRouteInfo, a ReservationSnapshot, or None to use the sandbox's shared snapshot
+        :return: RouteTable
+        """
+        if components is None:
+            return ReservationSnapshot.for_sandbox(sandbox).route_table()
+        if isinstance(components, ReservationSnapshot):
+            return components.route_table()
+        return RouteTable.from_topologies(components)
+
+    def _route_batcher(self, sandbox):
+        """
+        :param Sandbox sandbox:
+        :return: RouteBatcher, or a SwitchWaveScheduler over it with switch_waves set
+        """
+        batcher = RouteBatcher(sandbox.automation_api, sandbox.id, self.route_chunk_size, self.routes_in_flight,
+                               ReservationOutputWriter.for_sandbox(sandbox), self.isolate_route_failures)
+        return SwitchWaveScheduler(batcher) if self.switch_waves else batcher
+
+    def _routes_to_change(self, sandbox, routes, connect=True):
+        """
+        with reconcile_routes set, re-reads the reservation and drops the routes already in the desired state
+        :param Sandbox sandbox:
+        :param list RouteRecord routes: desired routes
+        :param bool connect: True when the routes are to be connected, False for disconnecting
+        :return: list RouteRecord: routes to send
+        """
+        if not self.reconcile_routes or len(routes) == 0:
+            return routes
+
+        active_keys = ReservationSnapshot.for_sandbox(sandbox).refresh().active_route_keys()
+        delta = RouteTable.reconcile(routes, active_keys, connect)
+
+        if len(delta) < len(routes):
+            ReservationOutputWriter.for_sandbox(sandbox)(
+                sandbox.id, 'Skipping {} of {} Routes, already {}'.format(len(routes) - len(delta), len(routes),
+                                                                          'connected' if connect else 'disconnected'))
+        return delta
+
+    def _connect_routes(self, sandbox, routes, mapping_type, message):
+        """
+        :param Sandbox sandbox:
+        :param list RouteRecord routes:
+        :param str mapping_type: 'bi' or 'uni'
+        :param str message: written to the reservation output before connecting
+        :return: bool: True if at least one ConnectRoutesInReservation call went through
+        """
+        if len(routes) == 0:
+            return False
+
+        ReservationOutputWriter.for_sandbox(sandbox)(sandbox.id, message)
+        result = self._route_batcher(sandbox).connect(routes, mapping_type, '{} routes'.format(mapping_type))
+        ReservationSnapshot.for_sandbox(sandbox).record_connected(result.succeeded_routes)
+        return bool(result)
+
+    def _connect_bi_and_uni(self, sandbox, bi_routes, bi_message, uni_routes, uni_message):
+        """
+        connects the bi-directional routes, then the uni-directional ones
+        :param Sandbox sandbox:
+        :param list RouteRecord bi_routes:
+        :param str bi_message:
+        :param list RouteRecord uni_routes:
+        :param str uni_message:
+        :return: bool: True if either set was connected
+        """
+        result = self._connect_routes(sandbox, bi_routes, 'bi', bi_message)
+        result = self._connect_routes(sandbox, uni_routes, 'uni', uni_message) or result
+
+        return result
+
+    def _disconnect_routes(self, sandbox, routes, message):
+        """
+        :param Sandbox sandbox:
+        :param list RouteRecord routes:
+        :param str message: written to the reservation output before disconnecting
+        :return: bool: True if at least one DisconnectRoutesInReservation call went through
+        """
+        if len(routes) == 0:
+            return False
+
+        ReservationOutputWriter.for_sandbox(sandbox)(sandbox.id, message)
+        return bool(self._route_batcher(sandbox).disconnect(routes))
+
     def _build_command_params(self, param_dict):
         """
 
@@ -99,6 +1947,7 @@ class SandboxOrchPlugins(object):
 
         return out
 
+    @_flushes_output
     def connect_all_routes(self, sandbox, components):
         """
         examines the routes listed for the sandbox being activated, and creates two lists of routes to be created
@@ -107,46 +1956,18 @@ class SandboxOrchPlugins(object):
         ['source1', 'target1', 'source2', 'target2', ... 'sourceN', 'targetN']
         :param Sandbox sandbox: Sandbox context obj
         :param TopologiesRouteInfo components:  List of Route Objects found in the reservation being used
+                                                 (or a ReservationSnapshot / None to use the shared snapshot)
         :return: Bool result: If Command Called
         """
-        result = False
-        w2output = sandbox.automation_api.WriteMessageToReservationOutput
-        bi_routes = []
-        uni_routes = []
-        for route in components:
-            for r in route:
-                if r.RouteType == 'bi':
-                    bi_routes.append(r.Source)
-                    bi_routes.append(r.Target)
-                elif r.RouteType == 'uni':
-                    uni_routes.append(r.Source)
-                    uni_routes.append(r.Target)
-
-        # set Bi-Dir Routes:
-        if len(bi_routes) > 0:
-            try:
-                w2output(sandbox.id,
-                         'Queueing {} Bi-Dir Routes for Connection'.format(len(bi_routes) / 2))
-                sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id,
-                                                                  endpoints=bi_routes,
-                                                                  mappingType='bi')
-                result = True
-            except Exception as err:
-                w2output(sandbox.id, err.message)
+        routes = self._routes_to_change(sandbox, list(self._resolve_route_table(sandbox, components)))
+        bi_routes = [route for route in routes if route.route_type == 'bi']
+        uni_routes = [route for route in routes if route.route_type == 'uni']
 
-        if len(uni_routes) > 0:
-            try:
-                w2output(sandbox.id,
-                         'Queueing {} Uni-Dir Routes for Connection'.format(len(uni_routes) / 2))
-                sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id,
-                                                                  endpoints=uni_routes,
-                                                                  mappingType='uni')
-                result = True
-            except Exception as err:
-                w2output(sandbox.id, err.message)
-
-        return result
+        return self._connect_bi_and_uni(sandbox,
+                                        bi_routes, 'Queueing {} Bi-Dir Routes for Connection'.format(len(bi_routes)),
+                                        uni_routes, 'Queueing {} Uni-Dir Routes for Connection'.format(len(uni_routes)))
 
+    @_flushes_output
     def disconnect_all_routes(self, sandbox, components):
         """
         examines the all routes listed in the sandbox being, and creates a list of routes to be disconnected
@@ -155,28 +1976,14 @@ class SandboxOrchPlugins(object):
         ['source1', 'target1', 'source2', 'target2', ... 'sourceN', 'targetN']
         :param Sandbox sandbox: Sandbox context obj
         :param TopologiesRouteInfo components:  List of Route Objects found in the reservation being used
+                                                 (or a ReservationSnapshot / None to use the shared snapshot)
         :return: Bool result: If Command Called
         """
-        result = False
-        w2output = sandbox.automation_api.WriteMessageToReservationOutput
-        routes = []
-        for route in components:
-            for r in route:
-                routes.append(r.Source)
-                routes.append(r.Target)
-
-        if len(routes) > 0:
-            try:
-                w2output(sandbox.id,
-                         'Queueing {} Routes for disconnection'.format(len(routes) / 2))
-                sandbox.automation_api.DisconnectRoutesInReservation(reservationId=sandbox.id,
-                                                                     endpoints=routes)
-                result = True
-            except Exception as err:
-                w2output(reservationId=sandbox.id, message=err.message)
+        routes = self._routes_to_change(sandbox, list(self._resolve_route_table(sandbox, components)), connect=False)
 
-        return result
+        return self._disconnect_routes(sandbox, routes, 'Queueing {} Routes for disconnection'.format(len(routes)))
 
+    @_flushes_output
     def connect_select_routes_by_type(self, sandbox, components):
         """
         Connect Routes if they are ["Bi" or "Uni"]
@@ -186,327 +1993,962 @@ class SandboxOrchPlugins(object):
         """
         result = False
         if components.route_type != '':
-            w2output = sandbox.automation_api.WriteMessageToReservationOutput
-            tar_routes = []
-            routes = sandbox.automation_api.GetReservationDetails(sandbox.id).ReservationDescription.TopologiesRouteInfo
-            for route in routes:
-                for r in route:
-                    if r.RouteType.upper() == components.route_type:
-                        tar_routes.append(r.Source)
-                        tar_routes.append(r.Target)
-            try:
-                w2output(sandbox.id, 'Queuing Connection of {} {} Routes'.format(len(tar_routes)/2,
-                                                                                 components.route_type)
-                         )
-                sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id, endpoints=tar_routes,
-                                                                  mappingType=components.route_type.lower())
-                result = True
-            except Exception as err:
-                w2output(reservationId=sandbox.id, message=err.message)
+            tar_routes = ReservationSnapshot.for_sandbox(sandbox).route_table().by_type(components.route_type)
+            tar_routes = self._routes_to_change(sandbox, tar_routes)
+            result = self._connect_routes(sandbox, tar_routes, components.route_type.lower(),
+                                          'Queuing Connection of {} {} Routes'.format(len(tar_routes),
+                                                                                      components.route_type))
 
         return result
 
+    @_flushes_output
     def disconnect_select_routes_by_type(self, sandbox, components):
         """
-        Connect Routes if they are ["Bi" or "Uni"]
+        Disconnect Routes if they are ["Bi" or "Uni"]
         :param Sandbox sandbox:
         :param RouteCommandHelper components:
         :return:
         """
         result = False
         if components.route_type != '':
-            w2output = sandbox.automation_api.WriteMessageToReservationOutput
-            tar_routes = []
-            routes = sandbox.automation_api.GetReservationDetails(sandbox.id).ReservationDescription.TopologiesRouteInfo
-            for route in routes:
-                for r in route:
-                    if r.RouteType.upper() == components.route_type:
-                        tar_routes.append(r.Source)
-                        tar_routes.append(r.Target)
-            try:
-                w2output(sandbox.id, 'Queuing Connection of {} {} Routes'.format(len(tar_routes)/2,
-                                                                                 components.route_type)
-                         )
-                sandbox.automation_api.DisconnectRoutesInReservation(reservationId=sandbox.id, endpoints=tar_routes,
-                                                                     mappingType=components.route_type.lower())
-                result = True
-            except Exception as err:
-                w2output(reservationId=sandbox.id, message=err.message)
+            tar_routes = ReservationSnapshot.for_sandbox(sandbox).route_table().by_type(components.route_type)
+            tar_routes = self._routes_to_change(sandbox, tar_routes, connect=False)
+            result = self._disconnect_routes(sandbox, tar_routes,
+                                             'Queuing Disconnection of {} {} Routes'.format(len(tar_routes),
+                                                                                            components.route_type))
 
         return result
 
+    @_flushes_output
     def connect_routes_by_device_type(self, sandbox, components):
         """
-        Connect Routes if they are ["Bi" or "Uni"]
+        Connect the Routes touching any device matching the helper's Family / Model / Name on the helper's
+        evaluate_connection_by side ('Source', 'Target' or 'Either'), limited to the helper's route_type when one is set
         :param Sandbox sandbox:
         :param RouteCommandHelper components:
-        :return:
+        :return: Boolean:  If it did something w/out error - no route changes will still return false
         """
-        result = False
-        if components.route_type != '':
-            w2output = sandbox.automation_api.WriteMessageToReservationOutput
-            bi_routes = []
-            uni_routes = []
-            devices = sandbox.components.resources
-            matching_devices = []
-            for device in devices:
-                family = sandbox.automation_api.GetResourceDetails(device).ResourceFamilyName
-                model = sandbox.automation_api.GetResourceDetails(device).ResourceModelName
-                if components.device_family == family:
-                    matching_devices.append(device)
-                elif components.device_model == model:
-                    matching_devices.append(device)
-                elif components.device_name.upper() in device.upper():
-                    matching_devices.append(device)
-            routes = sandbox.automation_api.GetReservationDetails(sandbox.id).ReservationDescription.TopologiesRouteInfo
-            for route in routes:
-                for r in route:
-                    base_target = r.Target.split('/')[0]
-                    base_source = r.Source.split('/')[0]
-                    if base_source in matching_devices or base_target in matching_devices:
-                        if r.RouteType.upper() == 'BI':
-                            bi_routes.append(r.Source)
-                            bi_routes.append(r.Target)
-                        if r.RouteType.upper() == 'UNI':
-                            uni_routes.append(r.Source)
-                            uni_routes.append(r.Target)
-            try:
-                # Bi-Routes
-                w2output(sandbox.id, 'Queuing Connection of {} {} Routes'.format(len(bi_routes) / 2, 'Bi-Directional'))
-                sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id, endpoints=bi_routes,
-                                                                  mappingType=components.route_type.lower())
-                # Uni-Routes
-                w2output(sandbox.id, 'Queuing Connection of {} {} Routes'.format(len(uni_routes) / 2, 'Uni'))
-                sandbox.automation_api.ConnectRoutesInReservation(reservationId=sandbox.id, endpoints=uni_routes,
-                                                                  mappingType=components.route_type.lower())
-                result = True
-            except Exception as err:
-                w2output(reservationId=sandbox.id, message=err.message)
+        matching_devices = self._match_devices(sandbox, components)
+        table = ReservationSnapshot.for_sandbox(sandbox).route_table()
+        routes = self._routes_to_change(sandbox, table.select(matching_devices, components.route_type,
+                                                              components.evaluate_by))
 
-        return result
+        bi_routes = [route for route in routes if route.route_type == 'bi']
+        uni_routes = [route for route in routes if route.route_type == 'uni']
 
+        return self._connect_bi_and_uni(sandbox,
+                                        bi_routes, 'Queuing Connection of {} {} Routes'.format(len(bi_routes),
+                                                                                           'Bi-Directional'),
+                                        uni_routes, 'Queuing Connection of {} {} Routes'.format(len(uni_routes), 'Uni'))
+
+    @_flushes_output
     def disconnect_routes_by_device_type(self, sandbox, components):
         """
+        Disconnect the Routes touching any device matching the helper's Family / Model / Name on the helper's
+        evaluate_connection_by side ('Source', 'Target' or 'Either'), limited to the helper's route_type when one is set
         :param Sandbox sandbox:
         :param RouteCommandHelper components:
         :return: Boolean:  If it did something w/out error - no route changes will still return false
         """
-        result = False
-        if components.route_type != '':
-            w2output = sandbox.automation_api.WriteMessageToReservationOutput
-            tar_routes = []
-            devices = sandbox.components.resources
-            matching_devices = []
-            for device in devices:
-                family = sandbox.automation_api.GetResourceDetails(device).ResourceFamilyName
-                model = sandbox.automation_api.GetResourceDetails(device).ResourceModelName
-                if components.device_family == family:
-                    matching_devices.append(device)
-                elif components.device_model == model:
-                    matching_devices.append(device)
-                elif components.device_name.upper() in device.upper():
-                    matching_devices.append(device)
-            routes = sandbox.automation_api.GetReservationDetails(sandbox.id).ReservationDescription.TopologiesRouteInfo
-            for route in routes:
-                for r in route:
-                    base_target = r.Target.split('/')[0]
-                    base_source = r.Source.split('/')[0]
-                    if base_target in matching_devices or base_source in matching_devices:
-                        tar_routes.append(r.Target)
-                        tar_routes.append(r.Source)
+        matching_devices = self._match_devices(sandbox, components)
+        table = ReservationSnapshot.for_sandbox(sandbox).route_table()
+        tar_routes = self._routes_to_change(sandbox, table.select(matching_devices, components.route_type,
+                                                                  components.evaluate_by),
+                                            connect=False)
 
-            try:
-                w2output(sandbox.id, 'Queuing Connection of {} {} Routes'.format(len(tar_routes)/2,
-                                                                                 components.route_type)
-                         )
-                sandbox.automation_api.DisconnectRoutesInReservation(reservationId=sandbox.id, endpoints=tar_routes)
-                result = True
-            except Exception as err:
-                w2output(reservationId=sandbox.id, message=err.message)
+        return self._disconnect_routes(sandbox, tar_routes,
+                                       'Queuing Disconnection of {} Routes'.format(len(tar_routes)))
+
+    @_flushes_output
+    def wait_for_routes(self, sandbox, components):
+        """
+        waits until the routes are active, polling the reservation, and reports throughput & the routes that
+        didn't come up. Register it after the routes were connected, e.g. with
+        sandbox.workflow.on_connectivity_ended, so configuration only starts on live links.
+        Only the routes the plugins' Connect calls went through for are waited on (routes that failed to connect
+        were already reported), every route when no plugin connected any in this run.
+        Nothing is waited on while an ExecutionPlanner dry-runs the step, the routes never get connected there
+        :param Sandbox sandbox:
+        :param components: None / ReservationSnapshot / TopologiesRouteInfo to wait on every route,
+                           or a RouteCommandHelper to wait on the routes it selects
+        :return: RouteWaitResult result: True if every route came up before route_wait_timeout
+        """
+        if isinstance(sandbox.automation_api, PlanningApi):
+            return RouteWaitResult([])
+
+        if isinstance(components, RouteCommandHelper):
+            table = ReservationSnapshot.for_sandbox(sandbox).route_table()
+            if components.selector.text:  # a Name / Family / Model or selector was set
+                routes = table.select(self._match_devices(sandbox, components), components.route_type,
+                                      components.evaluate_by)
+            else:
+                routes = table.select(None, components.route_type)
+        else:
+            routes = list(self._resolve_route_table(sandbox, components))
+
+        connected = ReservationSnapshot.for_sandbox(sandbox).connected_routes()
+        if connected is not None:
+            connected_keys = set(route.key for route in connected)
+            routes = [route for route in routes if route.key in connected_keys]
+        if len(routes) == 0:
+            return RouteWaitResult([])
+
+        waiter = RouteWaiter(ReservationSnapshot.for_sandbox(sandbox), ReservationOutputWriter.for_sandbox(sandbox))
+        return waiter.wait(routes, self.route_wait_timeout)
+
+    def _run_resource_command(self, sandbox, device, components):
+        """
+        verifies the command exists on the device (Driver commands first, then Connected commands) and runs it
+        :param Sandbox sandbox:
+        :param str device:
+        :param ResourceCommandHelper components:
+        :return: DeviceCommandResult or None if the command isn't available on the device
+        """
+        start = time()
+        result = DeviceCommandResult(device, components.command_name)
+
+        try:
+            reg_commands, con_commands = self._build_resource_command_lists(sandbox, device)
 
+            if components.command_name in reg_commands:
+                params = self._build_command_params(components.parameters)
+                if components.run_type == 'EXECUTE':
+                    sandbox.automation_api.ExecuteCommand(reservationId=sandbox.id,
+                                                          targetName=device,
+                                                          targetType='Resource',
+                                                          commandName=components.command_name,
+                                                          commandInputs=params)
+                elif components.run_type == 'ENQUEUE':
+                    sandbox.automation_api.EnqueueCommand(reservationId=sandbox.id,
+                                                          targetName=device,
+                                                          targetType='Resource',
+                                                          commandName=components.command_name,
+                                                          commandInputs=params)
+                else:
+                    return None
+
+            elif components.command_name in con_commands:
+                params = self._build_command_params(components.parameters)
+                sandbox.automation_api.ExecuteResourceConnectedCommand(reservationId=sandbox.id,
+                                                                       resourceFullPath=device,
+                                                                       commandName=components.command_name,
+                                                                       parameterValues=params)
+            else:
+                return None
+
+            result.success = True
+        except Exception as err:
+            result.error = err.message
+            ReservationOutputWriter.for_sandbox(sandbox)(reservationId=sandbox.id, message=err.message)
+
+        result.duration = time() - start
         return result
 
+    def _fan_out_resource_command(self, sandbox, devices, components):
+        """
+        runs the command on each device, up to components.max_concurrency devices at a time
+        :param Sandbox sandbox:
+        :param list str devices:
+        :param ResourceCommandHelper components:
+        :return: CommandRunResult
+        """
+        def _run(device):
+            start = time()
+            try:
+                return _call_with_timeout(lambda: self._run_resource_command(sandbox, device, components),
+                                          components.timeout)
+            except CommandTimeoutError as err:
+                ReservationOutputWriter.for_sandbox(sandbox)(
+                    reservationId=sandbox.id, message='{} on {}: {}'.format(components.command_name, device,
+                                                                            err.message))
+                return DeviceCommandResult(device, components.command_name, error=err.message,
+                                           duration=time() - start)
+
+        device_results = _thread_map(_run, devices, components.max_concurrency)
+
+        return CommandRunResult(components.command_name, [each for each in device_results if each is not None])
+
+    @_flushes_output
     def run_resource_command_on_all(self, sandbox, components):
         """
         designed to call a singular command on all devices, such as a Power Up.
         Verifies first that the command exists, and then launches it.
         Execute vs. Enqueue - Execute waits for it to complete
+        Devices are run up to components.max_concurrency at a time
         :param Sandbox sandbox:
         :param ResourceCommandHelper components: Use the CommandHelper (ignores Family & Model)
-        :return: Bool result: If command was called
+        :return: CommandRunResult result: per-device results, True if the command was called on any device
         """
-        result = False
-
         if components.command_name == '':  # if the command is blank, stop here
-            return result
+            return CommandRunResult(components.command_name)
 
-        devices = sandbox.components.resources
-        for device in devices:
-            reg_cmd_check = False
+        return self._fan_out_resource_command(sandbox, list(sandbox.components.resources), components)
 
-            reg_commands, con_commands = self._build_resource_command_lists(sandbox, device)
+    @_flushes_output
+    def run_resource_command_on_select(self, sandbox, components):
+        """
+        Runs the command on the devices matching the helper, up to components.max_concurrency at a time.
+        A device matches on its exact Name, or when no Name is set on its Family and / or Model,
+        and on the helper's selector string when one is given
+        :param Sandbox sandbox:
+        :param ResourceCommandHelper components:
+        :return: CommandRunResult result: per-device results, True if the command was called on any device
+        """
+        if components.command_name == '':  # if the command is blank, stop here
+            return CommandRunResult(components.command_name)
 
-            if len(reg_commands) > 0:
-                if components.command_name in reg_commands:
-                    reg_cmd_check = True
-                    params = self._build_command_params(components.parameters)
-
-                    try:
-                        if components.run_type == 'EXECUTE':
-                            sandbox.automation_api.ExecuteCommand(reservationId=sandbox.id,
-                                                                  targetName=device,
-                                                                  targetType='Resource',
-                                                                  commandName=components.command_name,
-                                                                  commandInputs=params)
-                            result = True
-                        elif components.run_type == 'ENQUEUE':
-                            sandbox.automation_api.EnqueueCommand(reservationId=sandbox.id,
-                                                                  targetName=device,
-                                                                  targetType='Resource',
-                                                                  commandName=components.command_name,
-                                                                  commandInputs=params)
-                            result = True
-                    except Exception as err:
-                        sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                                               message=err.message)
-
-            if len(con_commands) > 0 and not reg_cmd_check:
-                if components.command_name in con_commands:
-                    try:
-                        params = self._build_command_params(components.parameters)
-                        sandbox.automation_api.ExecuteResourceConnectedCommand(reservationId=sandbox.id,
-                                                                               resourceFullPath=device,
-                                                                               commandName=components.command_name,
-                                                                               parameterValues=params)
-                        result = True
-                    except Exception as err:
-                        sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                                               message=err.message)
+        selected = self._resource_index(sandbox).select(components.selector)
 
-        return result
+        return self._fan_out_resource_command(sandbox, selected, components)
 
-    def run_resource_command_on_select(self, sandbox, components):
+    def _run_service_command(self, sandbox, service, components):
         """
+        verifies the command exists on the instance's Service Model and runs it
+        :param Sandbox sandbox:
+        :param ServiceInstance service:
+        :param ServiceCommandHelper components:
+        :return: DeviceCommandResult or None if the command isn't available on the service
+        """
+        start = time()
+        result = DeviceCommandResult(service.Alias, components.command_name)
+
+        try:
+            command_list = CommandCatalog.for_sandbox(sandbox, self.metadata_store).service_commands(
+                service.ServiceName)
+            if components.command_name not in command_list:
+                return None
+
+            params = self._build_command_params(components.parameters)
+            if components.run_type == 'EXECUTE':
+                sandbox.automation_api.ExecuteCommand(reservationId=sandbox.id,
+                                                      targetName=service.Alias,
+                                                      targetType='Service',
+                                                      commandName=components.command_name,
+                                                      commandInputs=params)
+            elif components.run_type == 'ENQUEUE':
+                sandbox.automation_api.EnqueueCommand(reservationId=sandbox.id,
+                                                      targetName=service.Alias,
+                                                      targetType='Service',
+                                                      commandName=components.command_name,
+                                                      commandInputs=params)
+            else:
+                return None
+
+            result.success = True
+        except Exception as err:
+            result.error = err.message
+            ReservationOutputWriter.for_sandbox(sandbox)(reservationId=sandbox.id, message=err.message)
+
+        result.duration = time() - start
+        return result
 
+    @staticmethod
+    def _select_services(sandbox, components):
+        """
         :param Sandbox sandbox:
-        :param ResourceCommandHelper components:
-        :return: Bool result: If a command was called
+        :param ServiceCommandHelper components:
+        :return: list ServiceInstance: the sandbox's service instances the helper matches, in reservation order
         """
-        result = False
+        return [service for service in sandbox.components.services.values() if components.matches(service)]
 
+    @_flushes_output
+    def run_service_command(self, sandbox, components):
+        """
+        Runs the command on every service instance matching the helper's Service Name and / or Alias,
+        up to components.max_concurrency instances at a time. Command lists are looked up once per Service Model
+        :param Sandbox sandbox:
+        :param ServiceCommandHelper components:
+        :return: CommandRunResult result: per-instance results (keyed by Alias), True if the command was called on
+                 any instance
+        """
         if components.command_name == '':  # if the command is blank, stop here
-            return result
+            return CommandRunResult(components.command_name)
+
+        def _run(service):
+            start = time()
+            try:
+                return _call_with_timeout(lambda: self._run_service_command(sandbox, service, components),
+                                          components.timeout)
+            except CommandTimeoutError as err:
+                ReservationOutputWriter.for_sandbox(sandbox)(
+                    reservationId=sandbox.id, message='{} on {}: {}'.format(components.command_name, service.Alias,
+                                                                            err.message))
+                return DeviceCommandResult(service.Alias, components.command_name, error=err.message,
+                                           duration=time() - start)
+
+        service_results = _thread_map(_run, self._select_services(sandbox, components), components.max_concurrency)
+
+        return CommandRunResult(components.command_name, [each for each in service_results if each is not None])
+
+
+PLUGIN_METHODS = ('connect_all_routes', 'disconnect_all_routes', 'connect_select_routes_by_type',
+                  'disconnect_select_routes_by_type', 'connect_routes_by_device_type',
+                  'disconnect_routes_by_device_type', 'wait_for_routes', 'run_resource_command_on_all',
+                  'run_resource_command_on_select', 'run_service_command')
+
+
+class PendingResult(object):
+    """
+    Result of a call running in the background - the python 2 stand in for an asyncio future
+    """
+    def __init__(self):
+        self._done = Event()
+        self._value = None
+        self._exc_info = None
+
+    def _resolve(self, func, args, kwargs):
+        try:
+            self._value = func(*args, **kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def done(self):
+        """
+        :return: bool: True once the call returned or raised
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        waits for the call and returns its value, re-raising its error
+        :param float timeout: seconds, None waits as long as it takes
+        :return: the call's return value
+        """
+        if not self._done.wait(timeout):
+            raise CommandTimeoutError('Call did not finish within {}s'.format(timeout))
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+def gather(pending_results, timeout=None):
+    """
+    waits for every pending result, then raises the first error if any call failed
+    :param list PendingResult pending_results:
+    :param float timeout: seconds to wait for each result
+    :return: list: values, same order as pending_results
+    """
+    values = []
+    first_error = None
+    for pending in pending_results:
+        try:
+            values.append(pending.result(timeout))
+        except Exception:
+            values.append(None)
+            first_error = first_error or sys.exc_info()
+    if first_error is not None:
+        raise first_error[0], first_error[1], first_error[2]
+    return values
+
+
+class PluginExecutor(object):
+    """
+    Runs blocking calls in the background so independent API calls overlap.
+    submit() runs I/O on a bounded thread pool, spawn() runs a whole plugin on its own thread, so a plugin
+    waiting on its submitted calls never holds a pool thread those calls need
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param int max_workers: calls in flight at once
+        """
+        self.max_workers = max(max_workers, 1)
+        self._pool = None
+        self._lock = Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        :param function func: blocking call, must not wait on other submitted calls
+        :return: PendingResult
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+            pool = self._pool
+        pending = PendingResult()
+        pool.apply_async(pending._resolve, (_in_call_context(_get_call_context(), func), args, kwargs))
+        return pending
+
+    def spawn(self, func, *args, **kwargs):
+        """
+        :param function func: call that may itself submit & wait on other calls
+        :return: PendingResult
+        """
+        pending = PendingResult()
+        worker = Thread(target=pending._resolve, args=(_in_call_context(_get_call_context(), func), args, kwargs))
+        worker.daemon = True
+        worker.start()
+        return pending
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class AsyncApi(object):
+    """
+    Non-blocking view of a CloudShell API session, every API method returns a PendingResult right away
+    while the blocking client runs on the executor:
+
+        details, commands = gather([async_api.GetReservationDetails(sandbox.id),
+                                    async_api.GetResourceCommands('Router 1')])
+    """
+    def __init__(self, api, executor):
+        """
+        :param CloudShellAPISession api:
+        :param PluginExecutor executor:
+        """
+        self._api = api
+        self._executor = executor
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api, name)
+        if not callable(attribute):
+            return attribute
+
+        def _submit(*args, **kwargs):
+            return self._executor.submit(attribute, *args, **kwargs)
+        return _submit
+
+
+class AsyncSandboxOrchPlugins(SandboxOrchPlugins):
+    """
+    Same plugins as SandboxOrchPlugins, each returning a PendingResult instead of blocking.
+    Before a plugin runs, the reservation details, resource details and command lists it needs are fetched
+    concurrently, and bi & uni route connections go out side by side.
+    Wrap in SyncPluginFacade to register the plugins with sandbox.workflow.add_to_*.
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, executor=None, **kwargs):
+        """
+        :param int max_workers: API calls in flight at once, ignored when an executor is given
+        :param PluginExecutor executor: shared executor
+        :param kwargs: SandboxOrchPlugins arguments
+        """
+        super(AsyncSandboxOrchPlugins, self).__init__(**kwargs)
+        self.executor = executor or PluginExecutor(max_workers)
 
-        devices = sandbox.components.resources
+    def api(self, sandbox):
+        """
+        :param Sandbox sandbox:
+        :return: AsyncApi: the sandbox's API session, non-blocking
+        """
+        return AsyncApi(sandbox.automation_api, self.executor)
 
+    def _prefetch(self, sandbox, name, components):
+        """
+        starts every read the plugin will need, all at once
+        :param Sandbox sandbox:
+        :param str name: plugin method
+        :param components: the plugin's components
+        :return: list PendingResult
+        """
+        pending = []
+        if 'routes' in name:
+            if isinstance(components, ReservationSnapshot):
+                pending.append(self.executor.submit(lambda: components.description))
+            elif components is None or isinstance(components, RouteCommandHelper):
+                pending.append(self.executor.submit(lambda: ReservationSnapshot.for_sandbox(sandbox).description))
+        if name.endswith('by_device_type') or name.startswith('run_resource_command'):
+            pending.append(self.executor.submit(self._resource_index, sandbox))
+        return pending
+
+    def _prefetch_commands(self, sandbox, name, components):
+        """
+        fetches the command lists of the resources the plugin will run on at once, so the command fan out only
+        hits the catalog
+        :param Sandbox sandbox:
+        :param str name: run_resource_command_on_all or run_resource_command_on_select
+        :param ResourceCommandHelper components:
+        :return: list PendingResult
+        """
+        catalog = CommandCatalog.for_sandbox(sandbox, self.metadata_store)
+        index = self._resource_index(sandbox)
+        if name == 'run_resource_command_on_select':
+            devices = index.select(components.selector)
+        else:
+            devices = index.names()
+        pending = []
         for device in devices:
-            reg_commands = []  # commands as part of the Shell/Driver
-            con_commands = []  # commands inherited via connection (Power)
-            reg_cmd_check = False
-            resource = sandbox.automation_api.GetResourceDetails(device)
-
-            # build commands lists on the device is conditions are meet
-            # - A specific device name is meet
-            # - Matches Specific Family / Model combo
-            # - Matches Specific Model Name, no Family Name specified (as Model Names a unique, this is an edge case)
-            # - Matches Specific Family Name, no Model Name specified
-            if components.device_name == device.upper():
-
-                reg_commands, con_commands = self._build_resource_command_lists(sandbox, device)
-
-            elif components.family_name == resource.ResourceFamilyName.upper() and \
-                    components.model_name == resource.ResourceModelName.upper() and components.device_name == '':
-
-                reg_commands, con_commands = self._build_resource_command_lists(sandbox, device)
-
-            elif components.model_name == resource.ResourceModelName.upper() and \
-                    components.family_name == '' and components.device_name == '':
-
-                reg_commands, con_commands = self._build_resource_command_lists(sandbox, device)
-
-            elif components.family_name == resource.ResourceFamilyName.upper() and \
-                    components.model_name == '' and components.device_name == '':
-
-                reg_commands, con_commands = self._build_resource_command_lists(sandbox, device)
-
-            if len(reg_commands) > 0:
-                if components.command_name in reg_commands:
-                    reg_cmd_check = True
-                    params = self._build_command_params(components.parameters)
-
-                    try:
-                        if components.run_type == 'EXECUTE':
-                            sandbox.automation_api.ExecuteCommand(reservationId=sandbox.id,
-                                                                  targetName=device,
-                                                                  targetType='Resource',
-                                                                  commandName=components.command_name,
-                                                                  commandInputs=params)
-                            result = True
-                        elif components.run_type == 'ENQUEUE':
-                            sandbox.automation_api.EnqueueCommand(reservationId=sandbox.id,
-                                                                  targetName=device,
-                                                                  targetType='Resource',
-                                                                  commandName=components.command_name,
-                                                                  commandInputs=params)
-                            result = True
-                    except Exception as err:
-                        sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                                               message=err.message)
-
-            if len(con_commands) > 0 and not reg_cmd_check:
-                if components.command_name in con_commands:
-                    try:
-                        params = self._build_command_params(components.parameters)
-
-                        sandbox.automation_api.ExecuteResourceConnectedCommand(reservationId=sandbox.id,
-                                                                               resourceFullPath=device,
-                                                                               commandName=components.command_name,
-                                                                               parameterValues=params)
-                        result = True
-                    except Exception as err:
-                        sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                                               message=err.message)
+            pending.append(self.executor.submit(catalog.driver_commands, device, index.get_model(device)))
+            pending.append(self.executor.submit(catalog.connected_commands, device))
+        return pending
 
-        return result
+    def _run_plugin(self, name, sandbox, components):
+        """
+        :param str name: plugin method
+        :param Sandbox sandbox:
+        :param components:
+        :return: the plugin's result
+        """
+        gather(self._prefetch(sandbox, name, components))
+        if name.startswith('run_resource_command') and components.command_name != '':
+            try:
+                gather(self._prefetch_commands(sandbox, name, components))
+            except Exception:
+                pass  # the fan out looks the lists up again & reports per device
+        elif name == 'run_service_command' and components.command_name != '':
+            catalog = CommandCatalog.for_sandbox(sandbox, self.metadata_store)
+            models = set(service.ServiceName for service in self._select_services(sandbox, components))
+            try:
+                gather([self.executor.submit(catalog.service_commands, model) for model in models])
+            except Exception:
+                pass  # the fan out looks the lists up again & reports per instance
+        return getattr(super(AsyncSandboxOrchPlugins, self), name)(sandbox, components)
 
-    def run_service_command(self, sandbox, components):
+    def _connect_bi_and_uni(self, sandbox, bi_routes, bi_message, uni_routes, uni_message):
+        """
+        connects the bi-directional & uni-directional routes at the same time
+        """
+        return any(gather([self.executor.submit(self._connect_routes, sandbox, bi_routes, 'bi', bi_message),
+                           self.executor.submit(self._connect_routes, sandbox, uni_routes, 'uni', uni_message)]))
+
+
+def _async_plugin(name):
+    def _run(self, sandbox, components):
+        return self.executor.spawn(self._run_plugin, name, sandbox, components)
+    _run.__name__ = name
+    _run.__doc__ = 'non-blocking SandboxOrchPlugins.{}, returns a PendingResult of its result'.format(name)
+    return _run
+
+
+for _name in PLUGIN_METHODS:
+    setattr(AsyncSandboxOrchPlugins, _name, _async_plugin(_name))
+
+
+class SyncPluginFacade(object):
+    """
+    Blocking view of AsyncSandboxOrchPlugins, its plugin methods wait for their result so they can be
+    registered with sandbox.workflow.add_to_* like SandboxOrchPlugins':
+
+        plugins = SyncPluginFacade(AsyncSandboxOrchPlugins(max_workers=20))
+        sandbox.workflow.add_to_connectivity(function=plugins.connect_all_routes, components=None)
+    """
+    def __init__(self, plugins, timeout=None):
+        """
+        :param AsyncSandboxOrchPlugins plugins:
+        :param float timeout: seconds to wait on each plugin, None waits as long as it takes
+        """
+        self.plugins = plugins
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        attribute = getattr(self.plugins, name)
+        if name not in PLUGIN_METHODS:
+            return attribute
+
+        def _run(sandbox, components):
+            return attribute(sandbox, components).result(self.timeout)
+        _run.__name__ = name
+        _run.__doc__ = attribute.__doc__
+        return _run
+
+
+READ_ONLY_API_PREFIXES = ('Get', 'Find', 'Search')
+
+
+class PlannedCall(object):
+    __slots__ = ('stage', 'method', 'summary')
+
+    def __init__(self, stage, method, summary):
+        """
+        :param str stage: label of the planned step the call came from
+        :param str method: API method name
+        :param str summary: short description of the arguments
         """
+        self.stage = stage
+        self.method = method
+        self.summary = summary
+
+
+class ExecutionPlan(object):
+    """
+    Ordered API calls a set of plugin steps would make.  Mutating calls are listed, never sent;
+    read-only calls were made (and warmed the shared caches) and are counted
+    """
+    def __init__(self):
+        self.calls = []
+        self.read_counts = OrderedDict()
+        self.write_counts = OrderedDict()
 
+    def report(self):
+        """
+        :return: list str: one line per mutating call, followed by the call counts per API method
+        """
+        lines = ['[{}] {}({})'.format(call.stage, call.method, call.summary) for call in self.calls]
+        lines.append('-- {} mutating calls'.format(sum(self.write_counts.values())))
+        for method, count in self.write_counts.items():
+            lines.append('  {}: {}'.format(method, count))
+        lines.append('-- {} read calls'.format(sum(self.read_counts.values())))
+        for method, count in self.read_counts.items():
+            lines.append('  {}: {}'.format(method, count))
+        return lines
+
+
+def _summarize_call(kwargs, args):
+    """
+    :param dict kwargs:
+    :param tuple args:
+    :return: str: arguments of an API call, with endpoint lists shortened to a route count
+    """
+    parts = []
+    for key in sorted(kwargs):
+        value = kwargs[key]
+        if key == 'endpoints':
+            parts.append('endpoints={} routes'.format(len(value) / 2))
+        elif key in ('commandInputs', 'parameterValues'):
+            parts.append('{}={} inputs'.format(key, len(value or [])))
+        elif key != 'reservationId':
+            parts.append('{}={}'.format(key, value))
+    parts.extend(str(arg) for arg in args[1:])  # args[0] is the reservation id
+    return ', '.join(parts)
+
+
+SHARED_CACHES = (ReservationSnapshot, ResourceIndex, CommandCatalog)  # per sandbox registries of cached reads
+
+
+class PlanningApi(object):
+    """
+    Stands in for sandbox.automation_api during planning.
+    Read-only methods (Get*/Find*/Search*) go to the real API, everything else is recorded and returns None
+    """
+    def __init__(self, api, plan):
+        """
+        :param CloudShellAPISession api: real API session
+        :param ExecutionPlan plan: where calls get recorded
+        """
+        self._api = api
+        self._plan = plan
+        self._lock = Lock()
+        self.stage = ''
+        self.recording = True
+
+    def __getattr__(self, name):
+        target = getattr(self._api, name)
+        if not callable(target):
+            return target
+
+        if name.startswith(READ_ONLY_API_PREFIXES):
+            def _read(*args, **kwargs):
+                if self.recording:
+                    with self._lock:
+                        self._plan.read_counts[name] = self._plan.read_counts.get(name, 0) + 1
+                return target(*args, **kwargs)
+            return _read
+
+        def _write(*args, **kwargs):
+            if self.recording:
+                with self._lock:
+                    self._plan.write_counts[name] = self._plan.write_counts.get(name, 0) + 1
+                    self._plan.calls.append(PlannedCall(self.stage, name, _summarize_call(kwargs, args)))
+            return None
+        return _write
+
+
+class _PlanningSandbox(object):
+    """
+    the real Sandbox, with automation_api swapped for a PlanningApi
+    """
+    def __init__(self, sandbox, api):
+        self._sandbox = sandbox
+        self.automation_api = api
+
+    def __getattr__(self, name):
+        return getattr(self._sandbox, name)
+
+
+class ExecutionPlanner(object):
+    """
+    Dry-runs plugin steps through the same code as a real run, so the plan can't drift from real behaviour:
+        planner = ExecutionPlanner(sandbox)
+        planner.add(SandboxOrchPlugins().connect_all_routes, None, 'connectivity')
+        for line in planner.plan().report():
+            print line
+    The sandbox's shared caches (SHARED_CACHES) are set aside while planning and put back afterwards, so the
+    caches built during planning, bound to the PlanningApi, are never used by the real run
+    """
+    def __init__(self, sandbox):
+        """
         :param Sandbox sandbox:
-        :param ServiceCommandHelper components:
-        :return: bool result:
         """
-        result = False
-        command_list = []
-        cmds = sandbox.automation_api.GetServiceCommands(components.service_name)
-        for cmd in cmds:
-            command_list.append(cmd.Name)
-
-        services = sandbox.components.services
-        for each in services:
-            # is this the service (droid) we're looking for?
-            if each.ServiceName == components.service_name:
-                # verify command is present
-                if components.command_name in command_list:
-                    params = self._build_command_params(components.parameters)
-
-                    try:
-                        if components.run_type == 'EXECUTE':
-                            sandbox.automation_api.ExecuteCommand(reservationId=sandbox.id,
-                                                                  targetName=components.service_name,
-                                                                  targetType='Service',
-                                                                  commandName=components.command_name,
-                                                                  commandInputs=params)
-                            result = True
-                        if components.run_type == 'ENQUEUE':
-                            sandbox.automation_api.EnqueueCommand(reservationId=sandbox.id,
-                                                                  targetName=components.command_name,
-                                                                  targetType='Service',
-                                                                  commandName=components.command_name,
-                                                                  commandInputs=params)
-                            result = True
-                    except Exception as err:
-                        sandbox.automation_api.WriteMessageToReservationOutput(reservationId=sandbox.id,
-                                                                               message=err.message)
+        self.sandbox = sandbox
+        self.steps = []
 
-        return result
+    def add(self, function, components, stage=''):
+        """
+        :param function function: plugin function, called as function(sandbox, components)
+        :param components: the components it would be registered with
+        :param str stage: label shown against the planned calls
+        :return: None
+        """
+        self.steps.append((function, components, stage or function.__name__))
+
+    def plan(self):
+        """
+        :return: ExecutionPlan
+        """
+        plan = ExecutionPlan()
+        api = PlanningApi(self.sandbox.automation_api, plan)
+        planning_sandbox = _PlanningSandbox(self.sandbox, api)
+        set_aside = self._set_aside_caches()
+        try:
+            for function, components, stage in self.steps:
+                api.stage = stage
+                function(planning_sandbox, components)
+        finally:
+            api.recording = False
+            self._restore_caches(set_aside, api)
+        return plan
+
+    def _set_aside_caches(self):
+        """
+        takes the sandbox's shared caches out of their registries, so planning builds its own
+        :return: dict: class -> the cache set aside, None where there was none
+        """
+        set_aside = {}
+        for cls in SHARED_CACHES:
+            with cls._registry_lock:
+                set_aside[cls] = cls._registry.pop(self.sandbox.id, None)
+        return set_aside
+
+    def _restore_caches(self, set_aside, api):
+        """
+        drops the caches built during planning and puts the real ones back
+        :param dict set_aside: from _set_aside_caches
+        :param PlanningApi api: the planning run's api
+        :return: None
+        """
+        for cls, cache in set_aside.items():
+            with cls._registry_lock:
+                cls._registry.pop(self.sandbox.id, None)
+                if cache is not None:
+                    cls._registry[self.sandbox.id] = cache
+        with ReservationOutputWriter._registry_lock:
+            ReservationOutputWriter._registry.pop((self.sandbox.id, id(api)), None)
+
+
+WORKFLOW_STAGES = OrderedDict([('_preparation_functions', 'Preparation'),
+                               ('_after_preparation', 'On preparation ended'),
+                               ('_provisioning_functions', 'Provisioning'),
+                               ('_after_provisioning', 'On provisioning ended'),
+                               ('_connectivity_functions', 'Connectivity'),
+                               ('_after_connectivity', 'On connectivity ended'),
+                               ('_configuration_functions', 'Configuration'),
+                               ('_after_configuration', 'On configuration ended'),
+                               ('_before_teardown', 'Before Teardown Started'),
+                               ('_teardown_functions', 'Teardown')])
+
+
+class ApiCallRecord(object):
+    __slots__ = ('method', 'stage', 'plugin', 'latency', 'payload', 'error')
+
+    def __init__(self, method, stage, plugin, latency, payload, error=''):
+        """
+        :param str method: API method name
+        :param str stage: orchestration stage the call was made in, '' for the orchestration itself
+        :param str plugin: name of the plugin function that made the call
+        :param float latency: seconds
+        :param int payload: approximate request size, in characters of argument values
+        :param str error: error message if the call raised
+        """
+        self.method = method
+        self.stage = stage
+        self.plugin = plugin
+        self.latency = latency
+        self.payload = payload
+        self.error = error
+
+
+def _payload_size(args, kwargs):
+    """
+    :return: int: rough size of the request, the length of every argument value (list items counted one by one)
+    """
+    size = 0
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, (list, tuple)):
+            size += sum(len(str(item)) for item in value)
+        else:
+            size += len(str(value))
+    return size
+
+
+def _percentile(sorted_values, percent):
+    """
+    :param list float sorted_values:
+    :param int percent: 0..100
+    :return: float: nearest-rank percentile
+    """
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class ApiCallRecorder(object):
+    """
+    Collects an ApiCallRecord for every call made through an InstrumentedApi and summarizes them per method,
+    stage and plugin:
+        recorder = ApiCallRecorder()
+        recorder.attach(sandbox)  # after every add_to_* registration
+        try:
+            sandbox.execute_setup()
+        finally:
+            recorder.finish(sandbox, 'setup')
+    """
+    def __init__(self):
+        self.records = []
+        self._lock = Lock()
+        self._api = None
+
+    def add(self, record):
+        """
+        :param ApiCallRecord record:
+        :return: None
+        """
+        with self._lock:
+            self.records.append(record)
+
+    def instrument(self, api):
+        """
+        :param CloudShellAPISession api:
+        :return: InstrumentedApi: api wrapper recording into this recorder
+        """
+        return InstrumentedApi(api, self)
+
+    def attach(self, sandbox):
+        """
+        swaps sandbox.automation_api for an InstrumentedApi and tags every registered workflow function
+        with its stage, so calls are attributed to stage & plugin
+        :param Sandbox sandbox:
+        :return: None
+        """
+        if not isinstance(sandbox.automation_api, InstrumentedApi):
+            self._api = sandbox.automation_api
+            sandbox.automation_api = self.instrument(sandbox.automation_api)
+
+        for attribute, stage in WORKFLOW_STAGES.items():
+            for workflow_object in getattr(sandbox.workflow, attribute, []):
+                workflow_object.function = self._tag(workflow_object.function, stage)
+
+    @staticmethod
+    def _tag(function, stage):
+        """
+        :param function function: workflow function
+        :param str stage:
+        :return: function: same function, running under its stage / plugin call context
+        """
+        tagged = _in_call_context((stage, function.__name__), function)
+        return wraps(function)(tagged)
+
+    def summary(self, top=10):
+        """
+        :param int top: how many methods to list in top_methods
+        :return: dict: totals, per method (count, errors, total, p50, p95), per stage and per plugin
+        """
+        with self._lock:
+            records = list(self.records)
+
+        methods = {}
+        stages = OrderedDict()
+        plugins = OrderedDict()
+        for record in records:
+            methods.setdefault(record.method, []).append(record)
+            stage = stages.setdefault(record.stage or 'orchestration', {'count': 0, 'total': 0.0})
+            stage['count'] += 1
+            stage['total'] += record.latency
+            plugin = plugins.setdefault(record.plugin or 'orchestration', {'count': 0, 'total': 0.0})
+            plugin['count'] += 1
+            plugin['total'] += record.latency
+
+        per_method = {}
+        for method, method_records in methods.items():
+            latencies = sorted(record.latency for record in method_records)
+            per_method[method] = {'count': len(latencies),
+                                  'errors': sum(1 for record in method_records if record.error),
+                                  'total': round(sum(latencies), 4),
+                                  'p50': round(_percentile(latencies, 50), 4),
+                                  'p95': round(_percentile(latencies, 95), 4),
+                                  'payload': sum(record.payload for record in method_records)}
+
+        for totals in list(stages.values()) + list(plugins.values()):
+            totals['total'] = round(totals['total'], 4)
+
+        top_methods = sorted(per_method, key=lambda name: per_method[name]['total'], reverse=True)[:top]
+        return {'calls': len(records),
+                'total': round(sum(record.latency for record in records), 4),
+                'top_methods': top_methods,
+                'methods': per_method,
+                'stages': stages,
+                'plugins': plugins}
+
+    def summary_lines(self, top=5):
+        """
+        :param int top: how many methods to list
+        :return: list str: compact report for the reservation output
+        """
+        summary = self.summary(top)
+        lines = ['API calls: {} in {:.1f}s'.format(summary['calls'], summary['total'])]
+        for method in summary['top_methods']:
+            stats = summary['methods'][method]
+            lines.append('  {}: {} calls, {:.1f}s total, p50 {:.3f}s, p95 {:.3f}s{}'.format(
+                method, stats['count'], stats['total'], stats['p50'], stats['p95'],
+                ', {} errors'.format(stats['errors']) if stats['errors'] else ''))
+        for stage, stats in summary['stages'].items():
+            lines.append('  [{}] {} calls, {:.1f}s'.format(stage, stats['count'], stats['total']))
+        return lines
+
+    def finish(self, sandbox, label='setup', path=None):
+        """
+        writes the summary to the reservation output and to a local JSON file
+        :param Sandbox sandbox:
+        :param str label: 'setup' / 'teardown', used in the file name
+        :param str path: JSON file, defaults to api_calls_<label>_<sandbox id>.json in the temp directory
+        :return: str: path of the JSON file
+        """
+        if path is None:
+            path = os.path.join(gettempdir(), 'api_calls_{}_{}.json'.format(label, sandbox.id))
+        with open(path, 'w') as f:
+            f.write(json_dumps(self.summary(), indent=2, sort_keys=True))
+
+        api = self._api or sandbox.automation_api  # the summary itself isn't recorded
+        try:
+            api.WriteMessageToReservationOutput(reservationId=sandbox.id, message='\n'.join(self.summary_lines()))
+        except Exception:
+            pass  # the summary is best effort, the JSON file still has it
+        return path
+
+
+class InstrumentedApi(object):
+    """
+    Wraps a CloudShellAPISession (or sandbox.automation_api), recording each call's latency, payload size and
+    error together with the stage / plugin it was made for
+    """
+    def __init__(self, api, recorder):
+        """
+        :param CloudShellAPISession api:
+        :param ApiCallRecorder recorder:
+        """
+        self._api = api
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        target = getattr(self._api, name)
+        if not callable(target):
+            return target
+
+        def _call(*args, **kwargs):
+            stage, plugin = _get_call_context()
+            start = time()
+            error = ''
+            try:
+                return target(*args, **kwargs)
+            except Exception as err:
+                error = getattr(err, 'message', '') or str(err)
+                raise
+            finally:
+                self._recorder.add(ApiCallRecord(name, stage, plugin, time() - start, _payload_size(args, kwargs),
+                                                 error))
+        return _call